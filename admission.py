@@ -0,0 +1,307 @@
+"""
+Request admission control
+
+Two checks run before a request reaches its route:
+
+1. Rate limits: RATE_LIMITS gives the auth and task update endpoints token
+   buckets, keyed by the client address ("ip") or by the user whose
+   session token the request carries ("user"; requests without a valid
+   one are keyed by their address). A bucket holds up to burst tokens
+   and refills at rate tokens per second; a request takes one token, and
+   a request finding its bucket empty is answered 429 with a Retry-After
+   of the seconds until a token is back.
+2. Write concurrency: at most MAX_WRITES_IN_FLIGHT POST/PUT/PATCH/DELETE
+   requests run at once in a process (SQLite has a single writer, so more
+   only queue on its lock and slow everyone down); the rest are answered
+   503 with Retry-After right away instead of waiting.
+
+Buckets live in a backend. The default MemoryBackend keeps them in this
+process, split over SHARDS dicts that each have their own lock so
+concurrent requests rarely contend, and forgets the least recently used
+keys beyond MAX_KEYS (a forgotten key starts again with a full bucket). A
+backend shared by every process can be added to BACKENDS: it only needs
+take(key, rate, burst, now), give_back(key, burst), clear() and stats().
+Limits are therefore per process with the memory backend.
+
+Decisions and rejections are counted and exported with the app metrics.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, request
+from werkzeug.local import LocalProxy
+
+from instrumentation import dumps
+import users_dao
+
+SHARDS = 16
+MAX_KEYS = 100000
+MAX_WRITES_IN_FLIGHT = 16
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+# endpoint (blueprint.view) -> [(scope, tokens per second, burst)]
+RATE_LIMITS = {
+    "auth.register_account": [("ip", 0.1, 10)],
+    "auth.login": [("ip", 1, 10)],
+    "auth.update_session": [("ip", 1, 10)],
+    "tasks.update_task": [("user", 10, 50), ("ip", 50, 100)],
+    "tasks.update_tasks": [("user", 1, 10), ("ip", 5, 20)],
+}
+
+
+class MemoryBackend(object):
+    """
+    Token buckets kept in this process, sharded by key
+    """
+
+    def __init__(self, shards=SHARDS, max_keys=MAX_KEYS):
+        """
+        Initializes an empty MemoryBackend
+        """
+        self._shards = [(OrderedDict(), threading.Lock()) for _ in range(shards)]
+        self._max_per_shard = max(1, max_keys // shards)
+        self.evicted = 0
+
+    def take(self, key, rate, burst, now):
+        """
+        Takes a token from the bucket of key; returns 0 if there was one,
+        else the seconds until there will be
+        """
+        buckets, lock = self._shards[hash(key) % len(self._shards)]
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = [burst, now]
+                buckets[key] = bucket
+                if len(buckets) > self._max_per_shard:
+                    buckets.popitem(last=False)
+                    self.evicted = self.evicted + 1
+            else:
+                buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] = bucket[0] - 1
+                return 0
+            return (1 - bucket[0]) / rate
+
+    def give_back(self, key, burst):
+        """
+        Puts back a token taken from the bucket of key, up to burst
+        """
+        buckets, lock = self._shards[hash(key) % len(self._shards)]
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(burst, bucket[0] + 1)
+
+    def clear(self):
+        """
+        Forgets every bucket
+        """
+        for buckets, lock in self._shards:
+            with lock:
+                buckets.clear()
+
+    def stats(self):
+        """
+        Returns the number of buckets held and evicted
+        """
+        return {"keys": sum(len(buckets) for buckets, _ in self._shards), "evicted": self.evicted}
+
+
+# RATE_LIMIT_BACKEND name -> backend class, called with RATE_LIMIT_BACKEND_OPTIONS
+BACKENDS = {
+    "memory": MemoryBackend,
+}
+
+
+class RateLimiter(object):
+    """
+    Token bucket rate limits per endpoint
+    """
+
+    def __init__(self, rules=RATE_LIMITS, backend=None, enabled=True):
+        """
+        Initializes a RateLimiter
+        """
+        self.configure(rules, backend, enabled)
+
+    def init_app(self, app):
+        """
+        Makes this the rate_limiter of app
+        """
+        app.extensions["rate_limiter"] = self
+
+    def configure(self, rules=RATE_LIMITS, backend=None, enabled=True):
+        """
+        Sets the limits and the backend (a new MemoryBackend by default),
+        and resets the counters
+        """
+        self.rules = rules
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.enabled = enabled
+        self.allowed = 0
+        self.limited = 0
+        self._lock = threading.Lock()
+
+    def check(self, endpoint, identities):
+        """
+        Takes a token from every bucket of the endpoint's limits
+
+        identities maps a scope to the client's key for it; limits whose
+        scope has no key are skipped. Returns 0 if the request is admitted,
+        else the seconds until it would be; a rejected request gives back
+        the tokens it took from the buckets that admitted it
+        """
+        rules = self.rules.get(endpoint)
+        if not rules or not self.enabled:
+            return 0
+        now = time.monotonic()
+        taken = []
+        for scope, rate, burst in rules:
+            identity = identities.get(scope)
+            if identity is None:
+                continue
+            key = (endpoint, scope, identity)
+            wait = self.backend.take(key, rate, burst, now)
+            if wait:
+                for key, burst in taken:
+                    self.backend.give_back(key, burst)
+                with self._lock:
+                    self.limited = self.limited + 1
+                return wait
+            taken.append((key, burst))
+        with self._lock:
+            self.allowed = self.allowed + 1
+        return 0
+
+    def stats(self):
+        """
+        Returns the decision counters and the backend's numbers
+        """
+        with self._lock:
+            stats = {"allowed": self.allowed, "limited": self.limited}
+        stats.update(self.backend.stats())
+        return stats
+
+
+class ConcurrencyLimiter(object):
+    """
+    Caps the number of requests running at once, without waiting
+    """
+
+    def __init__(self, limit=MAX_WRITES_IN_FLIGHT):
+        """
+        Initializes a ConcurrencyLimiter
+        """
+        self.configure(limit)
+
+    def init_app(self, app):
+        """
+        Makes this the write_limiter of app
+        """
+        app.extensions["write_limiter"] = self
+
+    def configure(self, limit=MAX_WRITES_IN_FLIGHT):
+        """
+        Sets the cap (0 for none) and resets the counters
+        """
+        self.limit = limit
+        self.in_flight = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a slot; returns false if every slot is taken
+        """
+        with self._lock:
+            if self.limit and self.in_flight >= self.limit:
+                self.shed = self.shed + 1
+                return False
+            self.in_flight = self.in_flight + 1
+            return True
+
+    def release(self):
+        """
+        Gives back a slot taken by acquire
+        """
+        with self._lock:
+            self.in_flight = self.in_flight - 1
+
+    def stats(self):
+        """
+        Returns the slots in use, the cap and the requests shed
+        """
+        return {"in_flight": self.in_flight, "limit": self.limit, "shed": self.shed}
+
+
+# the RateLimiter and ConcurrencyLimiter of the current app (see their init_app)
+rate_limiter = LocalProxy(lambda: current_app.extensions["rate_limiter"])
+write_limiter = LocalProxy(lambda: current_app.extensions["write_limiter"])
+
+
+def make_backend(name, options):
+    """
+    Returns a new backend of the named kind
+    """
+    if name not in BACKENDS:
+        raise ValueError("Unknown rate limit backend: %s" % name)
+    return BACKENDS[name](**options)
+
+
+def _session_user():
+    """
+    Returns the id of the user whose session token the request carries,
+    or the client address if it carries no valid one
+    """
+    auth_header = request.headers.get("Authorization")
+    if auth_header:
+        user_id = users_dao.get_user_id_by_session_token(auth_header.replace("Bearer", "").strip())
+        if user_id is not None:
+            return user_id
+    return request.remote_addr
+
+
+def _before_request():
+    """
+    Answers 429 or 503 instead of running the route when the request is
+    over its rate limit or every write slot is taken
+    """
+    endpoint = request.endpoint
+    if endpoint is None:
+        return None
+    rules = rate_limiter.rules.get(endpoint)
+    if rules and rate_limiter.enabled:
+        identities = {"ip": request.remote_addr}
+        if any(scope == "user" for scope, _, _ in rules):
+            identities["user"] = _session_user()
+        wait = rate_limiter.check(endpoint, identities)
+        if wait:
+            return dumps({"error": "Too many requests, try again later"}), 429, {
+                "Retry-After": str(max(1, int(math.ceil(wait))))}
+    if request.method in WRITE_METHODS:
+        if not write_limiter.acquire():
+            return dumps({"error": "Server busy, try again shortly"}), 503, {"Retry-After": "1"}
+        g.write_slot = True
+    return None
+
+
+def _teardown_request(exc):
+    """
+    Gives back the request's write slot
+    """
+    if g.pop("write_slot", False):
+        write_limiter.release()
+
+
+def init_app(app):
+    """
+    Runs the admission checks before every request of app
+    """
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
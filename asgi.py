@@ -0,0 +1,317 @@
+"""
+ASGI entry point for the app
+
+Serves the read-heavy pod and leaderboard routes natively on an asyncio
+SQLAlchemy engine, so a single worker can keep many of those requests
+waiting on the database at once. Every other request is handed to the
+Flask app built by app.create_app() through a WSGI bridge running on a
+thread pool, so the full API is available from one process.
+
+The native routes build their statements from the same queries, cache
+keys and payload helpers as the Flask routes and return byte-identical
+responses (including ETags, sharing the app's response cache).
+
+Requires SQLAlchemy 1.4+ with an async driver for the database
+(aiosqlite for SQLite) and an ASGI server, e.g.
+    POD_SERVER=asgi python app.py
+    uvicorn asgi:application --workers 1
+"""
+
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_etags
+from werkzeug.routing import RequestRedirect
+
+from app import create_app
+from db import db, set_sqlite_pragmas, Pod, Task
+import http_cache
+import pagination
+from pods_routes import leaderboard_args, leaderboard_payload
+import stats_dao
+
+# sync driver name -> async driver used for the native routes
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+CONTENT_TYPE = b"text/html; charset=utf-8"
+
+
+def async_database_uri(flask_app):
+    """
+    Returns the ASYNC_DATABASE_URI config value, or the URL of the app's
+    engine with its driver swapped for the async one
+    """
+    if flask_app.config.get("ASYNC_DATABASE_URI"):
+        return flask_app.config["ASYNC_DATABASE_URI"]
+    with flask_app.app_context():
+        url = db.engine.url
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError("No async driver known for %s, set ASYNC_DATABASE_URL" % backend)
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class Request(object):
+    """
+    The parts of an ASGI HTTP request the native routes read
+    """
+
+    def __init__(self, scope):
+        """
+        Initializes a Request from an ASGI scope
+        """
+        query_string = scope.get("query_string", b"").decode("latin-1")
+        self.args = MultiDict(parse_qsl(query_string, keep_blank_values=True))
+        self.headers = dict(
+            (name.decode("latin-1").lower(), value.decode("latin-1"))
+            for name, value in scope.get("headers", [])
+        )
+
+
+class WSGIBridge(object):
+    """
+    Runs a WSGI app for ASGI HTTP requests on a thread pool
+
+    The whole WSGI call, including iterating a streamed body, runs on one
+    pool thread, which is what Flask's request contexts expect
+    """
+
+    def __init__(self, wsgi_app, threads):
+        """
+        Initializes a WSGIBridge with a pool of the given number of threads
+        """
+        self.wsgi_app = wsgi_app
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+
+    @staticmethod
+    def environ(scope, body):
+        """
+        Returns the WSGI environ of an ASGI HTTP scope
+        """
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_TYPE":
+                environ["CONTENT_TYPE"] = value
+            elif name != "CONTENT_LENGTH":
+                key = "HTTP_" + name
+                environ[key] = environ[key] + "," + value if key in environ else value
+        return environ
+
+    async def __call__(self, scope, receive, send):
+        """
+        Handles one ASGI HTTP request with the WSGI app
+        """
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            body = body + message.get("body", b"")
+            more = message.get("more_body", False)
+        loop = asyncio.get_running_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                response["start"] = {
+                    "type": "http.response.start",
+                    "status": int(status.split(" ", 1)[0]),
+                    "headers": [
+                        (name.lower().encode("latin-1"), value.encode("latin-1"))
+                        for name, value in headers
+                    ],
+                }
+
+            def send_start():
+                if "start" in response:
+                    send_from_thread(response.pop("start"))
+
+            chunks = self.wsgi_app(self.environ(scope, body), start_response)
+            try:
+                for chunk in chunks:
+                    if chunk:
+                        send_start()
+                        send_from_thread({"type": "http.response.body", "body": chunk, "more_body": True})
+                send_start()
+                send_from_thread({"type": "http.response.body", "body": b""})
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+
+        await loop.run_in_executor(self.pool, run)
+
+
+class PodASGI(object):
+    """
+    ASGI app serving the native async routes and bridging the rest to Flask
+    """
+
+    def __init__(self, flask_app):
+        """
+        Initializes a PodASGI for the Flask app; the async engine is
+        created on startup
+        """
+        self.app = flask_app
+        # the app's own encoder and cache, used outside its context here
+        self.encode = flask_app.extensions["json_encoder"]
+        self.response_cache = flask_app.extensions["response_cache"]
+        self.engine = None
+        self.bridge = WSGIBridge(flask_app, flask_app.config["ASGI_THREADS"])
+        self.routes = {
+            "pods.get_pod": self.get_pod,
+            "pods.pod_leaderboard": self.pod_leaderboard,
+        }
+
+    def startup(self):
+        """
+        Creates the async engine
+        """
+        if self.engine is None:
+            self.engine = create_async_engine(
+                async_database_uri(self.app), **self.app.config["ASYNC_ENGINE_OPTIONS"])
+            set_sqlite_pragmas(self.engine.sync_engine, self.app.config["SQLITE_PRAGMAS"])
+
+    async def shutdown(self):
+        """
+        Closes the async engine's connections and the WSGI thread pool
+        """
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+        self.bridge.pool.shutdown(wait=False)
+
+    def statements(self, build, *args):
+        """
+        Returns build(*args), called in an app context so the Flask-SQLAlchemy
+        queries it builds have a session; nothing is executed
+        """
+        with self.app.app_context():
+            return build(*args)
+
+    async def __call__(self, scope, receive, send):
+        """
+        Handles one ASGI connection
+        """
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    self.startup()
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await self.shutdown()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        try:
+            endpoint, values = self.app.url_map.bind("").match(scope["path"], scope["method"])
+        except (HTTPException, RequestRedirect):
+            endpoint, values = None, None
+        route = self.routes.get(endpoint)
+        if route is None:
+            await self.bridge(scope, receive, send)
+            return
+        self.startup()
+        status, body, headers = await route(Request(scope), **values)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        headers = [(b"content-type", CONTENT_TYPE), (b"content-length", str(len(body)).encode("latin-1"))] + [
+            (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()
+        ]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def get_pod(self, request, pod_id):
+        """
+        Async version of pods_routes.get_pod
+        """
+        try:
+            task_limit, task_cursor = self.statements(pagination.page_args, request.args, "task_")
+        except ValueError as e:
+            return 400, self.encode({"error": str(e)}), {}
+
+        def pod_statement():
+            return Pod.row_query().add_columns(Pod.version).filter(Pod.id == pod_id).statement
+
+        def tasks_statement():
+            query = Task.row_query().filter(Task.pod_id == pod_id)
+            return pagination.keyset_query(query, Task.id, task_limit, task_cursor).statement
+
+        async with self.engine.connect() as connection:
+            pod = (await connection.execute(self.statements(pod_statement))).first()
+            if pod is None:
+                return 404, self.encode({"error": "pod not found"}), {}
+            key = ("pod", pod.id, pod.version, task_limit, task_cursor)
+            tag = http_cache.etag_for(key)
+            headers = {"ETag": '"%s"' % tag}
+            if parse_etags(request.headers.get("if-none-match")).contains(tag):
+                return 304, b"", headers
+            body = self.response_cache.get(key)
+            if body is None:
+                rows = (await connection.execute(self.statements(tasks_statement))).all()
+                tasks, tasks_next_cursor = pagination.split_page(rows, task_limit)
+                body = self.encode(Pod.serialize_row(
+                    pod, [Task.serialize_row(t) for t in tasks], tasks_next_cursor))
+                self.response_cache.put(key, body)
+        return 200, body, headers
+
+    async def pod_leaderboard(self, request, pod_id):
+        """
+        Async version of pods_routes.pod_leaderboard
+        """
+        try:
+            n, ranks = self.statements(leaderboard_args, request.args)
+        except ValueError as e:
+            return 400, self.encode({"error": str(e)}), {}
+
+        def build():
+            return (
+                Pod.row_query().filter(Pod.id == pod_id).statement,
+                stats_dao.pod_leaderboard_query(pod_id, n).statement,
+            )
+
+        pod_statement, leaderboard_statement = self.statements(build)
+        async with self.engine.connect() as connection:
+            if (await connection.execute(pod_statement)).first() is None:
+                return 404, self.encode({"error": "pod not found"}), {}
+            rows = (await connection.execute(leaderboard_statement)).all()
+        leaderboard = stats_dao.rank_leaderboard(rows)
+        return 200, self.encode(leaderboard_payload(leaderboard, n, ranks)), {}
+
+
+application = PodASGI(create_app())
@@ -0,0 +1,150 @@
+"""
+Authentication routes: registration, login and sessions
+"""
+
+import json
+
+from flask import Blueprint, current_app, request
+
+from instrumentation import dumps
+import users_dao
+
+blueprint = Blueprint("auth", __name__)
+
+
+def extract_token(request):
+    """
+    Helper function that extracts the token from the header of a request
+    """
+    auth_header = request.headers.get("Authorization")
+    
+    if auth_header is None:
+        return False, dumps({"error": "Missing authorization header"}),404
+    
+    bearer_token = auth_header.replace("Bearer","").strip()
+
+    return True, bearer_token
+
+
+@blueprint.route("/register/", methods=["POST"])
+def register_account():
+    """
+    Endpoint for registering a new user
+    """
+    body = json.loads(request.data)
+    username = body.get("username")
+    password = body.get("password")
+    leader = body.get("leader")
+    tasks_completed = body.get("tasks_completed")
+
+    if username is None or password is None or leader is None or tasks_completed:
+        return dumps({"error": "Missing username or password or leader or tasks_completed"}),404
+
+    if not isinstance(password, str):
+        return dumps({"error": "password must be a string"}),400
+    
+    if leader != 0:
+        return dumps({"error": "Can only be a member upon registration. Join a pod to be a leader!"})
+    
+    if tasks_completed != 0:
+        return dumps({"error": "Don't cheat, everyone starts with 0!"})
+    
+    was_successful, user = users_dao.create_user(username,password,leader)
+
+    if not was_successful:
+        return dumps({"error": "User already exists"}),404
+    
+    session = users_dao.create_session(user.id, current_app.config["SESSION_LIFETIME"], current_app.config["SESSION_RENEW_WINDOW"])
+    return dumps(
+        {
+            "session_token": session.session_token, 
+            "session_expiration": str(session.expires_at),
+            "update_token": session.update_token
+        }),201
+
+@blueprint.route("/login/", methods=["POST"])
+def login():
+    """
+    Endpoint for logging in a user
+    """
+    body = json.loads(request.data)
+    username = body.get("username")
+    password = body.get("password")
+
+    if username is None or password is None:
+        return dumps({"error": "Missing username or password"}),400
+
+    if not isinstance(password, str):
+        return dumps({"error": "password must be a string"}),400
+    
+    was_successful, user = users_dao.verify_credentials(username,password)
+
+    if not was_successful:
+        return dumps({"error": "Incorrect username or password"}),401
+    
+    session = users_dao.create_session(user.id, current_app.config["SESSION_LIFETIME"], current_app.config["SESSION_RENEW_WINDOW"])
+    return dumps(
+        {
+            "session_token": session.session_token,
+            "session_expiration": str(session.expires_at),
+            "update_token": session.update_token,
+            "login": "successful"
+
+        }),201
+
+
+@blueprint.route("/session/", methods=["POST"])
+def update_session():
+    """
+    Endpoint for updating a user's session
+    """
+    was_successful, update_token = extract_token(request)
+
+    if not was_successful:
+        return update_token
+    
+    try:
+        session = users_dao.renew_session(update_token, current_app.config["SESSION_LIFETIME"], current_app.config["SESSION_RENEW_WINDOW"])
+    except Exception as e:
+        return dumps(f"Invalid update token: {str(e)}"),404
+
+    return dumps(
+        {
+            "session_token": session.session_token,
+            "session_expiration": str(session.expires_at),
+            "update_token": session.update_token
+        }),201
+
+@blueprint.route("/secret/", methods=["GET"])
+def secret_message():
+    """
+    Endpoint for verifying a session token and returning a secret message
+    """
+    was_successful, session_token = extract_token(request)
+
+    if not was_successful:
+        return session_token
+    
+    if users_dao.get_user_id_by_session_token(session_token) is None:
+        return dumps({"error": "Invalid session token"}),404
+    
+    return dumps(
+        {"message": "You have sucessfully implemented sessions!"}),201
+    
+
+@blueprint.route("/logout/", methods=["POST"])
+def logout():
+    """
+    Endpoint for logging out a user 
+    """
+    was_successful, session_token = extract_token(request)
+
+    if not was_successful:
+        return session_token
+    
+    if not users_dao.end_session(session_token):
+        return dumps({"error": "Invalid session token"}),404
+
+    return dumps({
+        "message": "You have successfully logged out"
+    }),201
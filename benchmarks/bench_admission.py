@@ -0,0 +1,87 @@
+"""
+Micro-benchmark of the admission checks
+
+Measures, without the app or a database,
+1. check: RateLimiter.check over --keys client addresses with limits
+   loose enough that every request is admitted, from 1 and from
+   --threads threads, for 1 shard and for the default SHARDS;
+2. limited: the same check for a client whose bucket is empty;
+3. write_slot: ConcurrencyLimiter.acquire + release.
+
+Each reports the mean cost of one decision (microseconds) and, for the
+threaded runs, the decisions per second of all threads together.
+
+Usage (from the repository root):
+    python benchmarks/bench_admission.py --decisions 1000000 --threads 8
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import admission  # noqa: E402
+
+RULES = {"login": [("ip", 1e9, 1e9)], "limited": [("ip", 1e-9, 1)]}
+
+
+def run(limiter, identities, decisions, threads, endpoint="login"):
+    """
+    Runs decisions checks spread over threads; returns (us per decision, decisions/s)
+    """
+    per_thread = decisions // threads
+
+    def work():
+        check = limiter.check
+        for i in range(per_thread):
+            check(endpoint, identities[i % len(identities)])
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    t0 = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - t0
+    total = per_thread * threads
+    return elapsed / total * 1e6, total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--decisions", type=int, default=1000000)
+    parser.add_argument("--keys", type=int, default=10000, help="distinct client addresses")
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    random.seed(1234)
+    identities = [{"ip": "10.%d.%d.%d" % (random.randrange(256), random.randrange(256), random.randrange(256))}
+                  for _ in range(args.keys)]
+    for shards in (1, admission.SHARDS):
+        for threads in (1, args.threads):
+            limiter = admission.RateLimiter(RULES, admission.MemoryBackend(shards=shards))
+            cost, rate = run(limiter, identities, args.decisions, threads)
+            print("check      shards %2d threads %2d: %6.2f us/decision, %9.0f decisions/s" % (
+                shards, threads, cost, rate))
+    limiter = admission.RateLimiter(RULES)
+    limiter.check("limited", identities[0])
+    cost, rate = run(limiter, identities[:1], args.decisions, 1, endpoint="limited")
+    print("limited    shards %2d threads  1: %6.2f us/decision (%d limited)" % (
+        admission.SHARDS, cost, limiter.limited))
+
+    slots = admission.ConcurrencyLimiter(limit=args.threads)
+    t0 = time.perf_counter()
+    for _ in range(args.decisions):
+        slots.acquire()
+        slots.release()
+    print("write_slot                      : %6.2f us/acquire+release" % (
+        (time.perf_counter() - t0) / args.decisions * 1e6))
+
+
+if __name__ == "__main__":
+    main()
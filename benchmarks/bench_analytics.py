@@ -0,0 +1,165 @@
+"""
+Benchmark of the analytics rollups at millions of tasks
+
+Seeds a fresh SQLite database with --tasks tasks (2M by default) spread
+over --pods pods and the last --days days, about half of them done, and
+runs the backfill_rollups job over them, reporting its throughput
+(tasks/s). Then, for a sample of pods, measures
+1. trend_day: GET /api/pod/<id>/analytics/ over 30 days;
+2. trend_hour: the same over 7 x 24 hours;
+3. leaderboard: GET /api/pod/<id>/analytics/leaderboard/ over 7 days;
+4. scan_day / scan_leaderboard: the same answers computed with GROUP BY
+   over the pod's tasks, which is what each report cost before the rollups;
+5. update: POST /api/task/update/<id>/, which now also updates 4 rollup rows.
+
+The response cache is cleared before every request. Each reports
+p50/p95/p99 latency (ms).
+
+Usage (from the repository root):
+    python benchmarks/bench_analytics.py --tasks 2000000 --pods 200
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_join_codes import timed  # noqa: E402
+
+SCAN_DAY = """
+    SELECT strftime('%Y-%m-%d', created_at), COUNT(*) FROM tasks
+    WHERE pod_id = :pod_id AND created_at >= :start GROUP BY 1
+"""
+SCAN_DAY_COMPLETED = """
+    SELECT strftime('%Y-%m-%d', completed_at), COUNT(*) FROM tasks
+    WHERE pod_id = :pod_id AND status = 1 AND completed_at >= :start GROUP BY 1
+"""
+SCAN_LEADERBOARD = """
+    SELECT users.username, COUNT(*) AS n FROM tasks JOIN users ON users.id = tasks.completer_id
+    WHERE tasks.pod_id = :pod_id AND tasks.status = 1 AND tasks.completed_at >= :start
+      AND users.podID = :pod_id
+    GROUP BY users.id ORDER BY n DESC, users.id DESC LIMIT 10
+"""
+
+
+def insert_tasks(db, Task, seeded, users_per_pod, count, days, chunk=50000):
+    """
+    Inserts count tasks with timestamps in the last days days, round robin
+    over the seeded pods
+    """
+    now = datetime.datetime.now()
+    span = days * 86400
+    pods = seeded.pod_ids
+    members = {pod_id: [seeded.leader_ids[i]] + seeded.member_ids[i * (users_per_pod - 1):(i + 1) * (users_per_pod - 1)]
+               for i, pod_id in enumerate(pods)}
+    rows = []
+    for n in range(count):
+        pod_id = pods[n % len(pods)]
+        created_at = now - datetime.timedelta(seconds=random.randrange(span))
+        done = random.random() < 0.5
+        completed_at = None
+        if done:
+            completed_at = created_at + datetime.timedelta(seconds=random.randrange(int((now - created_at).total_seconds()) + 1))
+        rows.append({"description": "task %d" % n, "status": done, "pod_id": pod_id,
+                     "creator_id": random.choice(members[pod_id]),
+                     "completer_id": random.choice(members[pod_id]) if done else None,
+                     "created_at": created_at, "completed_at": completed_at})
+        if len(rows) == chunk:
+            db.session.execute(Task.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(Task.__table__.insert(), rows)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tasks", type=int, default=2000000, help="tasks to seed")
+    parser.add_argument("--pods", type=int, default=200, help="pods to spread them over")
+    parser.add_argument("--users", type=int, default=20, help="users per pod")
+    parser.add_argument("--days", type=int, default=90, help="days the timestamps span")
+    parser.add_argument("--requests", type=int, default=200, help="requests per measurement")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="poductivity-bench-")
+    os.environ["DATABASE_URL"] = "sqlite:///%s" % os.path.join(workdir, "bench.db")
+    os.environ.setdefault("POD_ENV", "production")
+
+    from db import db, Task
+    import http_cache
+    from jobs import job_queue
+    import seed
+    import stats_dao
+
+    app = seed.create_app()
+
+    app.extensions["password_hasher"].configure(rounds=4)
+    app.extensions["rate_limiter"].configure(enabled=False)
+    app.extensions["job_queue"].configure(workers=0, chunk_size=app.config["JOB_CHUNK_SIZE"])
+    random.seed(1234)
+    client = app.test_client()
+    results = {}
+    with app.app_context():
+        seeded = seed.seed(args.pods, args.users, 0)
+        t0 = time.perf_counter()
+        insert_tasks(db, Task, seeded, args.users, args.tasks, args.days)
+        stats_dao.rebuild_counters()
+        print("seeded %d tasks in %.1fs" % (args.tasks, time.perf_counter() - t0))
+
+        job = job_queue.enqueue("backfill_rollups")
+        t0 = time.perf_counter()
+        job_queue.run_next()
+        elapsed = time.perf_counter() - t0
+        db.session.refresh(job)
+        print("backfill_rollups job: %d tasks in %.1fs (%.0f tasks/s), %s" % (
+            args.tasks, elapsed, args.tasks / elapsed, job.result))
+        results["backfill"] = {"tasks": args.tasks, "seconds": elapsed, "result": json.loads(job.result)}
+
+        pods = [random.choice(seeded.pod_ids) for _ in range(args.requests)]
+        now = datetime.datetime.now()
+        month, week = now - datetime.timedelta(days=30), now - datetime.timedelta(days=7)
+
+        def get(url):
+            http_cache.response_cache.clear()
+            response = client.get(url)
+            assert response.status_code == 200, response.data
+
+        def scan(pod_id, start, *queries):
+            for query in queries:
+                db.session.execute(db.text(query), {"pod_id": pod_id, "start": start}).fetchall()
+
+        results["trend_day"] = timed(lambda p=p: get("/api/pod/%d/analytics/?buckets=30" % p) for p in pods)
+        results["trend_hour"] = timed(
+            lambda p=p: get("/api/pod/%d/analytics/?period=hour&buckets=168" % p) for p in pods)
+        results["leaderboard"] = timed(
+            lambda p=p: get("/api/pod/%d/analytics/leaderboard/?buckets=7" % p) for p in pods)
+        results["scan_day"] = timed(lambda p=p: scan(p, month, SCAN_DAY, SCAN_DAY_COMPLETED) for p in pods)
+        results["scan_leaderboard"] = timed(lambda p=p: scan(p, week, SCAN_LEADERBOARD) for p in pods)
+
+        task_ids = [task_id for task_id, in db.session.query(Task.id).filter(Task.status == False).limit(args.requests)]
+        completer = seeded.leader_ids[0]
+
+        def update(task_id):
+            response = client.post("/api/task/update/%d/" % completer,
+                                   data=json.dumps({"task_id": task_id, "done": True}))
+            assert response.status_code == 201, response.data
+
+        results["update"] = timed(lambda t=t: update(t) for t in task_ids)
+        for name in ("trend_day", "trend_hour", "leaderboard", "scan_day", "scan_leaderboard", "update"):
+            print("    %-16s p50 %8.3f  p95 %8.3f  p99 %8.3f ms" % ((name,) + results[name]))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
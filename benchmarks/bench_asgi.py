@@ -0,0 +1,190 @@
+"""
+Benchmark of the ASGI entry point against the sync WSGI path
+
+Seeds a fresh SQLite database, then serves the app twice on local HTTP
+servers: app.py on the threaded Werkzeug server (sync) and asgi.py on
+uvicorn with a single worker (async). The read-heavy routes are driven
+from a pool of concurrent clients at each concurrency level:
+    pod_get          GET /api/pod/<id>/ (body cache warm)
+    pod_get_uncached GET /api/pod/<id>/?task_cursor=<n> (new cache key each time)
+    pod_leaderboard  GET /api/pod/leaderboard/<id>/?n=10
+
+Reports throughput, p50/p95/p99 latency (ms) and queries per request per
+route, server and concurrency.
+
+Usage (from the repository root, needs aiosqlite and uvicorn):
+    python benchmarks/bench_asgi.py --pods 200 --users-per-pod 20 \\
+        --tasks-per-pod 200 --requests 500 --concurrency 1,8,32
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_routes import QueryCounter, summarize  # noqa: E402
+
+
+def routes(seeded):
+    """
+    Returns (name, path) builders for the benchmarked routes; path is a
+    function of the request number
+    """
+    pods = seeded.pod_ids
+    tasks = seeded.task_ids
+    return [
+        ("pod_get", lambda i: "/api/pod/%d/" % pods[i % len(pods)]),
+        ("pod_get_uncached", lambda i: "/api/pod/%d/?task_cursor=%d" % (
+            pods[i % len(pods)], tasks[i % len(tasks)])),
+        ("pod_leaderboard", lambda i: "/api/pod/leaderboard/%d/?n=10" % pods[i % len(pods)]),
+    ]
+
+
+def free_port():
+    """
+    Returns a local TCP port nobody is listening on
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_sync(app):
+    """
+    Serves the Flask app on the threaded Werkzeug server; returns (base url, stop)
+    """
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:%d" % server.server_port, server.shutdown
+
+
+def serve_async(application):
+    """
+    Serves the ASGI app on uvicorn with one worker; returns (base url, stop)
+    """
+    import uvicorn
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(application, host="127.0.0.1", port=port,
+                                           log_level="warning", lifespan="on"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+
+    return "http://127.0.0.1:%d" % port, stop
+
+
+def drive(base, counter, path, n, concurrency):
+    """
+    Sends n GET requests from concurrency client threads and returns the
+    route's statistics
+    """
+
+    def call(i):
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(base + path(i)) as response:
+                response.read()
+            ok = True
+        except urllib.error.HTTPError as e:
+            e.read()
+            ok = e.code < 400
+        return time.perf_counter() - t0, ok
+
+    before = counter.count
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(call, range(n)))
+    wall = time.perf_counter() - started
+    errors = len([ok for _, ok in outcomes if not ok])
+    return summarize([t for t, _ in outcomes], wall, counter.count - before, errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pods", type=int, default=200)
+    parser.add_argument("--users-per-pod", type=int, default=20)
+    parser.add_argument("--tasks-per-pod", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=500, help="requests per route, server and concurrency")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma separated client thread counts")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="poductivity-bench-")
+    os.environ["DATABASE_URL"] = "sqlite:///%s" % os.path.join(workdir, "bench.db")
+    os.environ.setdefault("POD_ENV", "production")
+
+    from asgi import application
+    from db import db
+    import seed
+
+    app = application.app
+    seed.init_schema(app)
+
+    app.extensions["password_hasher"].configure(rounds=args.bcrypt_rounds)
+    # no job workers: QueryCounter would count their polling as the routes' statements
+    app.extensions["job_queue"].configure(workers=0, chunk_size=app.config["JOB_CHUNK_SIZE"])
+    with app.app_context():
+        t0 = time.perf_counter()
+        seeded = seed.seed(args.pods, args.users_per_pod, args.tasks_per_pod)
+        print("seeded %d pods x %d users x %d tasks in %.1fs" % (
+            args.pods, args.users_per_pod, args.tasks_per_pod, time.perf_counter() - t0))
+        sync_counter = QueryCounter(db.engine)
+
+    results = {"sync": {}, "async": {}}
+    levels = [int(c) for c in args.concurrency.split(",")]
+    for mode in ("sync", "async"):
+        if mode == "sync":
+            base, stop = serve_sync(app)
+            counter = sync_counter
+        else:
+            base, stop = serve_async(application)
+            counter = QueryCounter(application.engine.sync_engine)
+        try:
+            for concurrency in levels:
+                for name, path in routes(seeded):
+                    # every run starts from the same (empty) body cache
+                    app.extensions["response_cache"].clear()
+                    stats = drive(base, counter, path, args.requests, concurrency)
+                    results[mode].setdefault(name, {})[concurrency] = stats
+                    print("%-5s c=%-3d %-17s %9.1f req/s  p50 %7.2f  p95 %7.2f  p99 %7.2f ms  %5.2f q/req  %d errors" % (
+                        mode, concurrency, name, stats["throughput"], stats["p50_ms"], stats["p95_ms"],
+                        stats["p99_ms"], stats["queries_per_request"], stats["errors"]))
+        finally:
+            stop()
+
+    print()
+    for name, _ in routes(seeded):
+        for concurrency in levels:
+            sync, async_ = results["sync"][name][concurrency], results["async"][name][concurrency]
+            print("%-17s c=%-3d async/sync throughput %.2fx, p95 %.2fx" % (
+                name, concurrency, async_["throughput"] / sync["throughput"],
+                async_["p95_ms"] / sync["p95_ms"]))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark of join code lookups and allocation as the pod table grows
+
+Grows a fresh SQLite database through the requested pod counts (1M by
+default) and at each size measures
+1. lookup: pods_dao.get_pod_by_join_code for existing codes (unique index probe);
+2. join: POST /api/user/<id>/ through the Flask test client;
+3. allocate: pods_dao.unused_join_code (generate, then probe the index);
+4. scan: the same lookup with the index disabled (WHERE +join_code = ?),
+   for comparison with the unindexed lookup the join route used to run.
+
+Each reports p50/p95/p99 latency (ms). Lookup, join and allocation
+latency should stay flat as the table grows; the scan grows linearly.
+
+Usage (from the repository root):
+    python benchmarks/bench_join_codes.py --sizes 1000,10000,100000,1000000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_routes import percentile  # noqa: E402
+
+
+def timed(calls):
+    """
+    Runs every call and returns (p50, p95, p99) latency in ms
+    """
+    latencies = []
+    for call in calls:
+        t0 = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    return tuple(percentile(latencies, p) * 1000 for p in (0.50, 0.95, 0.99))
+
+
+def grow(db, Pod, pods_dao, codes, size, chunk=50000):
+    """
+    Inserts pods with fresh unique join codes until there are size of them
+    """
+    while len(codes) < size:
+        rows = []
+        while len(rows) < min(chunk, size - len(codes)):
+            code = pods_dao.generate_join_code()
+            if code in codes:
+                continue
+            codes.add(code)
+            rows.append({"name": "pod", "description": "benchmark pod", "join_code": code,
+                         "total_tasks": 0, "completed_tasks": 0, "incomplete_tasks": 0, "version": 1})
+        db.session.execute(Pod.__table__.insert(), rows)
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="comma separated pod counts")
+    parser.add_argument("--lookups", type=int, default=2000, help="lookups, joins and allocations per size")
+    parser.add_argument("--scans", type=int, default=20, help="unindexed lookups per size")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="poductivity-bench-")
+    os.environ["DATABASE_URL"] = "sqlite:///%s" % os.path.join(workdir, "bench.db")
+    os.environ.setdefault("POD_ENV", "production")
+
+    from sqlalchemy import text
+
+    from db import db, Pod, User
+    import pods_dao
+    import seed
+
+    app = seed.create_app()
+
+    app.extensions["password_hasher"].configure(rounds=4)
+    rng = random.Random(1234)
+    client = app.test_client()
+    results = {}
+    with app.app_context():
+        # free users to join pods with; spare pods get 6 digit codes, which
+        # cannot collide with the generated ones
+        seeded = seed.seed(0, 0, 0, spare=args.lookups)
+        codes = set()
+        for size in [int(s) for s in args.sizes.split(",")]:
+            t0 = time.perf_counter()
+            grow(db, Pod, pods_dao, codes, size)
+            grown = time.perf_counter() - t0
+            sample = rng.sample(sorted(codes), min(args.lookups, len(codes)))
+
+            lookup = timed(lambda code=code: pods_dao.get_pod_by_join_code(code) for code in sample)
+            db.session.remove()
+
+            def join(user_id, code):
+                response = client.post("/api/user/%d/" % user_id, data=json.dumps({"join_code": code}))
+                assert response.status_code == 200, response.data
+
+            joins = timed(lambda user_id=user_id, code=code: join(user_id, code)
+                          for user_id, code in zip(seeded.free_user_ids, sample))
+            User.query.filter(User.id.in_(seeded.free_user_ids)).update(
+                {User.podID: None}, synchronize_session=False)
+            db.session.commit()
+
+            allocate = timed(pods_dao.unused_join_code for _ in range(args.lookups))
+            scan_sql = text("SELECT id FROM pod WHERE +join_code = :code")
+            scan = timed(lambda code=code: db.session.execute(scan_sql, {"code": code}).first()
+                         for code in sample[:args.scans])
+            db.session.remove()
+
+            results[size] = {"lookup": lookup, "join": joins, "allocate": allocate, "scan": scan}
+            print("%8d pods (grown in %5.1fs)" % (size, grown))
+            for name in ("lookup", "join", "allocate", "scan"):
+                print("    %-9s p50 %8.3f  p95 %8.3f  p99 %8.3f ms" % ((name,) + results[size][name]))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark of password checks per second for each bcrypt work factor
+
+Runs password_hasher.verify from several threads for a fixed time at every
+work factor and reports logins/sec overall and per core, the number to
+size HASH_WORKERS and BCRYPT_ROUNDS against.
+
+Usage (from the repository root):
+    python benchmarks/bench_passwords.py --rounds 10 11 12 --seconds 3
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordHasher
+
+
+def run(rounds, workers, seconds):
+    """
+    Returns the password checks completed per second at a work factor
+    """
+    hasher = PasswordHasher(rounds=rounds, workers=workers)
+    hashed = hasher.hash("correct horse battery staple")
+    done = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def login():
+        while time.perf_counter() < deadline:
+            hasher.verify("correct horse battery staple", hashed)
+            with lock:
+                done[0] = done[0] + 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=login) for _ in range(workers * 2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return done[0] / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rounds", type=int, nargs="+", default=[4, 8, 10, 11, 12])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    print("%6s %8s %12s %16s" % ("rounds", "workers", "logins/sec", "logins/sec/core"))
+    for rounds in args.rounds:
+        rate = run(rounds, args.workers, args.seconds)
+        per_core = rate / args.workers
+        results.append({"rounds": rounds, "workers": args.workers,
+                        "logins_per_sec": rate, "logins_per_sec_per_core": per_core})
+        print("%6d %8d %12.1f %16.1f" % (rounds, args.workers, rate, per_core))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
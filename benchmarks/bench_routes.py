@@ -0,0 +1,328 @@
+"""
+Load test and micro-benchmark of every route of the app
+
+Seeds a fresh SQLite database at the requested scale, then
+1. drives every route through the Flask test client, one request at a time,
+   recording latency and the number of SQL statements each request runs;
+2. serves the app over HTTP on a threaded local server and drives the read
+   routes from a pool of concurrent clients.
+
+Each route reports throughput, p50/p95/p99 latency (ms), queries per
+request and non-2xx/3xx responses. Results can be saved as JSON and
+compared against an earlier run; any route whose p95 latency or
+throughput moved more than --threshold in the wrong direction, or that
+runs more queries per request, is reported and the exit status is 1.
+
+Usage (from the repository root):
+    python benchmarks/bench_routes.py --pods 50 --users-per-pod 20 \\
+        --tasks-per-pod 200 --requests 200 --concurrency 8 --out run.json
+    python benchmarks/bench_routes.py ... --baseline run.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class QueryCounter(object):
+    """
+    Counts the SQL statements executed on an engine
+
+    Every statement of the engine is counted, so the app must run no
+    background work (see JOB_WORKERS=0 in main)
+    """
+
+    def __init__(self, engine):
+        """
+        Starts counting statements on engine
+        """
+        from sqlalchemy import event
+
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        with self._lock:
+            self.count = self.count + 1
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of a sorted list
+    """
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(latencies, wall, queries, errors):
+    """
+    Returns the statistics reported for one route
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / wall if wall > 0 else None,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "queries_per_request": queries / float(len(latencies)),
+        "errors": errors,
+    }
+
+
+def scenarios(seeded, n):
+    """
+    Returns (name, method, path, body, headers, read_only) builders for every
+    route; path, body and headers are functions of the request number
+    """
+    pods = seeded.pod_ids
+    members = seeded.member_ids
+    tasks = seeded.task_ids
+    tokens = seeded.tokens
+    leader = seeded.leader_ids[0]
+
+    def pick(items):
+        return lambda i: items[i % len(items)]
+
+    def auth(token_index, field):
+        return lambda i: {"Authorization": "Bearer " + tokens[token_index(i) % len(tokens)][field]}
+
+    pod = pick(pods)
+    member = pick(members)
+    task = pick(tasks)
+    none = lambda i: None
+    return [
+        ("hello", "GET", lambda i: "/", none, none, True),
+        ("secret", "GET", lambda i: "/secret/", none, auth(lambda i: 0, 1), True),
+        ("user_list", "GET", lambda i: "/api/user/", none, none, True),
+        ("user_get", "GET", lambda i: "/api/user/%d/" % member(i), none, none, True),
+        ("user_tasks_completed", "GET", lambda i: "/api/user/taskscompleted/%d/" % member(i), none, none, True),
+        ("pod_list", "GET", lambda i: "/api/pod/", none, none, True),
+        ("pod_get", "GET", lambda i: "/api/pod/%d/" % pod(i), none, none, True),
+        ("pod_joincode", "GET", lambda i: "/api/pod/joincode/%d/" % pod(i), none, none, True),
+        ("pod_all_users", "GET", lambda i: "/api/pod/alluser/%d/" % pod(i), none, none, True),
+        ("pod_leaderboard", "GET", lambda i: "/api/pod/leaderboard/%d/" % pod(i), none, none, True),
+        ("pod_total_tasks", "GET", lambda i: "/api/pod/totaltasks/%d/" % pod(i), none, none, True),
+        ("pod_tasks_completed", "GET", lambda i: "/api/pod/taskscompleted/%d/" % pod(i), none, none, True),
+        ("pod_tasks_incomplete", "GET", lambda i: "/api/pod/tasksincomplete/%d/" % pod(i), none, none, True),
+        ("pod_stats", "GET", lambda i: "/api/pod/%d/stats/" % pod(i), none, none, True),
+        ("task_get", "GET", lambda i: "/api/task/%d/" % task(i), none, none, True),
+        ("export_pods", "GET", lambda i: "/api/export/pods/", none, none, True),
+        ("register", "POST", lambda i: "/register/",
+         lambda i: {"username": "bench-register-%d" % i, "password": "pw", "leader": 0, "tasks_completed": 0},
+         none, False),
+        ("login", "POST", lambda i: "/login/",
+         lambda i: {"username": "user%d" % member(i), "password": "bench-password"}, none, False),
+        ("session", "POST", lambda i: "/session/", none, auth(lambda i: 1 + i, 2), False),
+        ("logout", "POST", lambda i: "/logout/", none, auth(lambda i: 1 + n + i, 1), False),
+        ("user_create", "POST", lambda i: "/api/user/",
+         lambda i: {"username": "bench-user-%d" % i, "password": "pw"}, none, False),
+        ("join_pod", "POST", lambda i: "/api/user/%d/" % seeded.free_user_ids[i],
+         lambda i: {"join_code": seeded.join_codes[pod(i)]}, none, False),
+        ("pod_create", "POST", lambda i: "/api/pod/%d/" % seeded.free_user_ids[n + i],
+         lambda i: {"name": "bench pod %d" % i, "description": "created by the benchmark"}, none, False),
+        ("task_create", "POST", lambda i: "/api/task/%d/" % member(i),
+         lambda i: {"description": "bench task %d" % i}, none, False),
+        ("task_update", "POST", lambda i: "/api/task/update/%d/" % member(i),
+         lambda i: {"task_id": task(i), "done": i % 2 == 0}, none, False),
+        ("task_batch_create", "POST", lambda i: "/api/task/batch/%d/" % member(i),
+         lambda i: {"descriptions": ["bench batch %d-%d" % (i, k) for k in range(100)]}, none, False),
+        ("task_batch_update", "POST", lambda i: "/api/task/batch/update/%d/" % member(i),
+         lambda i: {"updates": [{"task_id": task(i * 100 + k), "done": k % 2 == 0} for k in range(100)]},
+         none, False),
+        ("user_delete_from_pod", "DELETE", lambda i: "/api/user/%d/delete/" % leader,
+         lambda i: {"user_to_delete": seeded.spare_member_ids[i]}, none, False),
+        ("pod_delete", "DELETE", lambda i: "/api/pod/%d/" % leader,
+         lambda i: {"pod_id": seeded.spare_pod_ids[i]}, none, False),
+    ]
+
+
+def run_client(app, counter, routes, n):
+    """
+    Drives every route n times through the Flask test client
+    """
+    client = app.test_client()
+    results = {}
+    for name, method, path, body, headers, _ in routes:
+        latencies = []
+        errors = 0
+        queries = 0
+        started = time.perf_counter()
+        for i in range(n):
+            data = body(i)
+            before = counter.count
+            t0 = time.perf_counter()
+            response = client.open(path(i), method=method, headers=headers(i),
+                                   data=json.dumps(data) if data is not None else None)
+            response.get_data()
+            latencies.append(time.perf_counter() - t0)
+            queries = queries + counter.count - before
+            if response.status_code >= 400:
+                errors = errors + 1
+        results[name] = summarize(latencies, time.perf_counter() - started, queries, errors)
+        print_row("client", name, results[name])
+    return results
+
+
+def run_http(app, counter, routes, n, concurrency):
+    """
+    Serves the app on a local threaded HTTP server and drives the read routes
+    n times each from concurrency client threads
+    """
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = "http://127.0.0.1:%d" % server.server_port
+    results = {}
+    try:
+        for name, method, path, body, headers, read_only in routes:
+            if not read_only:
+                continue
+
+            def call(i):
+                request = urllib.request.Request(base + path(i), method=method,
+                                                 headers=headers(i) or {})
+                t0 = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(request) as response:
+                        response.read()
+                    ok = True
+                except urllib.error.HTTPError as e:
+                    e.read()
+                    ok = e.code < 400
+                return time.perf_counter() - t0, ok
+
+            before = counter.count
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(call, range(n)))
+            wall = time.perf_counter() - started
+            errors = len([ok for _, ok in outcomes if not ok])
+            results[name] = summarize([t for t, _ in outcomes], wall, counter.count - before, errors)
+            print_row("http", name, results[name])
+    finally:
+        server.shutdown()
+    return results
+
+
+def print_row(phase, name, stats):
+    """
+    Prints the statistics of one route
+    """
+    print("%-6s %-22s %9.1f req/s  p50 %8.2f  p95 %8.2f  p99 %8.2f ms  %6.2f q/req  %d errors" % (
+        phase, name, stats["throughput"], stats["p50_ms"], stats["p95_ms"], stats["p99_ms"],
+        stats["queries_per_request"], stats["errors"]))
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns a description of every route that regressed against the baseline
+    """
+    regressions = []
+    for phase, routes in results["results"].items():
+        for name, stats in routes.items():
+            base = baseline.get("results", {}).get(phase, {}).get(name)
+            if base is None:
+                continue
+            if stats["p95_ms"] > base["p95_ms"] * (1 + threshold):
+                regressions.append("%s %s: p95 %.2fms -> %.2fms" % (phase, name, base["p95_ms"], stats["p95_ms"]))
+            if stats["throughput"] < base["throughput"] * (1 - threshold):
+                regressions.append("%s %s: throughput %.1f -> %.1f req/s" % (
+                    phase, name, base["throughput"], stats["throughput"]))
+            if round(stats["queries_per_request"], 2) > round(base["queries_per_request"], 2):
+                regressions.append("%s %s: queries/request %.2f -> %.2f" % (
+                    phase, name, base["queries_per_request"], stats["queries_per_request"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pods", type=int, default=50)
+    parser.add_argument("--users-per-pod", type=int, default=20)
+    parser.add_argument("--tasks-per-pod", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route and phase")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4,
+                        help="work factor for seeded passwords (see bench_passwords.py for hashing cost)")
+    parser.add_argument("--skip-http", action="store_true", help="only run the test client phase")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative change in p95 or throughput counted as a regression")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="poductivity-bench-")
+    os.environ["DATABASE_URL"] = "sqlite:///%s" % os.path.join(workdir, "bench.db")
+    os.environ.setdefault("POD_ENV", "production")
+
+    from db import db
+    import seed
+
+    # no job workers: their polling and the session sweep would be counted
+    # as statements of the routes being measured
+    app = seed.create_app(JOB_WORKERS=0)
+
+    app.extensions["password_hasher"].configure(rounds=args.bcrypt_rounds)
+    # every request comes from one address; measure the routes, not the limits
+    app.extensions["rate_limiter"].configure(enabled=False)
+    n = args.requests
+    with app.app_context():
+        t0 = time.perf_counter()
+        seeded = seed.seed(args.pods, args.users_per_pod, args.tasks_per_pod, spare=2 * n)
+        print("seeded %d pods x %d users x %d tasks in %.1fs" % (
+            args.pods, args.users_per_pod, args.tasks_per_pod, time.perf_counter() - t0))
+        counter = QueryCounter(db.engine)
+
+    routes = scenarios(seeded, n)
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "pods": args.pods,
+            "users_per_pod": args.users_per_pod,
+            "tasks_per_pod": args.tasks_per_pod,
+            "requests": n,
+            "concurrency": args.concurrency,
+        },
+        "results": {},
+    }
+    reads = [r for r in routes if r[5]]
+    writes = [r for r in routes if not r[5]]
+    # reads go first so every phase reads the same seeded data
+    if not args.skip_http:
+        results["results"]["http"] = run_http(app, counter, reads, n, args.concurrency)
+    results["results"]["client"] = run_client(app, counter, reads + writes, n)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
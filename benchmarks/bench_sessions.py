@@ -0,0 +1,146 @@
+"""
+Benchmark of session lookups and the expiry sweeper as the sessions table grows
+
+Grows a fresh SQLite database through the requested session counts (1M by
+default), a third of them already past their renew window, and at each
+size measures
+1. lookup: users_dao.get_user_id_by_session_token with the session cache
+   cleared (unique index probe on the token hash);
+2. secret: GET /secret/ through the Flask test client, cache cleared;
+3. renew: POST /session/ with an update token;
+4. sweep: one users_dao.sweep_sessions batch of --batch expired sessions.
+
+Each reports p50/p95/p99 latency (ms); lookups should stay flat as the
+table grows. Finally the sweep_sessions job deletes every expired session
+and its throughput (sessions/s) is reported.
+
+Usage (from the repository root):
+    python benchmarks/bench_sessions.py --sizes 1000,100000,1000000
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_join_codes import timed  # noqa: E402
+
+
+def grow(db, UserSession, user_ids, tokens, size, expired, chunk=50000):
+    """
+    Inserts sessions for random users until there are size of them; every
+    third one is past its renew window and is not kept in tokens
+    """
+    now = datetime.datetime.now()
+    past = now - datetime.timedelta(days=60)
+    while expired[0] + len(tokens) < size:
+        rows = []
+        while len(rows) < min(chunk, size - expired[0] - len(tokens)):
+            token, update_token = os.urandom(20).hex(), os.urandom(20).hex()
+            stale = (expired[0] + len(tokens)) % 3 == 0
+            expires_at = past if stale else now + datetime.timedelta(days=1)
+            rows.append({"user_id": random.choice(user_ids), "token_hash": UserSession.hash_token(token),
+                         "update_token_hash": UserSession.hash_token(update_token),
+                         "expires_at": expires_at, "renew_until": expires_at + datetime.timedelta(days=30)})
+            if stale:
+                expired[0] = expired[0] + 1
+            else:
+                tokens.append((token, update_token))
+        db.session.execute(UserSession.__table__.insert(), rows)
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="comma separated session counts")
+    parser.add_argument("--lookups", type=int, default=2000, help="lookups and requests per size")
+    parser.add_argument("--batch", type=int, default=500, help="sessions deleted per sweep batch")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="poductivity-bench-")
+    os.environ["DATABASE_URL"] = "sqlite:///%s" % os.path.join(workdir, "bench.db")
+    os.environ.setdefault("POD_ENV", "production")
+
+    from db import db, UserSession
+    from jobs import job_queue
+    from session_cache import session_cache
+    import users_dao
+    import seed
+
+    app = seed.create_app()
+
+    app.extensions["password_hasher"].configure(rounds=4)
+    app.extensions["rate_limiter"].configure(enabled=False)
+    # the periodic sweep would race the measurements; jobs run inline below
+    app.extensions["job_queue"].configure(workers=0, chunk_size=args.batch)
+    random.seed(1234)
+    client = app.test_client()
+    results = {}
+    with app.app_context():
+        seeded = seed.seed(10, 100, 0)
+        user_ids = [user_id for user_id, _, _ in seeded.tokens]
+        tokens = []
+        expired = [0]
+        for size in [int(s) for s in args.sizes.split(",")]:
+            t0 = time.perf_counter()
+            grow(db, UserSession, user_ids, tokens, size, expired)
+            grown = time.perf_counter() - t0
+            sample = random.sample(tokens, min(args.lookups, len(tokens)))
+
+            def lookup(token):
+                session_cache.clear()
+                assert users_dao.get_user_id_by_session_token(token) is not None
+
+            def secret(token):
+                session_cache.clear()
+                response = client.get("/secret/", headers={"Authorization": "Bearer " + token})
+                assert response.status_code == 201, response.data
+
+            renewed = []
+
+            def renew(update_token):
+                response = client.post("/session/", headers={"Authorization": "Bearer " + update_token})
+                assert response.status_code == 201, response.data
+                body = json.loads(response.data)
+                renewed.append((body["session_token"], body["update_token"]))
+
+            lookups = timed(lambda token=token: lookup(token) for token, _ in sample)
+            secrets = timed(lambda token=token: secret(token) for token, _ in sample)
+            renews = timed(lambda update_token=update_token: renew(update_token) for _, update_token in sample)
+            used = set(sample)
+            tokens = [t for t in tokens if t not in used] + renewed
+            # sweep one batch, then put the same number of expired sessions back
+            sweeps = timed([lambda: users_dao.sweep_sessions(args.batch)])
+            expired[0] = expired[0] - min(args.batch, expired[0])
+            grow(db, UserSession, user_ids, tokens, size, expired)
+            db.session.remove()
+
+            results[size] = {"lookup": lookups, "secret": secrets, "renew": renews, "sweep_batch": sweeps}
+            print("%8d sessions (grown in %5.1fs)" % (size, grown))
+            for name in ("lookup", "secret", "renew", "sweep_batch"):
+                print("    %-11s p50 %8.3f  p95 %8.3f  p99 %8.3f ms" % ((name,) + results[size][name]))
+
+        job_queue.enqueue("sweep_sessions")
+        t0 = time.perf_counter()
+        job_queue.run_next()
+        elapsed = time.perf_counter() - t0
+        swept = expired[0]
+        print("sweep_sessions job: %d sessions in %.2fs (%.0f sessions/s), %d left" % (
+            swept, elapsed, swept / elapsed, UserSession.query.count()))
+        results["sweep_job"] = {"sessions": swept, "seconds": elapsed}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
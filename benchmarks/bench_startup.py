@@ -0,0 +1,148 @@
+"""
+Benchmark of cold start: import, app creation and first request
+
+Seeds a SQLite database (schema set up by init-db), then starts --runs
+fresh interpreters for each of
+1. lazy: import app, create_app(), serve GET /api/pod/1/ - what a worker
+   or a test does now;
+2. eager: the same with the schema created and migrated before the first
+   request, which is what importing app.py used to do in every process.
+Each reports the median seconds spent importing, creating the app,
+on schema work and on the first request, the SQL statements run before
+the first request, whether bcrypt was loaded, and the wall time of the
+whole process.
+
+Then, as gunicorn --preload does, the app is created once in this process
+and --runs children are forked from it; each reports the seconds from the
+fork to its first response.
+
+Usage (from the repository root):
+    python benchmarks/bench_startup.py --runs 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, %(root)r)
+import app
+t_import = time.perf_counter()
+flask_app = app.create_app()
+t_create = time.perf_counter()
+from sqlalchemy import event
+from db import db
+statements = [0]
+with flask_app.app_context():
+    event.listen(db.engine, "before_cursor_execute", lambda *args: statements.__setitem__(0, statements[0] + 1))
+    if sys.argv[1] == "eager":
+        import migrations
+        migrations.migrate()
+t_schema = time.perf_counter()
+before_request = statements[0]
+bcrypt_loaded = "bcrypt" in sys.modules
+response = flask_app.test_client().get("/api/pod/1/")
+assert response.status_code == 200, response.data
+t_request = time.perf_counter()
+print(json.dumps({"import": t_import - t0, "create_app": t_create - t_import, "schema": t_schema - t_create,
+                  "first_request": t_request - t_schema, "statements": before_request,
+                  "bcrypt": bcrypt_loaded}))
+"""
+PHASES = ("import", "create_app", "schema", "first_request", "process")
+
+
+def start(mode):
+    """
+    Runs one fresh interpreter in mode; returns its timings
+    """
+    t0 = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD % {"root": ROOT}, mode],
+                            check=True, stdout=subprocess.PIPE).stdout
+    result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - t0
+    return result
+
+
+def fork_first_request(app):
+    """
+    Forks a child from this process and returns the seconds from the fork
+    to the child's first response
+    """
+    read_end, write_end = os.pipe()
+    t0 = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        response = app.test_client().get("/api/pod/1/")
+        os.write(write_end, str(time.perf_counter() - t0 if response.status_code == 200 else -1).encode("ascii"))
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as f:
+        elapsed = float(f.read())
+    os.waitpid(pid, 0)
+    if elapsed < 0:
+        raise AssertionError("first request of the forked child failed")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=20, help="processes started per measurement")
+    parser.add_argument("--pods", type=int, default=100, help="pods to seed")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="poductivity-bench-")
+    os.environ["DATABASE_URL"] = "sqlite:///%s" % os.path.join(workdir, "bench.db")
+    os.environ.setdefault("POD_ENV", "production")
+
+    from db import db
+    import seed
+
+    app = seed.create_app()
+    app.extensions["password_hasher"].configure(rounds=4)
+    with app.app_context():
+        seed.seed(args.pods, 10, 20)
+        db.session.remove()
+        db.engine.dispose()
+
+    results = {}
+    # the modes take turns so that drift in the machine's speed hits both alike
+    runs = {"lazy": [], "eager": []}
+    for _ in range(args.runs):
+        for mode in runs:
+            runs[mode].append(start(mode))
+    for mode in runs:
+        results[mode] = dict((phase, statistics.median(r[phase] for r in runs[mode])) for phase in PHASES)
+        results[mode]["statements"] = runs[mode][-1]["statements"]
+        results[mode]["bcrypt"] = runs[mode][-1]["bcrypt"]
+        print("%-5s import %6.1f  create_app %6.1f  schema %6.1f  first_request %6.1f  process %6.1f ms"
+              "  (%d statements before the first request, bcrypt %s)" % (
+                  (mode,) + tuple(results[mode][phase] * 1000 for phase in PHASES)
+                  + (results[mode]["statements"], "loaded" if results[mode]["bcrypt"] else "not loaded")))
+
+    if hasattr(os, "fork"):
+        # the parent's connections must not be shared with the children
+        with app.app_context():
+            db.engine.dispose()
+        forks = [fork_first_request(app) for _ in range(args.runs)]
+        results["preload_fork"] = statistics.median(forks)
+        print("preload: fork to first response %6.1f ms" % (results["preload_fork"] * 1000))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark of task status updates through the write-behind buffer
+
+Seeds a fresh SQLite database, then for each TASK_WRITE_MODE ("off",
+"sync", "async") has --threads threads each post --updates
+POST /api/task/update/<user_id>/ requests, toggling random tasks of their
+pod. Reports, per mode,
+1. updates/s of all threads together and p50/p95/p99 latency (ms);
+2. commits: the write transactions the updates took (one per update
+   when off, one per flush otherwise);
+3. drift: updates answered minus the increase of the users'
+   tasks_completed, which must be 0 (no increment lost).
+
+Usage (from the repository root):
+    python benchmarks/bench_write_buffer.py --pods 2 --threads 8 --updates 200
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_routes import percentile  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pods", type=int, default=2, help="pods the updates land on")
+    parser.add_argument("--users", type=int, default=10, help="users per pod")
+    parser.add_argument("--tasks", type=int, default=100, help="tasks per pod")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--updates", type=int, default=200, help="updates per thread and mode")
+    parser.add_argument("--window", type=float, help="TASK_WRITE_WINDOW (default: the config's)")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="poductivity-bench-")
+    os.environ["DATABASE_URL"] = "sqlite:///%s" % os.path.join(workdir, "bench.db")
+    os.environ.setdefault("POD_ENV", "production")
+
+    from db import db, User
+    import seed
+    import write_buffer
+
+    app = seed.create_app()
+    task_writes = app.extensions["task_writes"]
+
+    app.extensions["password_hasher"].configure(rounds=4)
+    app.extensions["rate_limiter"].configure(enabled=False)
+    app.extensions["write_limiter"].configure(0)
+    window = args.window if args.window is not None else app.config["TASK_WRITE_WINDOW"]
+    rng = random.Random(1234)
+    with app.app_context():
+        seeded = seed.seed(args.pods, args.users, args.tasks)
+    members = {pod_id: [seeded.leader_ids[i]] + seeded.member_ids[i * (args.users - 1):(i + 1) * (args.users - 1)]
+               for i, pod_id in enumerate(seeded.pod_ids)}
+    tasks = {pod_id: seeded.task_ids[i * args.tasks:(i + 1) * args.tasks] for i, pod_id in enumerate(seeded.pod_ids)}
+
+    def completed():
+        with app.app_context():
+            total = db.session.query(db.func.sum(User.tasks_completed)).scalar()
+            db.session.remove()
+            return total
+
+    results = {}
+    for mode in write_buffer.MODES:
+        task_writes.configure(mode, window, app.config["TASK_WRITE_MAX_UPDATES"])
+        plans = []
+        for _ in range(args.threads):
+            pod_id = rng.choice(seeded.pod_ids)
+            plans.append([(rng.choice(members[pod_id]), rng.choice(tasks[pod_id]), rng.random() < 0.5)
+                          for _ in range(args.updates)])
+        latencies = []
+        answered = [0]
+        lock = threading.Lock()
+
+        def work(plan):
+            client = app.test_client()
+            mine = []
+            for user_id, task_id, done in plan:
+                t0 = time.perf_counter()
+                response = client.post("/api/task/update/%d/" % user_id,
+                                       data=json.dumps({"task_id": task_id, "done": done}))
+                mine.append(time.perf_counter() - t0)
+                assert response.status_code in (201, 202), response.data
+            with lock:
+                latencies.extend(mine)
+                answered[0] = answered[0] + len(plan)
+
+        before = completed()
+        flushes = task_writes.flushes
+        workers = [threading.Thread(target=work, args=(plan,)) for plan in plans]
+        t0 = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        task_writes.flush()
+        elapsed = time.perf_counter() - t0
+        latencies.sort()
+        commits = answered[0] if mode == write_buffer.OFF else task_writes.flushes - flushes
+        results[mode] = {
+            "updates_per_second": answered[0] / elapsed,
+            "latency_ms": [percentile(latencies, p) * 1000 for p in (0.50, 0.95, 0.99)],
+            "commits": commits,
+            "drift": answered[0] - (completed() - before),
+        }
+        print("%-5s %7.0f updates/s  p50 %7.3f  p95 %7.3f  p99 %7.3f ms  %5d commits  drift %d" % (
+            (mode, results[mode]["updates_per_second"]) + tuple(results[mode]["latency_ms"])
+            + (commits, results[mode]["drift"])))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
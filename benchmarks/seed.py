@@ -0,0 +1,145 @@
+"""
+Synthetic data for the benchmarks
+
+Fills the app's database with pods x users x tasks using executemany
+inserts, plus spare rows that the mutating routes consume one per request
+(users outside any pod, empty pods, removable pod members).
+"""
+
+import datetime
+import random
+import uuid
+
+from db import db, Pod, Task, User, UserSession
+import migrations
+from passwords import password_hasher
+import stats_dao
+
+PASSWORD = "bench-password"
+
+
+class Seeded(object):
+    """
+    Ids and tokens of the seeded rows, for building benchmark requests
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty Seeded record
+        """
+        self.pod_ids = []
+        self.leader_ids = []
+        self.member_ids = []
+        self.task_ids = []
+        self.free_user_ids = []
+        self.spare_pod_ids = []
+        self.spare_member_ids = []
+        self.tokens = []
+        self.join_codes = {}
+
+
+def init_schema(app):
+    """
+    Creates the tables of the app's database and returns the app
+    """
+    with app.app_context():
+        migrations.migrate()
+    return app
+
+
+def create_app(**settings):
+    """
+    Returns a new app, from the config profile of POD_ENV with settings
+    overriding its keys, with its schema set up
+    """
+    from app import create_app
+    from config import get_config
+
+    return init_schema(create_app(type("BenchConfig", (get_config(),), settings)))
+
+
+def _token():
+    """
+    Returns a random session/update token
+    """
+    return uuid.uuid4().hex
+
+
+def _insert(model, rows, chunk=5000):
+    """
+    Inserts rows into the model's table with executemany, chunk rows at a time
+    """
+    for start in range(0, len(rows), chunk):
+        db.session.execute(model.__table__.insert(), rows[start:start + chunk])
+
+
+def seed(pods, users_per_pod, tasks_per_pod, spare=0, rng=None):
+    """
+    Seeds the database bound to the current app context and returns Seeded
+
+    Must run on an empty database
+    """
+    rng = rng or random.Random(1234)
+    seeded = Seeded()
+    password = password_hasher.hash(PASSWORD)
+    expiration = datetime.datetime.now() + datetime.timedelta(days=1)
+    pod_rows = []
+    user_rows = []
+    session_rows = []
+    task_rows = []
+
+    def add_user(pod_id, leader, tasks_completed=0):
+        user_id = len(user_rows) + 1
+        session_token, update_token = _token(), _token()
+        user_rows.append({
+            "id": user_id, "username": "user%d" % user_id, "password": password,
+            "leader": leader, "tasks_completed": tasks_completed, "podID": pod_id,
+        })
+        session_rows.append({
+            "user_id": user_id, "token_hash": UserSession.hash_token(session_token),
+            "update_token_hash": UserSession.hash_token(update_token),
+            "expires_at": expiration, "renew_until": expiration + datetime.timedelta(days=30),
+        })
+        seeded.tokens.append((user_id, session_token, update_token))
+        return user_id
+
+    def add_pod():
+        pod_id = len(pod_rows) + 1
+        join_code = str(100000 + pod_id)
+        pod_rows.append({
+            "id": pod_id, "name": "pod%d" % pod_id, "description": "benchmark pod",
+            "join_code": join_code, "version": 1,
+        })
+        seeded.join_codes[pod_id] = join_code
+        return pod_id
+
+    for _ in range(pods):
+        pod_id = add_pod()
+        seeded.pod_ids.append(pod_id)
+        members = [add_user(pod_id, True)]
+        for _ in range(users_per_pod - 1):
+            members.append(add_user(pod_id, False, rng.randint(0, tasks_per_pod)))
+        seeded.leader_ids.append(members[0])
+        seeded.member_ids.extend(members[1:])
+        for n in range(tasks_per_pod):
+            done = rng.random() < 0.5
+            task_rows.append({
+                "id": len(task_rows) + 1, "description": "task %d" % n, "status": done,
+                "pod_id": pod_id, "creator_id": members[0],
+                "completer_id": rng.choice(members) if done else None,
+            })
+            seeded.task_ids.append(len(task_rows))
+
+    for _ in range(spare):
+        seeded.free_user_ids.append(add_user(None, False))
+        seeded.spare_pod_ids.append(add_pod())
+        if seeded.pod_ids:
+            seeded.spare_member_ids.append(add_user(seeded.pod_ids[0], False))
+
+    _insert(Pod, pod_rows)
+    _insert(User, user_rows)
+    _insert(UserSession, session_rows)
+    _insert(Task, task_rows)
+    db.session.commit()
+    stats_dao.rebuild_counters()
+    return seeded
@@ -0,0 +1,158 @@
+"""
+Configuration profiles for the app
+
+The profile is picked with the POD_ENV environment variable
+("development" by default, or "production"). DATABASE_URL overrides the
+database of either profile, e.g. to point at a server-based engine.
+"""
+
+import os
+
+from sqlalchemy.pool import QueuePool
+
+import admission
+import feed
+import instrumentation
+import jobs
+import passwords
+import projections
+import pods_dao
+import rollups_dao
+import serialization
+import users_dao
+import write_buffer
+
+DB_FILENAME = "poductivity.db"
+DATABASE_URI = os.environ.get("DATABASE_URL", "sqlite:///%s" % DB_FILENAME)
+
+
+def _is_sqlite(uri):
+    """
+    Returns true if the database URI points at SQLite
+    """
+    return uri.startswith("sqlite")
+
+
+def _pooled_engine_options(uri, pool_size, max_overflow):
+    """
+    Returns engine options that keep a pool of open connections
+
+    SQLite connections are shared between worker threads, which the sqlite3
+    module only allows with check_same_thread disabled
+    """
+    options = {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_pre_ping": True,
+    }
+    if _is_sqlite(uri):
+        options["poolclass"] = QueuePool
+        options["connect_args"] = {"check_same_thread": False}
+    return options
+
+
+class Config(object):
+    """
+    Settings shared by every profile
+    """
+    DEBUG = False
+    SQLALCHEMY_DATABASE_URI = DATABASE_URI
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    # PRAGMA name -> value run on every new SQLite connection
+    SQLITE_PRAGMAS = {}
+    BCRYPT_ROUNDS = passwords.BCRYPT_ROUNDS
+    HASH_WORKERS = passwords.HASH_WORKERS
+    SESSION_LIFETIME = users_dao.SESSION_LIFETIME
+    # how long an expired session can still be renewed with its update token
+    SESSION_RENEW_WINDOW = users_dao.RENEW_WINDOW
+    # seconds between sweeps deleting sessions that can no longer be renewed
+    SESSION_SWEEP_INTERVAL = users_dao.SWEEP_INTERVAL
+    JOIN_CODE_LENGTH = pods_dao.JOIN_CODE_LENGTH
+    JOIN_CODE_ATTEMPTS = pods_dao.JOIN_CODE_ATTEMPTS
+    # members of all pods kept in the leaderboard projections, see projections.py
+    PROJECTION_MAX_MEMBERS = projections.MAX_MEMBERS
+    # requests slower than this are logged with their query fingerprints
+    SLOW_REQUEST_MS = instrumentation.SLOW_REQUEST_MS
+    # "json" (byte-for-byte stable output), "orjson", "ujson" or "fast"
+    JSON_ENCODER = serialization.DEFAULT_ENCODER
+    # "wsgi" serves app.py with the Flask server, "asgi" serves asgi.py
+    # with uvicorn on one worker
+    SERVER = os.environ.get("POD_SERVER", "wsgi")
+    # async engine of the ASGI routes; derived from the app's engine if unset
+    ASYNC_DATABASE_URI = os.environ.get("ASYNC_DATABASE_URL")
+    ASYNC_ENGINE_OPTIONS = {}
+    # threads running the Flask app for routes asgi.py does not serve natively
+    ASGI_THREADS = 8
+    # background job worker threads per process, see jobs.py
+    JOB_WORKERS = jobs.WORKERS
+    # rows a job deletes or rebuilds per transaction
+    JOB_CHUNK_SIZE = jobs.CHUNK_SIZE
+    JOB_LEASE_SECONDS = jobs.LEASE_SECONDS
+    JOB_POLL_INTERVAL = jobs.POLL_INTERVAL
+    JOB_MAX_ATTEMPTS = jobs.MAX_ATTEMPTS
+    # seconds between re-reads of the change feed by waiting requests, for
+    # changes made by other processes; see feed.py
+    FEED_POLL_INTERVAL = feed.POLL_INTERVAL
+    FEED_MAX_WAIT = feed.MAX_WAIT
+    FEED_HEARTBEAT = feed.HEARTBEAT
+    FEED_STREAM_SECONDS = feed.STREAM_SECONDS
+    # streams and waiting long-polls served at once per app process (0 for no cap)
+    FEED_MAX_WATCHERS = feed.MAX_WATCHERS
+    # longest window, in hours or days, an analytics request may cover
+    ANALYTICS_MAX_BUCKETS = rollups_dao.MAX_BUCKETS
+    # token bucket limits of the auth and task update routes, see admission.py
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMITS = admission.RATE_LIMITS
+    # "memory" keeps the buckets per process; see admission.BACKENDS
+    RATE_LIMIT_BACKEND = "memory"
+    RATE_LIMIT_BACKEND_OPTIONS = {"shards": admission.SHARDS, "max_keys": admission.MAX_KEYS}
+    # write requests running at once per process before the rest get 503 (0: no cap)
+    MAX_WRITES_IN_FLIGHT = admission.MAX_WRITES_IN_FLIGHT
+    # task status updates: "sync" groups them into one commit per window,
+    # "async" also answers 202 before the commit, "off" commits each one;
+    # see write_buffer.py
+    TASK_WRITE_MODE = write_buffer.MODE
+    TASK_WRITE_WINDOW = write_buffer.WINDOW
+    TASK_WRITE_MAX_UPDATES = write_buffer.MAX_UPDATES
+    TASK_WRITE_FLUSH_ON_SHUTDOWN = write_buffer.FLUSH_ON_SHUTDOWN
+
+
+class DevelopmentConfig(Config):
+    """
+    Local development: debugger on and every statement echoed
+    """
+    DEBUG = True
+    SQLALCHEMY_ECHO = True
+
+
+class ProductionConfig(Config):
+    """
+    Multi-worker deployments: no echo, pooled connections and WAL mode so
+    readers do not block on the writer
+    """
+    SQLALCHEMY_ENGINE_OPTIONS = _pooled_engine_options(DATABASE_URI, pool_size=5, max_overflow=10)
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,
+        "temp_store": "MEMORY",
+    }
+
+
+CONFIGS = {
+    "development": DevelopmentConfig,
+    "production": ProductionConfig,
+}
+
+
+def get_config(name=None):
+    """
+    Returns the config class of the named profile, read from POD_ENV by default
+    """
+    if name is None:
+        name = os.environ.get("POD_ENV", "development")
+    if name not in CONFIGS:
+        raise ValueError("Unknown config profile: %s" % name)
+    return CONFIGS[name]
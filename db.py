@@ -1,19 +1,39 @@
 import datetime
 import hashlib
-import os
-import random
-import bcrypt
+import json
+import secrets
+import time
 
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import aliased, joinedload, selectinload
+
+from passwords import password_hasher
 
 db = SQLAlchemy()
 
+
+def set_sqlite_pragmas(engine, pragmas):
+    """
+    Runs PRAGMA statements on every new connection of a SQLite engine
+    """
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA %s = %s" % (name, value))
+        cursor.close()
+
 class User(db.Model):
     """
     User model
     Has a many-to-one relationship with Pod
     Has a one-to-many relationship with Task 
+    Has a one-to-many relationship with UserSession
     """
     __tablename__ = "users"
     id = db.Column(db.Integer, primary_key = True, autoincrement = True)
@@ -22,10 +42,12 @@ class User(db.Model):
     leader = db.Column(db.Boolean, nullable = False)
     tasks_completed = db.Column(db.Integer, nullable = False)
     podID = db.Column(db.Integer, db.ForeignKey("pod.id", ondelete="SET NULL"))
-
-    session_token = db.Column(db.String, nullable=False, unique=True)
-    session_expiration = db.Column(db.DateTime, nullable=False)
-    update_token = db.Column(db.String, nullable=False, unique=True)
+    verified_completions = db.Column(db.Integer, nullable=False, server_default="0")
+    pod = db.relationship("Pod")
+    __table_args__ = (
+        db.Index("ix_users_username", "username"),
+        db.Index("ix_users_podID_tasks_completed", "podID", "tasks_completed"),
+    )
 
     def __init__(self, **kwargs):
         """
@@ -33,19 +55,18 @@ class User(db.Model):
         """
         # name, netid, leader
         self.username = kwargs.get("username", "")
-        self.password = kwargs.get("password","")
+        self.password = password_hasher.hash(kwargs.get("password",""))
         self.leader = False
         self.tasks_completed = 0
-        self.renew_session()
+        self.verified_completions = 0
     
     def serialize(self):
         """
         Serializes a User object
         """
-        pod = Pod.query.filter_by(id = self.podID).first()
         pod_serialized = None
-        if pod is not None:
-            pod_serialized = pod.simple_serialize() #pod is the podID, we want the pod that the podID references
+        if self.pod is not None:
+            pod_serialized = self.pod.simple_serialize()
         return {
             "id": self.id,
             "username": self.username,
@@ -66,40 +87,52 @@ class User(db.Model):
             "tasks_completed": self.tasks_completed,
             "leader": self.leader
         }
-    def _urlsafe_base_64(self):
-        """
-        Randomly generates hashed tokens (used for session/update tokens)
-        """
-        return hashlib.sha1(os.urandom(64)).hexdigest()
 
-    def renew_session(self):
+    @staticmethod
+    def serialize_options():
         """
-        Renews the sessions, i.e.
-        1. Creates a new session token
-        2. Sets the expiration time of the session to be a day from now
-        3. Creates a new update token
+        Loader options that eager-load everything serialize() reads
         """
-        self.session_token = self._urlsafe_base_64()
-        self.session_expiration = datetime.datetime.now() + datetime.timedelta(days=1)
-        self.update_token = self._urlsafe_base_64()
+        return (joinedload(User.pod),)
 
-    def verify_password(self, password):
+    @staticmethod
+    def row_query():
         """
-        Verifies the password of a user
+        Query of the columns serialize_row() reads, with the pod outer joined
         """
-        return password == self.password
+        return db.session.query(
+            User.id, User.username, User.password, User.tasks_completed, User.leader,
+            Pod.id.label("pod_id"), Pod.name.label("pod_name"),
+            Pod.description.label("pod_description"), Pod.join_code.label("pod_join_code"),
+        ).outerjoin(Pod, User.podID == Pod.id)
 
-    def verify_session_token(self, session_token):
+    @staticmethod
+    def serialize_row(row):
         """
-        Verifies the session token of a user
+        Serializes a row of row_query() the same way as serialize()
         """
-        return session_token == self.session_token and datetime.datetime.now() < self.session_expiration
+        pod_serialized = None
+        if row[5] is not None:
+            pod_serialized = {
+                "id": row[5],
+                "name": row[6],
+                "description": row[7],
+                "join_code": row[8],
+            }
+        return {
+            "id": row[0],
+            "username": row[1],
+            "password": row[2],
+            "tasks_completed": row[3],
+            "leader": row[4],
+            "pod": pod_serialized,
+        }
 
-    def verify_update_token(self, update_token):
+    def verify_password(self, password):
         """
-        Verifies the update token of a user
+        Verifies the password of a user against its stored hash
         """
-        return update_token == self.update_token
+        return password_hasher.verify(password, self.password)
 
 
 class Pod(db.Model):
@@ -113,7 +146,20 @@ class Pod(db.Model):
     name = db.Column(db.String, nullable=False)
     description = db.Column(db.String, nullable=False)
     join_code = db.Column(db.String, nullable = False)
-    tasks = db.relationship("Task", cascade="delete")
+    total_tasks = db.Column(db.Integer, nullable=False, server_default="0")
+    completed_tasks = db.Column(db.Integer, nullable=False, server_default="0")
+    incomplete_tasks = db.Column(db.Integer, nullable=False, server_default="0")
+    # bumped by every write to the pod, its tasks or its members; starts at
+    # the creation time in microseconds so a pod that reuses a deleted
+    # pod's id never repeats one of its versions
+    version = db.Column(db.BigInteger, nullable=False, server_default="0")
+    # bumped only by writes to the pod's members or their tasks_completed,
+    # see projections.py
+    members_version = db.Column(db.BigInteger, nullable=False, server_default="0")
+    tasks = db.relationship("Task", cascade="delete", back_populates="pod")
+    __table_args__ = (
+        db.Index("ux_pod_join_code", "join_code", unique=True),
+    )
 
 
     def __init__(self, **kwargs):
@@ -122,18 +168,36 @@ class Pod(db.Model):
         """
         self.name = kwargs.get("name", "")
         self.description = kwargs.get("description", "")
-        self.join_code = random.randint(1000,9999)
+        self.join_code = kwargs.get("join_code")
+        self.total_tasks = 0
+        self.completed_tasks = 0
+        self.incomplete_tasks = 0
+        self.version = int(time.time() * 1000000)
+        self.members_version = self.version
 
-    def serialize(self):
+    def serialize(self, tasks=None, tasks_next_cursor=None):
         """
         Serialize Pod object
+
+        Serializes every task of the pod unless a page of already serialized
+        tasks is given, in which case the cursor of the next page is
+        included as well
         """
+        if tasks is None:
+            return {
+                "id": self.id,
+                "name": self.name,
+                "description": self.description,
+                "join_code": self.join_code,
+                "tasks": [t.serialize() for t in self.tasks],
+            }
         return {
             "id": self.id,
             "name": self.name,
             "description": self.description,
             "join_code": self.join_code,
-            "tasks": [t.serialize() for t in self.tasks],
+            "tasks": tasks,
+            "tasks_next_cursor": tasks_next_cursor,
         }
 
     def simple_serialize(self):
@@ -147,6 +211,67 @@ class Pod(db.Model):
             "join_code": self.join_code,
         }
 
+    @staticmethod
+    def bump_version(pod_id):
+        """
+        Marks a pod as changed, invalidating cached reads of it
+        """
+        Pod.query.filter(Pod.id == pod_id).update(
+            {Pod.version: Pod.version + 1}, synchronize_session=False
+        )
+
+    @staticmethod
+    def bump_members_version(pod_id):
+        """
+        Marks a pod's members as changed and returns the new members_version
+
+        The version is read back in the same transaction, which holds the
+        row's write lock, so it is the one this change produced
+        """
+        Pod.query.filter(Pod.id == pod_id).update(
+            {Pod.members_version: Pod.members_version + 1}, synchronize_session=False
+        )
+        return db.session.query(Pod.members_version).filter(Pod.id == pod_id).scalar()
+
+    @staticmethod
+    def serialize_options():
+        """
+        Loader options that eager-load everything serialize() reads
+        """
+        return (
+            selectinload(Pod.tasks).joinedload(Task.creator),
+            selectinload(Pod.tasks).joinedload(Task.completer),
+        )
+
+    @staticmethod
+    def row_query():
+        """
+        Query of the columns serialize_row() reads
+        """
+        return db.session.query(Pod.id, Pod.name, Pod.description, Pod.join_code)
+
+    @staticmethod
+    def serialize_row(row, tasks=None, tasks_next_cursor=None):
+        """
+        Serializes a row of row_query() the same way as simple_serialize(),
+        or as serialize() when a page of serialized tasks is given
+        """
+        if tasks is None:
+            return {
+                "id": row[0],
+                "name": row[1],
+                "description": row[2],
+                "join_code": row[3],
+            }
+        return {
+            "id": row[0],
+            "name": row[1],
+            "description": row[2],
+            "join_code": row[3],
+            "tasks": tasks,
+            "tasks_next_cursor": tasks_next_cursor,
+        }
+
 
 class Task(db.Model):
     """
@@ -161,6 +286,17 @@ class Task(db.Model):
     pod_id=db.Column(db.Integer, db.ForeignKey("pod.id"), nullable=False)
     creator_id=db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     completer_id=db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    # null for tasks written before these columns until backfill_rollups runs
+    created_at = db.Column(db.DateTime, nullable=True)
+    # when the task was last marked done; null while it is not done
+    completed_at = db.Column(db.DateTime, nullable=True)
+    pod = db.relationship("Pod", back_populates="tasks")
+    creator = db.relationship("User", foreign_keys=[creator_id])
+    completer = db.relationship("User", foreign_keys=[completer_id])
+    __table_args__ = (
+        db.Index("ix_tasks_pod_id_status", "pod_id", "status"),
+        db.Index("ix_tasks_completer_id_status", "completer_id", "status"),
+    )
 
     def __init__(self, **kwargs):
         """
@@ -171,22 +307,253 @@ class Task(db.Model):
         self.creator_id=kwargs.get("creator_id")
         self.completer_id=kwargs.get("completer_id")
         self.status = False
+        self.created_at = kwargs.get("created_at") or datetime.datetime.now()
+        self.completed_at = None
 
     def serialize(self):
         """
         serialize Task object
         """
-        pod = Pod.query.filter_by(id = self.pod_id).first()
-        creator = User.query.filter_by(id = self.creator_id).first().username
-        completer = User.query.filter_by(id = self.completer_id).first()
         completer_user = None
-        if completer is not None:
-            completer_user = completer.username
+        if self.completer is not None:
+            completer_user = self.completer.username
         return {
             "id": self.id,
             "description": self.description,
             "status": self.status,
-            "pod": pod.name,
-            "created by": creator,
+            "pod": self.pod.name,
+            "created by": self.creator.username,
             "completed by": completer_user
         }
+
+    @staticmethod
+    def serialize_options():
+        """
+        Loader options that eager-load everything serialize() reads
+        """
+        return (
+            joinedload(Task.pod),
+            joinedload(Task.creator),
+            joinedload(Task.completer),
+        )
+
+    @staticmethod
+    def row_query():
+        """
+        Query of the columns serialize_row() reads, with the pod, creator
+        and completer outer joined
+        """
+        creator = aliased(User)
+        completer = aliased(User)
+        return (
+            db.session.query(
+                Task.id, Task.description, Task.status, Task.pod_id,
+                Pod.name.label("pod_name"),
+                creator.username.label("creator_username"),
+                completer.username.label("completer_username"),
+            )
+            .outerjoin(Pod, Task.pod_id == Pod.id)
+            .outerjoin(creator, Task.creator_id == creator.id)
+            .outerjoin(completer, Task.completer_id == completer.id)
+        )
+
+    @staticmethod
+    def serialize_row(row):
+        """
+        Serializes a row of row_query() the same way as serialize()
+        """
+        return {
+            "id": row[0],
+            "description": row[1],
+            "status": row[2],
+            "pod": row[4],
+            "created by": row[5],
+            "completed by": row[6]
+        }
+
+
+class Job(db.Model):
+    """
+    Job model
+    A unit of background work run by the worker pool in jobs.py
+    """
+    __tablename__ = "jobs"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String, nullable=False)
+    # JSON object of the job's arguments
+    params = db.Column(db.String, nullable=False)
+    # "queued", "running", "done" or "failed"
+    status = db.Column(db.String, nullable=False)
+    # rows processed so far
+    progress = db.Column(db.Integer, nullable=False, server_default="0")
+    attempts = db.Column(db.Integer, nullable=False, server_default="0")
+    # JSON result of a finished job, or the error of a failed one
+    result = db.Column(db.String, nullable=True)
+    error = db.Column(db.String, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # a running job whose lease has expired was left by a dead worker
+    lease_expires = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (
+        db.Index("ix_jobs_status_id", "status", "id"),
+    )
+
+    def __init__(self, **kwargs):
+        """
+        Initializes a queued Job object
+        """
+        self.kind = kwargs.get("kind")
+        self.params = kwargs.get("params", "{}")
+        self.status = "queued"
+        self.progress = 0
+        self.attempts = 0
+        self.created_at = datetime.datetime.now()
+
+    def serialize(self):
+        """
+        Serializes a Job object
+        """
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "params": json.loads(self.params),
+            "status": self.status,
+            "progress": self.progress,
+            "attempts": self.attempts,
+            "result": json.loads(self.result) if self.result is not None else None,
+            "error": self.error,
+            "created_at": str(self.created_at),
+            "started_at": str(self.started_at) if self.started_at is not None else None,
+            "finished_at": str(self.finished_at) if self.finished_at is not None else None,
+        }
+
+
+class UserSession(db.Model):
+    """
+    Session model
+    One signed-in device of a User; only hashes of its tokens are stored
+    """
+    __tablename__ = "sessions"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    token_hash = db.Column(db.String, nullable=False)
+    update_token_hash = db.Column(db.String, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    # the update token can renew the session until then; the row is swept after
+    renew_until = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (
+        db.Index("ux_sessions_token_hash", "token_hash", unique=True),
+        db.Index("ux_sessions_update_token_hash", "update_token_hash", unique=True),
+        db.Index("ix_sessions_user_id", "user_id"),
+        db.Index("ix_sessions_renew_until", "renew_until"),
+    )
+
+    def __init__(self, **kwargs):
+        """
+        Initializes a UserSession object
+        """
+        self.user_id = kwargs.get("user_id")
+
+    @staticmethod
+    def hash_token(token):
+        """
+        Returns the stored form of a session or update token
+        """
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def renew(self, lifetime, renew_window):
+        """
+        Renews the session, i.e.
+        1. Creates a new session token, valid for lifetime
+        2. Creates a new update token, valid for renew_window after that
+
+        The tokens are kept on the object (but not stored) for the response
+        """
+        self.session_token = secrets.token_hex(20)
+        self.update_token = secrets.token_hex(20)
+        self.token_hash = UserSession.hash_token(self.session_token)
+        self.update_token_hash = UserSession.hash_token(self.update_token)
+        self.expires_at = datetime.datetime.now() + lifetime
+        self.renew_until = self.expires_at + renew_window
+
+
+class PodEvent(db.Model):
+    """
+    PodEvent model
+    One entry of a pod's change feed, see events_dao.py
+    """
+    __tablename__ = "pod_events"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    pod_id = db.Column(db.Integer, db.ForeignKey("pod.id"), nullable=False)
+    # the pod's version right after the change; shared by the events of one change
+    seq = db.Column(db.BigInteger, nullable=False)
+    kind = db.Column(db.String, nullable=False)
+    # JSON snapshot of the task or member the event is about
+    data = db.Column(db.String, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (
+        db.Index("ix_pod_events_pod_id_seq", "pod_id", "seq"),
+    )
+
+    def __init__(self, **kwargs):
+        """
+        Initializes a PodEvent object
+        """
+        self.pod_id = kwargs.get("pod_id")
+        self.seq = kwargs.get("seq")
+        self.kind = kwargs.get("kind")
+        self.data = kwargs.get("data")
+        self.created_at = datetime.datetime.now()
+
+    @staticmethod
+    def row_query():
+        """
+        Query of the columns serialize_row() reads
+        """
+        return db.session.query(PodEvent.seq, PodEvent.kind, PodEvent.data, PodEvent.created_at)
+
+    @staticmethod
+    def serialize_row(row):
+        """
+        Serializes a row of row_query()
+        """
+        return {
+            "seq": row[0],
+            "kind": row[1],
+            "data": json.loads(row[2]),
+            "at": str(row[3]),
+        }
+
+
+class PodRollup(db.Model):
+    """
+    PodRollup model
+    Tasks of a pod created and completed in one hour or day, see rollups_dao.py
+    """
+    __tablename__ = "pod_rollups"
+    pod_id = db.Column(db.Integer, db.ForeignKey("pod.id"), primary_key=True)
+    # "hour" or "day"
+    period = db.Column(db.String, primary_key=True)
+    # start of the hour or day
+    bucket = db.Column(db.DateTime, primary_key=True)
+    created = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UserRollup(db.Model):
+    """
+    UserRollup model
+    Tasks of a pod created and completed by a user in one hour or day, see
+    rollups_dao.py
+    """
+    __tablename__ = "user_rollups"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    pod_id = db.Column(db.Integer, db.ForeignKey("pod.id"), primary_key=True)
+    period = db.Column(db.String, primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    created = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (
+        db.Index("ix_user_rollups_pod_id_period_bucket", "pod_id", "period", "bucket"),
+    )
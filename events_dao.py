@@ -0,0 +1,114 @@
+"""
+DAO (Data Access Object) file
+
+Helper file for the per-pod change feed: an append-only log of the task
+and member changes of each pod, written in the same transaction as the
+change it describes.
+
+An event's seq is the pod's version right after the change (see
+Pod.version), read back inside the transaction that bumped it. Writes to a
+pod are serialized by the lock on its row, so seqs grow in commit order,
+and the events of one change (a batch of tasks) share a seq. A client
+reads the events after the last seq it has seen, which is a range scan of
+the (pod_id, seq) index, so a refresh costs O(changes) rather than
+O(pod size).
+"""
+
+import datetime
+import json
+
+from db import db, Pod, PodEvent, Task
+
+TASK_CREATED = "task_created"
+TASK_UPDATED = "task_updated"
+MEMBER_JOINED = "member_joined"
+MEMBER_LEFT = "member_left"
+
+
+def _insert(pod_id, kind, payloads):
+    """
+    Logs an event of the given kind for every payload, at the pod's current
+    version; the version must already have been bumped in this transaction
+    """
+    if not payloads:
+        return
+    seq = db.session.query(Pod.version).filter(Pod.id == pod_id).scalar()
+    now = datetime.datetime.now()
+    db.session.execute(
+        PodEvent.__table__.insert(),
+        [
+            {"pod_id": pod_id, "seq": seq, "kind": kind, "data": json.dumps(payload), "created_at": now}
+            for payload in payloads
+        ],
+    )
+
+
+def record_task_events(pod_id, kind, task_ids):
+    """
+    Logs an event with the current state of each of the pod's tasks
+
+    Task ids are bound in one IN (...) clause, so callers pass at most
+    tasks_dao.IN_CHUNK_SIZE of them at a time
+    """
+    rows = Task.row_query().filter(Task.id.in_(task_ids)).order_by(Task.id).all()
+    _insert(pod_id, kind, [Task.serialize_row(row) for row in rows])
+
+
+def record_member_event(pod_id, kind, user):
+    """
+    Logs a member joining or leaving the pod
+    """
+    _insert(pod_id, kind, [{
+        "id": user.id,
+        "username": user.username,
+        "tasks_completed": user.tasks_completed,
+        "leader": user.leader,
+    }])
+
+
+def latest_seq(pod_id):
+    """
+    Returns the seq the next change of the pod will be logged after, or
+    None if there is no such pod
+    """
+    return db.session.query(Pod.version).filter(Pod.id == pod_id).scalar()
+
+
+def events_since(pod_id, since, limit):
+    """
+    Returns the serialized events of the pod after seq since, oldest first
+
+    Returns about limit events, never splitting the events of one change
+    """
+    query = PodEvent.row_query().filter(PodEvent.pod_id == pod_id)
+    rows = query.filter(PodEvent.seq > since).order_by(PodEvent.seq, PodEvent.id).limit(limit + 1).all()
+    if len(rows) > limit:
+        split_seq = rows[limit][0]
+        complete = [row for row in rows[:limit] if row[0] != split_seq]
+        if not complete:
+            # a single change with more than limit events
+            complete = query.filter(PodEvent.seq == split_seq).order_by(PodEvent.id).all()
+        rows = complete
+    return [PodEvent.serialize_row(row) for row in rows]
+
+
+def delete_events_chunk(pod_id, chunk_size):
+    """
+    Deletes and commits about chunk_size of the oldest events of a pod
+
+    Returns the number of events deleted, 0 once the pod has none left
+    """
+    last_seq = (
+        db.session.query(PodEvent.seq)
+        .filter(PodEvent.pod_id == pod_id)
+        .order_by(PodEvent.seq)
+        .offset(chunk_size - 1)
+        .limit(1)
+        .scalar()
+    )
+    query = PodEvent.query.filter(PodEvent.pod_id == pod_id)
+    if last_seq is not None:
+        query = query.filter(PodEvent.seq <= last_seq)
+    deleted = query.delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
@@ -0,0 +1,59 @@
+"""
+Helper file for streaming bulk exports as newline-delimited JSON
+
+Rows are read from the database in batches with yield_per as plain column
+tuples (no ORM objects) and encoded one line at a time, so memory use does
+not grow with the size of the table.
+"""
+
+from db import User, Pod, Task
+import serialization
+
+EXPORT_BATCH_SIZE = 1000
+
+
+def _user_rows():
+    """
+    Returns the query and row serializer for exporting users
+    """
+    return User.row_query(), User.serialize_row
+
+
+def _pod_rows():
+    """
+    Returns the query and row serializer for exporting pods (without tasks)
+    """
+    return Pod.row_query(), Pod.serialize_row
+
+
+def _task_rows():
+    """
+    Returns the query and row serializer for exporting tasks
+    """
+    return Task.row_query(), Task.serialize_row
+
+
+EXPORTS = {
+    "users": (User, _user_rows),
+    "pods": (Pod, _pod_rows),
+    "tasks": (Task, _task_rows),
+}
+
+
+def ndjson_rows(kind, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Returns a generator of NDJSON lines for every row of the given kind,
+    or None if kind is not exportable
+    """
+    if kind not in EXPORTS:
+        return None
+    model, rows = EXPORTS[kind]
+
+    def generate():
+        # the query is built here so it runs on the session of the context
+        # the response is streamed in, not one already torn down
+        query, serialize = rows()
+        for row in query.order_by(model.id).yield_per(batch_size):
+            yield serialization.encode(serialize(row)) + "\n"
+
+    return generate()
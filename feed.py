@@ -0,0 +1,221 @@
+"""
+Long-poll and server-sent event delivery of the pod change feed
+
+Requests on the feed (see events_dao.py) that have no new events wait
+here for the next change to their pod. Writes in this process wake the
+waiters of their pod as soon as they commit; changes committed by other
+processes are picked up by re-reading the feed every POLL_INTERVAL
+seconds. While waiting, a request hands its database connection back to
+the pool.
+
+An SSE stream sends one message per event, with the event's seq as the
+message id on the last event of each change, so a client reconnecting
+with Last-Event-ID resumes after the last complete change it received.
+Streams send a comment every HEARTBEAT seconds to keep proxies from
+closing them, and end after STREAM_SECONDS so that the worker thread is
+freed; EventSource clients reconnect by themselves.
+
+Every waiting request holds a worker thread (or, under asgi.py, one of the
+ASGI_THREADS bridge threads), so at most MAX_WATCHERS streams and waiting
+long-polls run at once per app process. The rest are answered 503 with a
+Retry-After of RETRY_AFTER seconds instead of taking the threads the other
+routes need.
+"""
+
+import json
+import threading
+import time
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from db import db
+import events_dao
+
+POLL_INTERVAL = 1.0
+# longest a long-poll request may wait for a change
+MAX_WAIT = 30
+HEARTBEAT = 15
+STREAM_SECONDS = 300
+# streams and waiting long-polls at once (0 for no cap); keep it below the worker's threads
+MAX_WATCHERS = 4
+RETRY_AFTER = 5
+
+
+class ChangeNotifier(object):
+    """
+    Wakes the requests waiting on a pod when it changes
+    """
+
+    def __init__(self, poll_interval=POLL_INTERVAL, max_watchers=MAX_WATCHERS):
+        """
+        Initializes a ChangeNotifier with no waiters
+        """
+        self.poll_interval = poll_interval
+        self.max_watchers = max_watchers
+        self.watchers = 0
+        self.turned_away = 0
+        # pod id -> [number of watches, number of changes seen]
+        self._pods = {}
+        self._condition = threading.Condition()
+
+    def init_app(self, app):
+        """
+        Makes this the feed notifier of app
+        """
+        app.extensions["feed_notifier"] = self
+
+    def notify(self, pod_id):
+        """
+        Records a committed change to a pod
+        """
+        with self._condition:
+            entry = self._pods.get(pod_id)
+            if entry is not None:
+                entry[1] = entry[1] + 1
+                self._condition.notify_all()
+
+    def admit(self):
+        """
+        Takes a watcher slot; returns false if every slot is taken
+        """
+        with self._condition:
+            if self.max_watchers and self.watchers >= self.max_watchers:
+                self.turned_away = self.turned_away + 1
+                return False
+            self.watchers = self.watchers + 1
+            return True
+
+    def leave(self):
+        """
+        Gives back a watcher slot taken by admit
+        """
+        with self._condition:
+            self.watchers = self.watchers - 1
+
+    def watch(self, pod_id):
+        """
+        Returns a Watch of the pod's changes from now on
+        """
+        return Watch(self, pod_id)
+
+    def stats(self):
+        """
+        Returns the number of pods and requests being watched, and the
+        watcher slots in use, their cap and the requests turned away
+        """
+        with self._condition:
+            return {"pods": len(self._pods), "watches": sum(entry[0] for entry in self._pods.values()),
+                    "watchers": self.watchers, "max_watchers": self.max_watchers,
+                    "turned_away": self.turned_away}
+
+
+class Watch(object):
+    """
+    Context manager that waits for the changes of one pod
+    """
+
+    def __init__(self, notifier, pod_id):
+        """
+        Initializes a Watch
+        """
+        self.notifier = notifier
+        self.pod_id = pod_id
+        self.changes = 0
+
+    def __enter__(self):
+        """
+        Starts watching the pod
+        """
+        with self.notifier._condition:
+            entry = self.notifier._pods.setdefault(self.pod_id, [0, 0])
+            entry[0] = entry[0] + 1
+            self.changes = entry[1]
+        return self
+
+    def __exit__(self, *exc_info):
+        """
+        Stops watching the pod
+        """
+        with self.notifier._condition:
+            entry = self.notifier._pods[self.pod_id]
+            entry[0] = entry[0] - 1
+            if entry[0] == 0:
+                del self.notifier._pods[self.pod_id]
+
+    def wait(self, timeout):
+        """
+        Waits up to timeout seconds for a change since the last wait;
+        returns true if there was one
+        """
+        with self.notifier._condition:
+            entry = self.notifier._pods[self.pod_id]
+            changed = self.notifier._condition.wait_for(lambda: entry[1] != self.changes, timeout)
+            self.changes = entry[1]
+            return changed
+
+
+# the ChangeNotifier of the current app (see ChangeNotifier.init_app)
+notifier = LocalProxy(lambda: current_app.extensions["feed_notifier"])
+
+
+def _release_connection():
+    """
+    Ends the session's transaction so its connection goes back to the pool
+    """
+    db.session.rollback()
+
+
+def next_events(pod_id, since, limit, wait):
+    """
+    Returns the pod's events after since, waiting up to wait seconds for
+    one if there are none yet, or None if there is no such pod
+    """
+    deadline = time.monotonic() + wait
+    with notifier.watch(pod_id) as watch:
+        while True:
+            if events_dao.latest_seq(pod_id) is None:
+                return None
+            events = events_dao.events_since(pod_id, since, limit)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            _release_connection()
+            watch.wait(min(notifier.poll_interval, remaining))
+
+
+def sse_message(event, last_of_change):
+    """
+    Returns an event as a server-sent event message
+    """
+    lines = ["event: %s" % event["kind"], "data: %s" % json.dumps(event)]
+    if last_of_change:
+        lines.insert(0, "id: %d" % event["seq"])
+    return "\n".join(lines) + "\n\n"
+
+
+def stream_events(pod_id, since, limit, seconds=STREAM_SECONDS, heartbeat=HEARTBEAT):
+    """
+    Yields the pod's events after since as server-sent event messages as
+    they are logged, for up to seconds seconds or until the pod is deleted
+    """
+    started = time.monotonic()
+    last_sent = started
+    yield "retry: %d\n\n" % int(notifier.poll_interval * 1000)
+    with notifier.watch(pod_id) as watch:
+        while time.monotonic() - started < seconds:
+            if events_dao.latest_seq(pod_id) is None:
+                return
+            events = events_dao.events_since(pod_id, since, limit)
+            _release_connection()
+            for index, event in enumerate(events):
+                last_of_change = index == len(events) - 1 or events[index + 1]["seq"] != event["seq"]
+                yield sse_message(event, last_of_change)
+            if events:
+                since = events[-1]["seq"]
+                last_sent = time.monotonic()
+                continue
+            if time.monotonic() - last_sent >= heartbeat:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            watch.wait(notifier.poll_interval)
@@ -0,0 +1,111 @@
+"""
+Conditional GET support and a cache of serialized response bodies
+
+A cached read is identified by a key built from the version stamps of the
+rows it depends on (see Pod.version), so a key changes whenever a write
+path bumps one of those stamps. The key's digest is sent as a strong
+ETag; a request whose If-None-Match carries it is answered with 304
+without serializing anything, and other requests reuse the serialized
+body of the key while it stays in the LRU cache.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request
+from werkzeug.local import LocalProxy
+
+from instrumentation import dumps
+
+MAX_ENTRIES = 1024
+
+
+class ResponseCache(object):
+    """
+    LRU cache of key -> serialized response body
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        """
+        Initializes an empty ResponseCache
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Makes this the response_cache of app
+        """
+        app.extensions["response_cache"] = self
+
+    def get(self, key):
+        """
+        Returns the body cached for key, or None
+        """
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses = self.misses + 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits = self.hits + 1
+            return body
+
+    def put(self, key, body):
+        """
+        Caches the body for key, evicting the least recently used entries
+        """
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes every entry and resets the counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and current size of the cache
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+# the ResponseCache of the current app (see ResponseCache.init_app)
+response_cache = LocalProxy(lambda: current_app.extensions["response_cache"])
+
+
+def etag_for(key):
+    """
+    Returns the (unquoted) strong ETag of a cache key
+    """
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+
+def cached_json(key, build, status=200):
+    """
+    Returns a Flask response for the JSON body identified by key
+
+    build is only called when the client's copy is stale and the body is
+    not cached
+    """
+    tag = etag_for(key)
+    headers = {"ETag": '"%s"' % tag}
+    if request.if_none_match.contains(tag):
+        return "", 304, headers
+    body = response_cache.get(key)
+    if body is None:
+        body = dumps(build())
+        response_cache.put(key, body)
+    return body, status, headers
@@ -0,0 +1,252 @@
+"""
+Per-request instrumentation
+
+Hooks the SQLAlchemy engine's before/after_cursor_execute events and the
+Flask request cycle to record, for every request, the number of SQL
+statements, the time spent in the database, the time spent encoding JSON
+(bodies encoded through dumps) and the response size. These are sent back
+in a Server-Timing header and aggregated into per-route histograms served
+in the Prometheus text format at /metrics. Requests slower than
+SLOW_REQUEST_MS are logged to the "poductivity.slow" logger along with a
+fingerprint of each statement they ran.
+
+Metrics are kept per app, in each process.
+"""
+
+import logging
+import re
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from werkzeug.local import LocalProxy
+
+import serialization
+
+SLOW_REQUEST_MS = 500
+# statements kept per request for the slow log
+MAX_FINGERPRINTS = 200
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+slow_log = logging.getLogger("poductivity.slow")
+
+_IN_LIST = re.compile(r"\(\s*\?(\s*,\s*\?)+\s*\)")
+_LITERAL = re.compile(r"'[^']*'|\b\d+\b")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """
+    Returns a statement with literals and IN lists collapsed, so that
+    statements differing only in their values compare equal
+    """
+    statement = _LITERAL.sub("?", statement)
+    statement = _IN_LIST.sub("(?+)", statement)
+    return _SPACE.sub(" ", statement).strip()
+
+
+def dumps(obj):
+    """
+    Encodes obj as JSON, adding the time spent to the current request
+    """
+    started = time.perf_counter()
+    body = serialization.encode(obj)
+    if has_request_context() and "instrumentation" in g:
+        g.instrumentation["serialize"] += time.perf_counter() - started
+    return body
+
+
+class Histogram(object):
+    """
+    Cumulative histogram in the Prometheus style
+    """
+
+    def __init__(self, buckets):
+        """
+        Initializes an empty Histogram with the given upper bounds
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0
+
+    def observe(self, value):
+        """
+        Records one value
+        """
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+
+class Metrics(object):
+    """
+    Per-route request histograms plus counters from other components
+    """
+
+    HISTOGRAMS = (
+        ("poductivity_request_duration_seconds", "Time to handle a request", SECONDS_BUCKETS),
+        ("poductivity_request_db_seconds", "Time spent in the database per request", SECONDS_BUCKETS),
+        ("poductivity_request_serialize_seconds", "Time spent encoding JSON per request", SECONDS_BUCKETS),
+        ("poductivity_request_queries", "SQL statements per request", QUERY_BUCKETS),
+        ("poductivity_response_size_bytes", "Response body size", SIZE_BUCKETS),
+    )
+
+    def __init__(self):
+        """
+        Initializes an empty Metrics registry
+        """
+        self._routes = {}
+        self._counters = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Makes this the metrics of app
+        """
+        app.extensions["metrics"] = self
+
+    def observe(self, route, method, values):
+        """
+        Records the values (in HISTOGRAMS order) of one request
+        """
+        key = (route, method)
+        with self._lock:
+            histograms = self._routes.get(key)
+            if histograms is None:
+                histograms = [Histogram(buckets) for _, _, buckets in self.HISTOGRAMS]
+                self._routes[key] = histograms
+            for histogram, value in zip(histograms, values):
+                if value is not None:
+                    histogram.observe(value)
+
+    def register_counters(self, prefix, stats):
+        """
+        Exports the numbers returned by stats() as <prefix>_<name> gauges
+        """
+        self._counters.append((prefix, stats))
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            routes = sorted(self._routes.items())
+            for index, (name, help_text, _) in enumerate(self.HISTOGRAMS):
+                lines.append("# HELP %s %s" % (name, help_text))
+                lines.append("# TYPE %s histogram" % name)
+                for (route, method), histograms in routes:
+                    histogram = histograms[index]
+                    labels = 'route="%s",method="%s"' % (route, method)
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+                    lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, histogram.count))
+                    lines.append("%s_sum{%s} %s" % (name, labels, histogram.total))
+                    lines.append("%s_count{%s} %d" % (name, labels, histogram.count))
+        for prefix, stats in self._counters:
+            for key, value in sorted(stats().items()):
+                lines.append("# TYPE %s_%s gauge" % (prefix, key))
+                lines.append("%s_%s %s" % (prefix, key, value))
+        return "\n".join(lines) + "\n"
+
+
+# the Metrics of the current app (see Metrics.init_app)
+metrics = LocalProxy(lambda: current_app.extensions["metrics"])
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Notes when a statement starts
+    """
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Adds a finished statement to the current request
+    """
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if not has_request_context() or "instrumentation" not in g:
+        return
+    stats = g.instrumentation
+    stats["queries"] += 1
+    stats["db"] += elapsed
+    if len(stats["statements"]) < MAX_FINGERPRINTS:
+        stats["statements"].append((statement, elapsed))
+
+
+def _before_request():
+    """
+    Starts recording the current request
+    """
+    g.instrumentation = {
+        "started": time.perf_counter(),
+        "queries": 0,
+        "db": 0.0,
+        "serialize": 0.0,
+        "statements": [],
+    }
+
+
+def _slow_request(app, route, total, stats):
+    """
+    Logs a slow request with the fingerprints of the statements it ran
+    """
+    grouped = {}
+    for statement, elapsed in stats["statements"]:
+        key = fingerprint(statement)
+        count, spent = grouped.get(key, (0, 0.0))
+        grouped[key] = (count + 1, spent + elapsed)
+    lines = [
+        "%5dx %8.2fms  %s" % (count, spent * 1000, key)
+        for key, (count, spent) in sorted(grouped.items(), key=lambda item: -item[1][1])
+    ]
+    slow_log.warning(
+        "slow request %s %s (%s): %.1fms total, %.1fms in %d queries, %.1fms serializing\n%s",
+        request.method, request.full_path.rstrip("?"), route, total * 1000, stats["db"] * 1000,
+        stats["queries"], stats["serialize"] * 1000, "\n".join(lines),
+    )
+
+
+def _after_request_for(app):
+    """
+    Returns the after_request hook that reports and records a request
+    """
+
+    def after_request(response):
+        stats = g.pop("instrumentation", None)
+        if stats is None:
+            return response
+        total = time.perf_counter() - stats["started"]
+        response.headers["Server-Timing"] = (
+            'db;dur=%.2f;desc="%d queries", serialize;dur=%.2f, total;dur=%.2f'
+            % (stats["db"] * 1000, stats["queries"], stats["serialize"] * 1000, total * 1000)
+        )
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        size = None if response.is_streamed else response.calculate_content_length()
+        app.extensions["metrics"].observe(route, request.method,
+                                          (total, stats["db"], stats["serialize"], stats["queries"], size))
+        if total * 1000 >= app.config.get("SLOW_REQUEST_MS", SLOW_REQUEST_MS):
+            _slow_request(app, route, total, stats)
+        return response
+
+    return after_request
+
+
+def init_app(app, engine):
+    """
+    Instruments the app's requests and the statements run on engine, and
+    gives app its own Metrics
+    """
+    Metrics().init_app(app)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    app.before_request(_before_request)
+    app.after_request(_after_request_for(app))
@@ -0,0 +1,405 @@
+"""
+Background jobs
+
+Slow maintenance work (deleting a pod and its tasks, taking a user out of
+a pod, rebuilding the task counters or the analytics rollups) runs as a job instead of inside the
+request. A job is a row of the jobs table in the app's own database, so
+it survives restarts: the route enqueues it and answers 202 with the job,
+and GET /api/job/<id>/ reports its status and result.
+
+Each app process runs a pool of WORKERS threads, started by its first
+request (after a fork, the child starts its own); jobs queued from the
+command line are run by the app's workers. A worker
+claims the oldest queued job with a conditional UPDATE, so no two workers
+or processes run the same job, and runs it in an app context. Handlers do
+their writes in chunks of CHUNK_SIZE rows, each committed on its own, so
+a large pod never holds SQLite's write lock for long. Every chunk renews
+the job's lease; a running job whose lease has expired was left by a
+worker that died and is claimed again. Handlers are written so that
+running them again from the start is safe. A job that raises is retried
+up to MAX_ATTEMPTS times before it is marked failed.
+
+Periodic jobs (the session sweeper) are registered with schedule(); an
+idle worker queues each one once its interval has passed.
+"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import and_, or_
+from werkzeug.local import LocalProxy
+
+from db import db, Job
+import events_dao
+import feed
+import pods_dao
+import rollups_dao
+import stats_dao
+import users_dao
+from projections import pod_projections
+
+WORKERS = 2
+CHUNK_SIZE = 500
+# seconds a claimed job may go without progress before another worker takes it
+LEASE_SECONDS = 60
+# seconds an idle worker waits before looking for jobs from other processes
+POLL_INTERVAL = 1.0
+MAX_ATTEMPTS = 3
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+log = logging.getLogger("poductivity.jobs")
+
+# job kind -> handler(job, **params) returning the job's JSON result
+HANDLERS = {}
+
+
+def handler(kind):
+    """
+    Registers the decorated function as the handler of a job kind
+    """
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def _encode(value):
+    """
+    Returns the stored JSON form of job params or results
+    """
+    return json.dumps(value, sort_keys=True)
+
+
+def get_job(job_id):
+    """
+    Returns the job with the given id, or None
+    """
+    return Job.query.filter_by(id=job_id).first()
+
+
+class RunningJob(object):
+    """
+    What a handler sees of the job it runs
+    """
+
+    def __init__(self, job_id, progress, chunk_size, lease):
+        """
+        Initializes a RunningJob
+        """
+        self.id = job_id
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.lease = lease
+
+    def checkpoint(self, rows):
+        """
+        Adds rows to the job's progress and renews its lease
+        """
+        self.progress = self.progress + rows
+        Job.query.filter(Job.id == self.id).update(
+            {Job.progress: self.progress,
+             Job.lease_expires: datetime.datetime.now() + self.lease},
+            synchronize_session=False,
+        )
+        db.session.commit()
+
+
+class JobQueue(object):
+    """
+    Durable job queue with an in-process pool of worker threads
+    """
+
+    def __init__(self, workers=WORKERS, chunk_size=CHUNK_SIZE, lease_seconds=LEASE_SECONDS,
+                 poll_interval=POLL_INTERVAL, max_attempts=MAX_ATTEMPTS):
+        """
+        Initializes a JobQueue; its workers are started on first use
+        """
+        self.app = None
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self._threads = []
+        self._pid = None
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # job kind -> [interval in seconds, monotonic time it is next due]
+        self._periodic = {}
+        self._periodic_lock = threading.Lock()
+        self.configure(workers, chunk_size, lease_seconds, poll_interval, max_attempts)
+
+    def configure(self, workers=WORKERS, chunk_size=CHUNK_SIZE, lease_seconds=LEASE_SECONDS,
+                  poll_interval=POLL_INTERVAL, max_attempts=MAX_ATTEMPTS):
+        """
+        Sets the pool size and job limits
+        """
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.lease = datetime.timedelta(seconds=lease_seconds)
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+
+    def init_app(self, app):
+        """
+        Makes this the job_queue of app: jobs run in app's context, and
+        the workers start on its first request
+        """
+        self.app = app
+        app.extensions["job_queue"] = self
+        app.before_request(self.start)
+
+    def start(self):
+        """
+        Starts the worker threads unless this process already runs them
+        """
+        if self._pid == os.getpid() or self.app is None or self.workers < 1:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stopping = False
+            self._threads = [
+                threading.Thread(target=self._work, name="poductivity-jobs-%d" % i, daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def stop(self, timeout=None):
+        """
+        Stops the worker threads once their current jobs finish
+        """
+        with self._lock:
+            self._stopping = True
+            self._wakeup.set()
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+            self._pid = None
+
+    def schedule(self, kind, interval):
+        """
+        Queues a job of the given kind (without params) every interval
+        seconds, starting when the workers start
+        """
+        with self._periodic_lock:
+            self._periodic[kind] = [interval, 0]
+
+    def enqueue_due(self):
+        """
+        Queues the periodic jobs whose interval has passed
+        """
+        now = time.monotonic()
+        due = []
+        with self._periodic_lock:
+            for kind, entry in self._periodic.items():
+                if entry[1] <= now:
+                    entry[1] = now + entry[0]
+                    due.append(kind)
+        for kind in due:
+            self.enqueue(kind)
+
+    def enqueue(self, kind, **params):
+        """
+        Queues and commits a job, and returns it
+
+        Returns the queued or running job with the same kind and params
+        instead if there is one
+        """
+        encoded = _encode(params)
+        job = Job.query.filter(
+            Job.status.in_((QUEUED, RUNNING)), Job.kind == kind, Job.params == encoded
+        ).first()
+        if job is None:
+            job = Job(kind=kind, params=encoded)
+            db.session.add(job)
+            db.session.commit()
+        self._wakeup.set()
+        return job
+
+    def _work(self):
+        """
+        Runs jobs until stopped, waiting for new ones when there are none
+        """
+        while not self._stopping:
+            try:
+                with self.app.app_context():
+                    self.enqueue_due()
+                    ran = self.run_next()
+            except Exception:
+                log.exception("Job worker error")
+                ran = False
+            if not ran and not self._stopping:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _claimable(self, now):
+        """
+        Returns the filter of jobs a worker may claim
+        """
+        return or_(Job.status == QUEUED, and_(Job.status == RUNNING, Job.lease_expires < now))
+
+    def claim(self):
+        """
+        Marks the oldest claimable job as running and returns its id, or None
+        """
+        while True:
+            now = datetime.datetime.now()
+            job_id = (
+                db.session.query(Job.id)
+                .filter(self._claimable(now))
+                .order_by(Job.id)
+                .limit(1)
+                .scalar()
+            )
+            if job_id is None:
+                return None
+            claimed = Job.query.filter(Job.id == job_id, self._claimable(now)).update(
+                {Job.status: RUNNING, Job.attempts: Job.attempts + 1, Job.started_at: now,
+                 Job.lease_expires: now + self.lease},
+                synchronize_session=False,
+            )
+            db.session.commit()
+            if claimed:
+                return job_id
+            # another worker claimed it first
+
+    def run_next(self):
+        """
+        Claims and runs one job; returns false if there was none
+        """
+        job_id = self.claim()
+        if job_id is None:
+            return False
+        self.run(get_job(job_id))
+        return True
+
+    def run(self, job):
+        """
+        Runs a claimed job and records its outcome
+        """
+        job_id, kind, attempts = job.id, job.kind, job.attempts
+        running = RunningJob(job_id, job.progress, self.chunk_size, self.lease)
+        try:
+            fn = HANDLERS.get(kind)
+            if fn is None:
+                raise ValueError("Unknown job kind: %s" % kind)
+            result = fn(running, **json.loads(job.params))
+        except Exception as e:
+            db.session.rollback()
+            log.exception("Job %d (%s) failed on attempt %d", job_id, kind, attempts)
+            if attempts < self.max_attempts:
+                self.retried = self.retried + 1
+                outcome = {Job.status: QUEUED, Job.error: str(e), Job.lease_expires: None}
+            else:
+                self.failed = self.failed + 1
+                outcome = {Job.status: FAILED, Job.error: str(e), Job.lease_expires: None,
+                           Job.finished_at: datetime.datetime.now()}
+        else:
+            self.completed = self.completed + 1
+            outcome = {Job.status: DONE, Job.result: _encode(result), Job.error: None,
+                       Job.lease_expires: None, Job.finished_at: datetime.datetime.now()}
+        Job.query.filter(Job.id == job_id).update(outcome, synchronize_session=False)
+        db.session.commit()
+
+    def stats(self):
+        """
+        Returns the job counters of this process
+        """
+        return {"workers": len([t for t in self._threads if t.is_alive()]),
+                "completed": self.completed, "failed": self.failed, "retried": self.retried}
+
+
+# the JobQueue of the current app (see JobQueue.init_app)
+job_queue = LocalProxy(lambda: current_app.extensions["job_queue"])
+
+
+@handler("delete_pod")
+def delete_pod(job, pod_id):
+    """
+    Deletes a pod's tasks, change feed and rollups a chunk at a time, then
+    the pod itself
+    """
+    tasks_deleted = 0
+    while True:
+        deleted = pods_dao.delete_tasks_chunk(pod_id, job.chunk_size)
+        if not deleted:
+            break
+        tasks_deleted = tasks_deleted + deleted
+        job.checkpoint(deleted)
+    while True:
+        deleted = events_dao.delete_events_chunk(pod_id, job.chunk_size)
+        if not deleted:
+            break
+        job.checkpoint(deleted)
+    while True:
+        deleted = rollups_dao.delete_rollups_chunk(pod_id, job.chunk_size)
+        if not deleted:
+            break
+        job.checkpoint(deleted)
+    outcome = pods_dao.delete_pod(pod_id)
+    pod_projections.discard(pod_id)
+    feed.notifier.notify(pod_id)
+    if outcome is None:
+        return {"deleted": False, "tasks_deleted": tasks_deleted}
+    last_tasks_deleted, members_removed = outcome
+    return {"deleted": True, "tasks_deleted": tasks_deleted + last_tasks_deleted,
+            "members_removed": members_removed}
+
+
+@handler("remove_user")
+def remove_user(job, pod_id, user_id):
+    """
+    Takes a user out of a pod
+    """
+    return {"removed": users_dao.remove_from_pod(user_id, pod_id)}
+
+
+@handler("rebuild_counters")
+def rebuild_counters(job):
+    """
+    Recomputes the task counters of pods and users a range of ids at a time
+    """
+    pods_fixed = 0
+    users_fixed = 0
+    max_id = stats_dao.max_counter_id()
+    for first_id in range(1, max_id + 1, job.chunk_size):
+        last_id = min(first_id + job.chunk_size - 1, max_id)
+        pods, users = stats_dao.rebuild_counters(first_id=first_id, last_id=last_id)
+        pods_fixed = pods_fixed + pods
+        users_fixed = users_fixed + users
+        job.checkpoint(last_id - first_id + 1)
+    return {"pods_fixed": pods_fixed, "users_fixed": users_fixed}
+
+
+@handler("backfill_rollups")
+def backfill_rollups(job):
+    """
+    Timestamps the tasks written before the timestamp columns, then
+    rebuilds the rollups a range of pods at a time
+    """
+    stamped, written = rollups_dao.backfill(job.chunk_size, job.checkpoint)
+    return {"timestamps_set": stamped, "rollups_written": written}
+
+
+@handler("sweep_sessions")
+def sweep_sessions(job):
+    """
+    Deletes the sessions that can no longer be renewed, a chunk at a time
+    """
+    while True:
+        deleted = users_dao.sweep_sessions(job.chunk_size)
+        if not deleted:
+            break
+        job.checkpoint(deleted)
+    return {"sessions_deleted": job.progress}
@@ -0,0 +1,80 @@
+"""
+Base routes: liveness, metrics, background jobs and exports, plus the
+error handlers shared by every blueprint
+"""
+
+from flask import Blueprint, Response, current_app, stream_with_context
+
+import export
+import instrumentation
+from instrumentation import dumps
+import jobs
+from passwords import HasherBusy
+import pods_dao
+
+blueprint = Blueprint("main", __name__)
+
+
+# BASE ROUTE
+
+
+@blueprint.route("/")
+def hello():
+    """
+    Endpoint for printing hello
+    """
+    return "hello"
+
+@blueprint.route("/metrics")
+def metrics():
+    """
+    Endpoint for the per-route request metrics in the Prometheus text format
+    """
+    return Response(instrumentation.metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@blueprint.app_errorhandler(pods_dao.JoinCodesExhausted)
+def join_codes_exhausted(e):
+    """
+    Reports a pod that could not be given a join code
+    """
+    return dumps({"error": "Could not allocate a join code, try again"}), 503, {"Retry-After": "1"}
+
+@blueprint.app_errorhandler(HasherBusy)
+def hasher_busy(e):
+    """
+    Sheds password checks while the hashing pool is saturated
+    """
+    return dumps({"error": "Server busy, try again shortly"}), 503, {"Retry-After": "1"}
+
+# JOB ROUTES
+
+
+def job_accepted(job):
+    """
+    Returns the 202 response of a route that handed its work to a job
+    """
+    return dumps(job.serialize()), 202, {"Location": "/api/job/%d/" % job.id}
+
+
+@blueprint.route("/api/job/<int:job_id>/")
+def get_job(job_id):
+    """
+    Endpoint for getting the status and result of a background job
+    """
+    job = jobs.get_job(job_id)
+    if job is None:
+        return dumps({"error": "job not found"}), 404
+    return dumps(job.serialize()), 200
+
+# EXPORT ROUTES
+
+
+@blueprint.route("/api/export/<kind>/")
+def export_ndjson(kind):
+    """
+    Endpoint for streaming every user, pod or task as newline-delimited JSON
+    """
+    rows = export.ndjson_rows(kind, current_app.config["EXPORT_BATCH_SIZE"])
+    if rows is None:
+        return dumps({"error": "can only export users, pods or tasks"}), 404
+    return Response(stream_with_context(rows), mimetype="application/x-ndjson")
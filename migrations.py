@@ -0,0 +1,225 @@
+"""
+Versioned schema migrations
+
+db.create_all() only creates missing tables, so changes to existing tables
+(new indexes, new columns) are applied here as numbered steps. The number
+of the last applied step is stored in the schema_version table. Steps are
+written so they are safe to run against a database that create_all() has
+just built from the current models.
+"""
+
+import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.schema import CreateTable
+
+from db import db, Job, Pod, Task, User, UserSession
+import pods_dao
+import stats_dao
+import users_dao
+
+
+def _create_indexes(connection, unique=False):
+    """
+    Creates every non-unique (or unique) index declared on the models that
+    does not exist yet
+    """
+    inspector = inspect(connection)
+    for table in db.metadata.sorted_tables:
+        existing = [i["name"] for i in inspector.get_indexes(table.name)]
+        for index in table.indexes:
+            if bool(index.unique) == unique and index.name not in existing:
+                index.create(bind=connection)
+
+
+def add_column(connection, table_name, column):
+    """
+    Adds a column to an existing table unless it is already there
+    """
+    existing = [c["name"] for c in inspect(connection).get_columns(table_name)]
+    if column.name in existing:
+        return
+    ddl = 'ALTER TABLE %s ADD COLUMN "%s" %s' % (
+        table_name, column.name, column.type.compile(dialect=connection.dialect))
+    if column.server_default is not None:
+        ddl = ddl + " DEFAULT %s" % column.server_default.arg
+    if not column.nullable:
+        ddl = ddl + " NOT NULL"
+    connection.execute(text(ddl))
+
+
+def rebuild_table(connection, table):
+    """
+    Recreates a table from its model, keeping the rows of the columns the
+    model still has; this is how columns are dropped in SQLite, which
+    cannot drop UNIQUE columns in place
+
+    Foreign keys pointing at the table are left as they are, which needs
+    PRAGMA foreign_keys to be off (SQLite's default)
+    """
+    existing = [c["name"] for c in inspect(connection).get_columns(table.name)]
+    kept = ", ".join('"%s"' % c.name for c in table.columns if c.name in existing)
+    metadata = MetaData()
+    for other in db.metadata.sorted_tables:
+        if other is not table:
+            other.tometadata(metadata)
+    rebuilt = table.tometadata(metadata, name=table.name + "_rebuilt")
+    connection.execute(CreateTable(rebuilt))
+    connection.execute(text("INSERT INTO %s (%s) SELECT %s FROM %s" % (rebuilt.name, kept, kept, table.name)))
+    connection.execute(text("DROP TABLE %s" % table.name))
+    connection.execute(text("ALTER TABLE %s RENAME TO %s" % (rebuilt.name, table.name)))
+    for index in table.indexes:
+        index.create(bind=connection)
+
+
+def drop_columns(connection, table, names):
+    """
+    Drops the columns of a table that its model no longer has
+    """
+    existing = [c["name"] for c in inspect(connection).get_columns(table.name)]
+    names = [name for name in names if name in existing]
+    if not names:
+        return
+    if connection.dialect.name == "sqlite":
+        rebuild_table(connection, table)
+        return
+    for name in names:
+        connection.execute(text('ALTER TABLE %s DROP COLUMN "%s"' % (table.name, name)))
+
+
+def _add_counters(connection):
+    """
+    Adds the denormalized task counters to pods and users and fills them in
+    """
+    add_column(connection, "pod", Pod.__table__.c.total_tasks)
+    add_column(connection, "pod", Pod.__table__.c.completed_tasks)
+    add_column(connection, "pod", Pod.__table__.c.incomplete_tasks)
+    add_column(connection, "users", User.__table__.c.verified_completions)
+    stats_dao.rebuild_counters(connection)
+
+
+def _add_pod_version(connection):
+    """
+    Adds the version stamp used for ETags to pods
+    """
+    add_column(connection, "pod", Pod.__table__.c.version)
+
+
+def _unique_join_codes(connection):
+    """
+    Gives every pod that shares its join code with an older pod a new code,
+    then replaces the plain join code index with a unique one
+    """
+    duplicates = connection.execute(text(
+        "SELECT id FROM pod WHERE id NOT IN (SELECT MIN(id) FROM pod GROUP BY join_code)"
+    )).fetchall()
+    for (pod_id,) in duplicates:
+        connection.execute(
+            text("UPDATE pod SET join_code = :join_code WHERE id = :id"),
+            {"join_code": pods_dao.unused_join_code(connection=connection), "id": pod_id},
+        )
+    connection.execute(text("DROP INDEX IF EXISTS ix_pod_join_code"))
+    _create_indexes(connection, unique=True)
+
+
+def _add_pod_members_version(connection):
+    """
+    Adds the version stamp of pod members used by the projections
+    """
+    add_column(connection, "pod", Pod.__table__.c.members_version)
+
+
+# the session columns users had before the sessions table
+_LEGACY_USERS = Table(
+    "users", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("session_token", String),
+    Column("session_expiration", DateTime),
+    Column("update_token", String),
+)
+
+
+def _move_sessions(connection, batch_size=5000):
+    """
+    Moves each user's session into the sessions table, as token hashes, and
+    drops the session columns from users
+
+    Update tokens never expired before, so every moved session can be
+    renewed for RENEW_WINDOW from now
+    """
+    existing = [c["name"] for c in inspect(connection).get_columns("users")]
+    if "session_token" not in existing:
+        return
+    renew_until = datetime.datetime.now() + users_dao.RENEW_WINDOW
+    rows = connection.execute(_LEGACY_USERS.select()).fetchall()
+    sessions = [
+        {
+            "user_id": row.id,
+            "token_hash": UserSession.hash_token(row.session_token),
+            "update_token_hash": UserSession.hash_token(row.update_token),
+            "expires_at": row.session_expiration,
+            "renew_until": renew_until,
+        }
+        for row in rows
+    ]
+    for start in range(0, len(sessions), batch_size):
+        connection.execute(UserSession.__table__.insert(), sessions[start:start + batch_size])
+    drop_columns(connection, User.__table__, ["session_token", "session_expiration", "update_token"])
+
+
+def _add_task_timestamps(connection):
+    """
+    Adds the created and completed timestamps to tasks, and queues the job
+    that stamps the existing tasks and builds their rollups
+    """
+    add_column(connection, "tasks", Task.__table__.c.created_at)
+    add_column(connection, "tasks", Task.__table__.c.completed_at)
+    if connection.execute(text("SELECT 1 FROM tasks LIMIT 1")).first() is not None:
+        connection.execute(Job.__table__.insert(), [{
+            "kind": "backfill_rollups", "params": "{}", "status": "queued", "progress": 0,
+            "attempts": 0, "created_at": datetime.datetime.now(),
+        }])
+
+
+# (version, description, step) in the order they must be applied
+MIGRATIONS = [
+    (1, "secondary indexes on hot lookup columns", _create_indexes),
+    (2, "denormalized pod and user task counters", _add_counters),
+    (3, "pod version stamp for conditional GETs", _add_pod_version),
+    (4, "unique join codes", _unique_join_codes),
+    (5, "pod members version stamp for projections", _add_pod_members_version),
+    (6, "sessions table replacing the session columns of users", _move_sessions),
+    (7, "task timestamps for the analytics rollups", _add_task_timestamps),
+]
+
+
+def current_version(connection):
+    """
+    Returns the version of the last migration applied, or 0
+    """
+    connection.execute(
+        text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    )
+    version = connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+
+def migrate():
+    """
+    Creates missing tables and applies every pending migration
+
+    Returns the schema version after migrating
+    """
+    db.create_all()
+    with db.engine.begin() as connection:
+        version = current_version(connection)
+        for number, description, step in MIGRATIONS:
+            if number <= version:
+                continue
+            step(connection)
+            connection.execute(
+                text("INSERT INTO schema_version (version) VALUES (:version)"),
+                {"version": number},
+            )
+            version = number
+    return version
@@ -0,0 +1,108 @@
+"""
+Helper file for keyset pagination of the list endpoints
+
+A page is requested with ?limit=<n>&cursor=<id>. Rows are returned in id
+order starting after the cursor, and the response carries the id to pass
+as the next cursor (or None on the last page). The page size is capped by
+the MAX_PAGE_SIZE config value.
+"""
+
+from flask import current_app
+from sqlalchemy import func
+
+from db import db, Task
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def _int_arg(args, name):
+    """
+    Returns the query argument as a non-negative int, or None if absent
+    """
+    value = args.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError("%s must be an integer" % name)
+    if value < 0:
+        raise ValueError("%s must not be negative" % name)
+    return value
+
+
+def page_args(args, prefix=""):
+    """
+    Returns (limit, cursor) read from the request query arguments
+
+    Raises ValueError if either argument is malformed
+    """
+    max_size = current_app.config.get("MAX_PAGE_SIZE", MAX_PAGE_SIZE)
+    default_size = current_app.config.get("DEFAULT_PAGE_SIZE", DEFAULT_PAGE_SIZE)
+    limit = _int_arg(args, prefix + "limit")
+    cursor = _int_arg(args, prefix + "cursor")
+    if limit is None or limit == 0:
+        limit = default_size
+    return min(limit, max_size), cursor
+
+
+def keyset_query(query, id_column, limit, cursor):
+    """
+    Returns the query limited to the page after cursor, plus one row to
+    tell whether another page follows
+    """
+    if cursor is not None:
+        query = query.filter(id_column > cursor)
+    return query.order_by(id_column).limit(limit + 1)
+
+
+def split_page(rows, limit):
+    """
+    Returns (rows, next_cursor) for the rows of a keyset_query()
+    """
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
+
+
+def keyset_page(query, id_column, limit, cursor):
+    """
+    Returns (rows, next_cursor) for the page of query after cursor
+    """
+    return split_page(keyset_query(query, id_column, limit, cursor).all(), limit)
+
+
+def first_task_pages(pod_ids, limit):
+    """
+    Returns {pod_id: (tasks, next_cursor)} with the first page of serialized
+    tasks of every given pod, loaded in a single query
+    """
+    pages = {pod_id: ([], None) for pod_id in pod_ids}
+    if not pod_ids:
+        return pages
+    ranked = (
+        db.session.query(
+            Task.id.label("id"),
+            func.row_number()
+            .over(partition_by=Task.pod_id, order_by=Task.id)
+            .label("rn"),
+        )
+        .filter(Task.pod_id.in_(pod_ids))
+        .subquery()
+    )
+    rows = (
+        Task.row_query()
+        .join(ranked, ranked.c.id == Task.id)
+        .filter(ranked.c.rn <= limit + 1)
+        .order_by(Task.pod_id, Task.id)
+        .all()
+    )
+    for row in rows:
+        page, next_cursor = pages[row.pod_id]
+        if len(page) < limit:
+            page.append(Task.serialize_row(row))
+        else:
+            pages[row.pod_id] = (page, page[-1]["id"])
+    return pages
@@ -0,0 +1,169 @@
+"""
+Password hashing service
+
+Passwords are stored as bcrypt hashes. Hashing is CPU heavy by design, so
+every hash and check runs on a bounded pool of worker threads (bcrypt
+releases the GIL while it works): at most HASH_WORKERS hashes run at once,
+and at most MAX_PENDING may be waiting, beyond which callers get
+HasherBusy instead of piling up behind the pool.
+
+The work factor is BCRYPT_ROUNDS. Hashes made with a different work factor
+still verify, and needs_rehash tells the caller to store a fresh hash.
+Passwords stored in plain text by earlier versions are also accepted once
+and then rehashed. bcrypt is imported by the first hash or check, so
+processes that never see a password do not load it.
+"""
+
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+BCRYPT_ROUNDS = 12
+HASH_WORKERS = os.cpu_count() or 1
+MAX_PENDING = 64
+# seconds a caller waits for a free slot before HasherBusy is raised
+QUEUE_TIMEOUT = 5
+# bcrypt only reads the first 72 bytes of a password
+MAX_PASSWORD_BYTES = 72
+
+
+class HasherBusy(Exception):
+    """
+    Raised when too many hashes are already waiting for the pool
+    """
+
+
+def _is_bcrypt_hash(value):
+    """
+    Returns true if value looks like a bcrypt hash
+    """
+    return value.startswith("$2") and len(value) == 60
+
+
+def _encode(password):
+    """
+    Returns the bytes of a password that bcrypt hashes
+    """
+    return password.encode("utf-8")[:MAX_PASSWORD_BYTES]
+
+
+def _rounds_of(hashed):
+    """
+    Returns the work factor a bcrypt hash was made with
+    """
+    return int(hashed.split("$")[2])
+
+
+class PasswordHasher(object):
+    """
+    Hashes and checks passwords on a bounded thread pool
+    """
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=HASH_WORKERS, max_pending=MAX_PENDING):
+        """
+        Initializes a PasswordHasher; its pool is started on first use
+        """
+        self.configure(rounds, workers, max_pending)
+
+    def init_app(self, app):
+        """
+        Makes this the password_hasher of app
+        """
+        app.extensions["password_hasher"] = self
+
+    def configure(self, rounds=BCRYPT_ROUNDS, workers=HASH_WORKERS, max_pending=MAX_PENDING):
+        """
+        Sets the work factor and pool size, replacing any running pool
+        """
+        self.rounds = rounds
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._executor = None
+        self._pid = None
+        self._dummy_hash = None
+
+    def _pool(self):
+        """
+        Returns the thread pool, starting a new one in a freshly forked worker
+        """
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            self._pid = os.getpid()
+        return self._executor
+
+    def _submit(self, fn, *args):
+        """
+        Schedules fn on the pool and returns its Future
+        """
+        if not self._slots.acquire(timeout=QUEUE_TIMEOUT):
+            raise HasherBusy("Too many password checks in progress")
+        try:
+            future = self._pool().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def hash(self, password):
+        """
+        Returns the bcrypt hash of a password, made with the current work factor
+        """
+        return self._submit(self._hash, password, self.rounds).result()
+
+    def verify(self, password, hashed):
+        """
+        Returns true if password matches the stored hash
+        """
+        if not _is_bcrypt_hash(hashed):
+            return hmac.compare_digest(password.encode("utf-8"), hashed.encode("utf-8"))
+        return self.verify_async(password, hashed).result()
+
+    def verify_async(self, password, hashed):
+        """
+        Returns a Future that resolves to whether password matches the
+        stored bcrypt hash
+        """
+        return self._submit(self._check, password, hashed)
+
+    def verify_dummy(self, password):
+        """
+        Checks a password against a throwaway hash so that failed logins for
+        unknown users take as long as those for known ones
+        """
+        if self._dummy_hash is None:
+            self._dummy_hash = self.hash(os.urandom(16).hex())
+        self.verify(password, self._dummy_hash)
+        return False
+
+    def needs_rehash(self, hashed):
+        """
+        Returns true if the stored value should be replaced by a fresh hash
+        """
+        return not _is_bcrypt_hash(hashed) or _rounds_of(hashed) != self.rounds
+
+    @staticmethod
+    def _hash(password, rounds):
+        """
+        Hashes a password (runs on the pool)
+        """
+        import bcrypt
+
+        return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds)).decode("utf-8")
+
+    @staticmethod
+    def _check(password, hashed):
+        """
+        Checks a password against a hash (runs on the pool)
+        """
+        import bcrypt
+
+        return bcrypt.checkpw(_encode(password), hashed.encode("utf-8"))
+
+
+# the PasswordHasher of the current app (see PasswordHasher.init_app)
+password_hasher = LocalProxy(lambda: current_app.extensions["password_hasher"])
@@ -0,0 +1,158 @@
+"""
+DAO (Data Access Object) file
+
+Helper file containing functions for accessing pods, including the
+allocation of join codes.
+
+Join codes are JOIN_CODE_LENGTH characters drawn from an alphabet without
+look-alike characters (0/O, 1/I), and are unique across pods: the pod
+table has a unique index on join_code, which also serves join lookups.
+A new code is probed against that index before use and the insert is
+retried with a fresh code if it still collides with a concurrent one.
+
+Pods are deleted by a background job (see jobs.py) in chunks of tasks,
+each in its own short transaction, so a large pod never holds the write
+lock for long.
+"""
+
+import secrets
+
+from sqlalchemy.exc import IntegrityError
+
+from db import db, Pod, PodEvent, Task, User
+import rollups_dao
+import stats_dao
+
+JOIN_CODE_ALPHABET = "23456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+JOIN_CODE_LENGTH = 8
+JOIN_CODE_ATTEMPTS = 10
+
+
+class JoinCodesExhausted(Exception):
+    """
+    Raised when no unused join code was found within the allowed attempts
+    """
+
+
+def generate_join_code(length=JOIN_CODE_LENGTH):
+    """
+    Returns a random join code of the given length
+    """
+    return "".join(secrets.choice(JOIN_CODE_ALPHABET) for _ in range(length))
+
+
+def normalize_join_code(join_code):
+    """
+    Returns a join code as typed by a user in the form it is stored in,
+    or None if there is no code
+    """
+    if join_code is None:
+        return None
+    return str(join_code).strip().upper()
+
+
+def join_code_in_use(join_code, connection=None):
+    """
+    Returns true if a pod has the join code
+    """
+    query = db.session.query(Pod.id).filter(Pod.join_code == join_code)
+    if connection is not None:
+        return connection.execute(query.statement.limit(1)).first() is not None
+    return query.first() is not None
+
+
+def unused_join_code(length=JOIN_CODE_LENGTH, attempts=JOIN_CODE_ATTEMPTS, connection=None):
+    """
+    Returns a join code no pod has yet
+
+    Raises JoinCodesExhausted if every attempt hit a code in use
+    """
+    for _ in range(attempts):
+        join_code = generate_join_code(length)
+        if not join_code_in_use(join_code, connection):
+            return join_code
+    raise JoinCodesExhausted("No unused join code of length %d after %d attempts" % (length, attempts))
+
+
+def get_pod_by_join_code(join_code):
+    """
+    Returns the pod with the join code, or None
+    """
+    join_code = normalize_join_code(join_code)
+    if join_code is None:
+        return None
+    return Pod.query.filter(Pod.join_code == join_code).first()
+
+
+def create_pod(name, description, length=JOIN_CODE_LENGTH, attempts=JOIN_CODE_ATTEMPTS):
+    """
+    Creates and commits a pod with an unused join code
+
+    Raises JoinCodesExhausted if no code could be allocated
+    """
+    for _ in range(attempts):
+        pod = Pod(name=name, description=description, join_code=unused_join_code(length, attempts))
+        db.session.add(pod)
+        try:
+            db.session.commit()
+            return pod
+        except IntegrityError:
+            db.session.rollback()
+            if not join_code_in_use(pod.join_code):
+                raise
+            # another pod took the code between the probe and the insert
+    raise JoinCodesExhausted("Join code kept colliding after %d attempts" % attempts)
+
+
+def delete_tasks(pod_id, last_id=None):
+    """
+    Deletes the tasks of a pod with ids up to last_id (all of them if None),
+    keeping the task counters in step; does not commit
+
+    Returns the number of tasks deleted
+    """
+    stats_dao.record_tasks_deleted(pod_id, last_id)
+    query = Task.query.filter(Task.pod_id == pod_id)
+    if last_id is not None:
+        query = query.filter(Task.id <= last_id)
+    return query.delete(synchronize_session=False)
+
+
+def delete_tasks_chunk(pod_id, chunk_size):
+    """
+    Deletes and commits the chunk_size oldest tasks of a pod
+
+    Returns the number of tasks deleted, 0 once the pod has none left
+    """
+    last_id = (
+        db.session.query(Task.id)
+        .filter(Task.pod_id == pod_id)
+        .order_by(Task.id)
+        .offset(chunk_size - 1)
+        .limit(1)
+        .scalar()
+    )
+    deleted = delete_tasks(pod_id, last_id)
+    if deleted:
+        Pod.bump_version(pod_id)
+    db.session.commit()
+    return deleted
+
+
+def delete_pod(pod_id):
+    """
+    Deletes and commits a pod together with any tasks, change feed events
+    and rollups it has left, and takes its members out of it
+
+    Returns (tasks deleted, members removed), or None if there is no such pod
+    """
+    if db.session.query(Pod.id).filter(Pod.id == pod_id).first() is None:
+        return None
+    deleted = delete_tasks(pod_id)
+    PodEvent.query.filter(PodEvent.pod_id == pod_id).delete(synchronize_session=False)
+    rollups_dao.delete_rollups(pod_id)
+    removed = User.query.filter(User.podID == pod_id).update(
+        {User.podID: None, User.tasks_completed: 0}, synchronize_session=False)
+    Pod.query.filter(Pod.id == pod_id).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted, removed
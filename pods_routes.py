@@ -0,0 +1,378 @@
+"""
+Pod routes: pods, members, leaderboards, counters, the change feed and
+pod analytics
+"""
+
+import json
+
+from flask import Blueprint, Response, current_app, request, stream_with_context
+
+from db import db, User, Pod, Task
+import events_dao
+import feed
+import http_cache
+from instrumentation import dumps
+from jobs import job_queue
+from main_routes import job_accepted
+import pagination
+import pods_dao
+import projections
+from projections import pod_projections
+import rollups_dao
+from users_routes import trend_body
+
+blueprint = Blueprint("pods", __name__)
+
+
+LEADERBOARD_SIZE = 3
+LEADERBOARD_PLACES = ["first", "second", "third"]
+
+
+@blueprint.route("/api/pod/")
+def get_all_pods():
+    """
+    Endpoint for getting all pods, a page at a time, each with the first
+    page of its tasks
+    request args:
+    limit
+    cursor
+    task_limit
+    """
+    try:
+        limit, cursor = pagination.page_args(request.args)
+        task_limit, _ = pagination.page_args(request.args, prefix="task_")
+    except ValueError as e:
+        return dumps({"error": str(e)}), 400
+    pods, next_cursor = pagination.keyset_page(Pod.row_query(), Pod.id, limit, cursor)
+    task_pages = pagination.first_task_pages([p.id for p in pods], task_limit)
+    return dumps({"pods": [Pod.serialize_row(p, *task_pages[p.id]) for p in pods], "next_cursor": next_cursor}),200
+
+
+@blueprint.route("/api/pod/<int:pod_id>/")
+def get_pod(pod_id):
+    """
+    Endpoint for getting a pod by id, with a page of its tasks
+    request args:
+    task_limit
+    task_cursor
+    """
+    try:
+        task_limit, task_cursor = pagination.page_args(request.args, prefix="task_")
+    except ValueError as e:
+        return dumps({"error": str(e)}), 400
+    pod = Pod.query.filter_by(id=pod_id).first()
+    if pod is None:
+        return dumps({"error": "pod not found"}), 404
+
+    def build():
+        tasks, tasks_next_cursor = pagination.keyset_page(
+            Task.row_query().filter(Task.pod_id == pod_id), Task.id, task_limit, task_cursor)
+        return pod.serialize([Task.serialize_row(t) for t in tasks], tasks_next_cursor)
+
+    key = ("pod", pod.id, pod.version, task_limit, task_cursor)
+    return http_cache.cached_json(key, build)
+
+@blueprint.route("/api/pod/joincode/<int:pod_id>/")
+def get_pod_joincode(pod_id):
+    """
+    Endpoint for getting a pod's join code
+    """
+    pod = Pod.query.filter_by(id=pod_id).first()
+    if pod is None:
+        return dumps({"error": "pod not found"}), 404
+    return dumps(pod.join_code), 200
+
+
+@blueprint.route("/api/pod/<int:user_id>/", methods = ["POST"])
+def create_pod(user_id):
+    """
+    Endpoint for creating a pod
+    """
+    user = User.query.filter_by(id = user_id).first()
+    if user_id is None:
+        return dumps({"error": "pod creator not found"}), 404
+    if user.podID != None:
+        return dumps({"error": "user is already in pod"}), 404
+    body = json.loads(request.data)
+    if body.get("name") is None:
+        return dumps({"error": "pod name field not supplied"}), 400
+    if body.get("description") is None:
+        return dumps({"error": "pod description field not supplied"}), 400
+    new_pod = pods_dao.create_pod(body.get("name"), body.get("description"),
+                                  current_app.config["JOIN_CODE_LENGTH"], current_app.config["JOIN_CODE_ATTEMPTS"])
+    if new_pod is None:
+        return dumps({"error": "new pod is null."}), 400
+    pod_id = new_pod.id
+    user.podID=pod_id
+    user.leader = True
+    member = projections.Member.of(user)
+    members_version = Pod.bump_members_version(pod_id)
+    db.session.commit()
+    pod_projections.add_member(pod_id, members_version, member)
+    return dumps(new_pod.serialize()), 201
+
+
+@blueprint.route("/api/pod/alluser/<int:pod_id>/")
+def pod_all_users(pod_id):
+    """
+    Endpoint for getting all users of a pod, a page at a time
+    request args:
+    limit
+    cursor
+    """
+    try:
+        limit, cursor = pagination.page_args(request.args)
+    except ValueError as e:
+        return dumps({"error": str(e)}), 400
+    page = projections.member_page(pod_id, limit, cursor)
+    users, next_cursor = page if page is not None else ([], None)
+    return dumps({"users": [User.serialize_row(u) for u in users], "next_cursor": next_cursor}),200
+
+
+@blueprint.route("/api/pod/leaderboard/<int:pod_id>/")
+def pod_leaderboard(pod_id):
+    """
+    Endpoint for returning the top users of a pod by number of tasks completed
+    request args:
+    n (number of users, default 3)
+    ranks (return each user's rank instead of a placement string)
+    """
+    try:
+        n, ranks = leaderboard_args(request.args)
+    except ValueError as e:
+        return dumps({"error": str(e)}), 400
+    leaderboard = projections.leaderboard(pod_id, n)
+    if leaderboard is None:
+        return dumps({"error": "pod not found"}), 404
+    return dumps(leaderboard_payload(leaderboard, n, ranks)),200
+
+
+def leaderboard_args(args):
+    """
+    Returns (n, ranks) read from the leaderboard request arguments
+
+    Raises ValueError if n is malformed
+    """
+    try:
+        n = int(args.get("n", LEADERBOARD_SIZE))
+    except ValueError:
+        raise ValueError("n must be an integer")
+    if n < 1:
+        raise ValueError("n must be at least 1")
+    return min(n, current_app.config["MAX_PAGE_SIZE"]), args.get("ranks") in ("1", "true")
+
+
+def leaderboard_payload(leaderboard, n, ranks):
+    """
+    Returns the leaderboard response body for stats_dao.rank_leaderboard rows
+    """
+    if ranks:
+        userslist = [
+            {"rank": rank, "username": username, "tasks_completed": tasks_completed}
+            for username, tasks_completed, rank in leaderboard
+        ]
+        return {"top users": userslist}
+    userslist = []
+    for position in range(1, n + 1):
+        place = LEADERBOARD_PLACES[position - 1] if position <= len(LEADERBOARD_PLACES) else "#%d" % position
+        if position > len(leaderboard):
+            userslist.append(place + ": invite more users!")
+        else:
+            username, tasks_completed, _ = leaderboard[position - 1]
+            userslist.append(place + ": " + username + ", tasks done: " + str(tasks_completed))
+    return {"top users": userslist}
+
+
+@blueprint.route("/api/pod/totaltasks/<int:pod_id>/")
+def pod_total_tasks(pod_id):
+    """
+    Endpoint for getting total number of tasks of a pod
+    """
+    pod = Pod.query.filter_by(id=pod_id).first()
+    if pod is None:
+        return dumps({"error": "pod not found"}), 404
+    total_tasks = pod.total_tasks
+    return dumps({"total tasks": total_tasks}), 201
+
+
+@blueprint.route("/api/pod/taskscompleted/<int:pod_id>/")
+def pod_tasks_completed(pod_id):
+    """
+    Endpoint for getting total number of completed tasks of a pod
+    """
+    pod = Pod.query.filter_by(id=pod_id).first()
+    if pod is None:
+        return dumps({"error": "pod not found"}), 404
+    tasks_completed = pod.completed_tasks
+    return dumps({"tasks completed": tasks_completed}), 201
+
+
+@blueprint.route("/api/pod/tasksincomplete/<int:pod_id>/")
+def pod_tasks_incompleted(pod_id):
+    """
+    Endpoint for getting total number of incomplete tasks of a pod
+    """
+    pod = Pod.query.filter_by(id=pod_id).first()
+    if pod is None:
+        return dumps({"error": "pod not found"}), 404
+    tasks_incomplete = pod.incomplete_tasks
+    return dumps({"tasks incomplete": tasks_incomplete}), 201
+
+
+@blueprint.route("/api/pod/<int:pod_id>/stats/")
+def pod_stats(pod_id):
+    """
+    Endpoint for getting the total, completed and incomplete task counts of a pod
+    """
+    pod = Pod.query.filter_by(id=pod_id).first()
+    if pod is None:
+        return dumps({"error": "pod not found"}), 404
+    return dumps(
+        {
+            "total tasks": pod.total_tasks,
+            "tasks completed": pod.completed_tasks,
+            "tasks incomplete": pod.incomplete_tasks
+        }), 200
+
+
+@blueprint.route("/api/pod/<int:pod_id>/events/")
+def pod_events(pod_id):
+    """
+    Endpoint for the changes to a pod's tasks and members after a seq, as
+    JSON (long-poll) or as a stream of server-sent events
+    request args:
+    since (seq of the last change seen; Last-Event-ID also works; defaults to now)
+    limit
+    wait (seconds to wait for a change when there is none yet, long-poll only)
+    stream (1 for server-sent events, also chosen by Accept: text/event-stream)
+    Streams and waiting long-polls are answered 503 with Retry-After while
+    FEED_MAX_WATCHERS others are running
+    """
+    try:
+        since, limit, wait = feed_args(request)
+    except ValueError as e:
+        return dumps({"error": str(e)}), 400
+    latest_seq = events_dao.latest_seq(pod_id)
+    if latest_seq is None:
+        return dumps({"error": "pod not found"}), 404
+    if since is None:
+        since = latest_seq
+    stream = request.args.get("stream") in ("1", "true") or request.accept_mimetypes.best == "text/event-stream"
+    if (stream or wait > 0) and not feed.notifier.admit():
+        return dumps({"error": "Too many clients watching, try again later"}), 503, {
+            "Retry-After": str(feed.RETRY_AFTER)}
+    if stream:
+        events = feed.stream_events(pod_id, since, limit, current_app.config["FEED_STREAM_SECONDS"], current_app.config["FEED_HEARTBEAT"])
+        response = Response(stream_with_context(events), mimetype="text/event-stream",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        # the server closes the response once the stream ends or the client goes away
+        response.call_on_close(feed.notifier.leave)
+        return response
+    try:
+        events = feed.next_events(pod_id, since, limit, wait)
+    finally:
+        if wait > 0:
+            feed.notifier.leave()
+    if events is None:
+        return dumps({"error": "pod not found"}), 404
+    next_since = events[-1]["seq"] if events else since
+    return dumps({"events": events, "next_since": next_since}), 200
+
+
+def feed_args(request):
+    """
+    Returns (since, limit, wait) read from a change feed request
+
+    Raises ValueError if one of them is malformed
+    """
+    since = request.args.get("since", request.headers.get("Last-Event-ID"))
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            raise ValueError("since must be an integer")
+    limit, _ = pagination.page_args(request.args)
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        raise ValueError("wait must be a number")
+    return since, limit, min(max(wait, 0), current_app.config["FEED_MAX_WAIT"])
+
+
+@blueprint.route("/api/pod/<int:pod_id>/analytics/")
+def pod_analytics(pod_id):
+    """
+    Endpoint for the tasks of a pod created and completed per hour or day
+    request args:
+    period (hour or day)
+    start, end (ISO dates or times; default: the last buckets buckets)
+    buckets
+    """
+    try:
+        period, start, end = rollups_dao.window_args(request.args, current_app.config["ANALYTICS_MAX_BUCKETS"])
+    except ValueError as e:
+        return dumps({"error": str(e)}), 400
+    version = db.session.query(Pod.version).filter(Pod.id == pod_id).scalar()
+    if version is None:
+        return dumps({"error": "pod not found"}), 404
+
+    def build():
+        return trend_body(period, start, end, rollups_dao.pod_trend(pod_id, period, start, end))
+
+    key = ("pod_analytics", pod_id, version, period, start, end)
+    return http_cache.cached_json(key, build)
+
+
+@blueprint.route("/api/pod/<int:pod_id>/analytics/leaderboard/")
+def pod_analytics_leaderboard(pod_id):
+    """
+    Endpoint for the members of a pod who completed the most tasks in a window
+    request args:
+    period (hour or day)
+    start, end (ISO dates or times; default: the last buckets buckets)
+    buckets
+    limit
+    """
+    try:
+        period, start, end = rollups_dao.window_args(request.args, current_app.config["ANALYTICS_MAX_BUCKETS"])
+        limit, _ = pagination.page_args(request.args)
+    except ValueError as e:
+        return dumps({"error": str(e)}), 400
+    version = db.session.query(Pod.version).filter(Pod.id == pod_id).scalar()
+    if version is None:
+        return dumps({"error": "pod not found"}), 404
+
+    def build():
+        rows = rollups_dao.window_leaderboard(pod_id, period, start, end, limit)
+        return {
+            "period": period,
+            "start": str(start),
+            "end": str(end),
+            "leaderboard": [
+                {"username": username, "tasks_completed": tasks_completed, "rank": rank}
+                for username, tasks_completed, rank in rows
+            ],
+        }
+
+    key = ("pod_analytics_leaderboard", pod_id, version, period, start, end, limit)
+    return http_cache.cached_json(key, build)
+
+
+@blueprint.route("/api/pod/<int:user_id>/", methods=["DELETE"])
+def delete_pod_by_id(user_id):
+    """
+    Endpoint for deleting pod by id
+    """
+    user = User.query.filter_by(id = user_id).first()
+    if user_id is None:
+        return dumps({"error": "pod creator not found"}), 404
+    body = json.loads(request.data)
+    if body.get("pod_id") is None:
+        return dumps({"error": "pod to delete not specified"}), 400
+    pod = Pod.query.filter_by(id=body.get("pod_id")).first()
+    if pod is None:
+        return dumps({"error": "pod not found"}), 404
+    if user.leader == False:
+        return dumps({"error": "not allowed"}), 400
+    job = job_queue.enqueue("delete_pod", pod_id=pod.id)
+    return job_accepted(job)
@@ -0,0 +1,329 @@
+"""
+Read-side projection of pod membership for the leaderboard and member list
+
+Each cached pod keeps a compact copy of the member columns those routes
+return, sorted both by user id (for keyset pages) and by
+(tasks_completed, id) descending (for the leaderboard), so they are
+answered without loading User objects or their tokens.
+
+A projection is stamped with the pod's members_version. Writes that change
+a pod's members or their tasks_completed bump that column inside their
+transaction (Pod.bump_members_version) and, once committed, apply the same
+change here. A change is only applied to the projection of the version
+right before it, so a change made by another process (or applied out of
+order) makes the projection stale, and reads, which compare the stamp
+against the database, reload it.
+
+Pods are evicted least recently used first once the cached pods hold more
+than MAX_MEMBERS members in total.
+"""
+
+import bisect
+import threading
+from array import array
+from collections import OrderedDict
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from db import db, Pod, User
+import stats_dao
+
+MAX_MEMBERS = 200000
+
+
+class Member(object):
+    """
+    The columns of a pod member the projected routes return
+    """
+    __slots__ = ("user_id", "username", "password", "tasks_completed", "leader")
+
+    def __init__(self, user_id, username, password, tasks_completed, leader):
+        """
+        Initializes a Member
+        """
+        self.user_id = user_id
+        self.username = username
+        self.password = password
+        self.tasks_completed = tasks_completed
+        self.leader = leader
+
+    @staticmethod
+    def of(user):
+        """
+        Returns the Member of a User object
+        """
+        return Member(user.id, user.username, user.password, user.tasks_completed, user.leader)
+
+    def rank_key(self):
+        """
+        Returns the key ordering members like ORDER BY tasks_completed DESC, id DESC
+        """
+        return (-self.tasks_completed, -self.user_id)
+
+
+class PodProjection(object):
+    """
+    The members of one pod, ordered by id and by rank
+    """
+    __slots__ = ("pod_id", "members_version", "pod", "ids", "ranking", "members")
+
+    def __init__(self, pod_id, members_version, pod, members):
+        """
+        Initializes a PodProjection from the pod's (id, name, description,
+        join_code) and its Members
+        """
+        self.pod_id = pod_id
+        self.members_version = members_version
+        self.pod = pod
+        self.members = dict((m.user_id, m) for m in members)
+        self.ids = array("q", sorted(self.members))
+        self.ranking = sorted(m.rank_key() for m in members)
+
+    def add(self, member):
+        """
+        Adds a member
+        """
+        if member.user_id in self.members:
+            self.remove(member.user_id)
+        self.members[member.user_id] = member
+        bisect.insort(self.ids, member.user_id)
+        bisect.insort(self.ranking, member.rank_key())
+
+    def remove(self, user_id):
+        """
+        Removes a member if present
+        """
+        member = self.members.pop(user_id, None)
+        if member is None:
+            return
+        del self.ids[bisect.bisect_left(self.ids, user_id)]
+        del self.ranking[bisect.bisect_left(self.ranking, member.rank_key())]
+
+    def add_tasks_completed(self, user_id, delta):
+        """
+        Adds delta to a member's tasks_completed
+        """
+        member = self.members.get(user_id)
+        if member is None:
+            return
+        del self.ranking[bisect.bisect_left(self.ranking, member.rank_key())]
+        member.tasks_completed = member.tasks_completed + delta
+        bisect.insort(self.ranking, member.rank_key())
+
+    def top(self, n):
+        """
+        Returns the (username, tasks_completed) of the top n members
+        """
+        return [
+            (self.members[-user_id].username, -tasks_completed)
+            for tasks_completed, user_id in self.ranking[:n]
+        ]
+
+    def page(self, limit, cursor):
+        """
+        Returns (rows, next_cursor) for the members after cursor, in id order,
+        as rows of User.row_query()
+        """
+        start = 0 if cursor is None else bisect.bisect_right(self.ids, cursor)
+        ids = self.ids[start:start + limit + 1]
+        next_cursor = None
+        if len(ids) > limit:
+            ids = ids[:limit]
+            next_cursor = ids[-1]
+        rows = []
+        for user_id in ids:
+            m = self.members[user_id]
+            rows.append((m.user_id, m.username, m.password, m.tasks_completed, m.leader) + self.pod)
+        return rows, next_cursor
+
+
+class PodProjections(object):
+    """
+    LRU cache of pod id -> PodProjection bounded by the total number of members
+    """
+
+    def __init__(self, max_members=MAX_MEMBERS):
+        """
+        Initializes an empty PodProjections
+        """
+        self.max_members = max_members
+        self.hits = 0
+        self.misses = 0
+        self._members = 0
+        self._pods = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Makes this the pod_projections of app
+        """
+        app.extensions["pod_projections"] = self
+
+    def read(self, pod_id, members_version, read):
+        """
+        Returns (True, read(projection)) for the projection of the pod at
+        members_version, or (False, None) if it is not cached
+        """
+        with self._lock:
+            projection = self._pods.get(pod_id)
+            if projection is None or projection.members_version != members_version:
+                self.misses = self.misses + 1
+                return False, None
+            self._pods.move_to_end(pod_id)
+            self.hits = self.hits + 1
+            return True, read(projection)
+
+    def put(self, projection):
+        """
+        Caches a projection unless a newer one is cached, evicting the least
+        recently used pods to stay within the member budget
+        """
+        with self._lock:
+            cached = self._pods.get(projection.pod_id)
+            if cached is not None:
+                if cached.members_version > projection.members_version:
+                    return
+                self._discard(projection.pod_id)
+            if len(projection.members) > self.max_members:
+                return
+            self._pods[projection.pod_id] = projection
+            self._members = self._members + len(projection.members)
+            while self._members > self.max_members:
+                self._discard(next(iter(self._pods)))
+
+    def _discard(self, pod_id):
+        """
+        Drops a pod's projection; the lock must be held
+        """
+        projection = self._pods.pop(pod_id, None)
+        if projection is not None:
+            self._members = self._members - len(projection.members)
+
+    def discard(self, pod_id):
+        """
+        Drops a pod's projection
+        """
+        with self._lock:
+            self._discard(pod_id)
+
+    def _apply(self, pod_id, members_version, change):
+        """
+        Applies change to the pod's projection if it is at the version right
+        before members_version, otherwise drops it
+        """
+        with self._lock:
+            projection = self._pods.get(pod_id)
+            if projection is None:
+                return
+            if projection.members_version != members_version - 1:
+                self._discard(pod_id)
+                return
+            before = len(projection.members)
+            change(projection)
+            projection.members_version = members_version
+            self._members = self._members + len(projection.members) - before
+
+    def add_member(self, pod_id, members_version, member):
+        """
+        Records a member joining the pod
+        """
+        self._apply(pod_id, members_version, lambda p: p.add(member))
+
+    def remove_member(self, pod_id, members_version, user_id):
+        """
+        Records a member leaving the pod
+        """
+        self._apply(pod_id, members_version, lambda p: p.remove(user_id))
+
+    def add_tasks_completed_by(self, pod_id, members_version, deltas):
+        """
+        Records a change to the tasks_completed of several members, given
+        as {user_id: delta}
+        """
+        def change(projection):
+            for user_id, delta in deltas.items():
+                projection.add_tasks_completed(user_id, delta)
+        self._apply(pod_id, members_version, change)
+
+    def clear(self):
+        """
+        Removes every projection and resets the counters
+        """
+        with self._lock:
+            self._pods.clear()
+            self._members = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and current size of the cache
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "pods": len(self._pods), "members": self._members}
+
+
+# the PodProjections of the current app (see PodProjections.init_app)
+pod_projections = LocalProxy(lambda: current_app.extensions["pod_projections"])
+
+
+def load(pod_id):
+    """
+    Returns a fresh projection of the pod read from the database, or None
+    if there is no such pod
+
+    The pod's members_version and its members are read in one statement,
+    so the projection's stamp is that of the members it holds even when a
+    member write commits while it is being read
+    """
+    rows = (
+        Pod.row_query()
+        .add_columns(Pod.members_version, User.id, User.username, User.password, User.tasks_completed, User.leader)
+        .outerjoin(User, User.podID == Pod.id)
+        .filter(Pod.id == pod_id)
+        .all()
+    )
+    if not rows:
+        return None
+    members = [Member(*row[5:]) for row in rows if row[5] is not None]
+    return PodProjection(pod_id, rows[0][4], tuple(rows[0][:4]), members)
+
+
+def _read(pod_id, read):
+    """
+    Returns read(projection) for the up to date projection of the pod, or
+    None if there is no such pod
+
+    Costs one primary key lookup when the cached projection is current
+    """
+    members_version = db.session.query(Pod.members_version).filter(Pod.id == pod_id).scalar()
+    if members_version is None:
+        pod_projections.discard(pod_id)
+        return None
+    hit, result = pod_projections.read(pod_id, members_version, read)
+    if hit:
+        return result
+    projection = load(pod_id)
+    if projection is None:
+        return None
+    result = read(projection)
+    pod_projections.put(projection)
+    return result
+
+
+def leaderboard(pod_id, n):
+    """
+    Returns the top n (username, tasks_completed, rank) rows of a pod, as
+    stats_dao.rank_leaderboard ranks them, or None if there is no such pod
+    """
+    return _read(pod_id, lambda projection: stats_dao.rank_leaderboard(projection.top(n)))
+
+
+def member_page(pod_id, limit, cursor):
+    """
+    Returns (rows, next_cursor) for a page of the pod's members as rows of
+    User.row_query(), or None if there is no such pod
+    """
+    return _read(pod_id, lambda projection: projection.page(limit, cursor))
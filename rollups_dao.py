@@ -0,0 +1,389 @@
+"""
+DAO (Data Access Object) file
+
+Helper file for the hourly and daily task rollups behind the analytics
+routes. pod_rollups counts the tasks of each pod created and completed in
+each hour and day; user_rollups counts the same per user (the creator for
+created, the completer for completed) and pod. The write paths keep them
+up to date through the record_* functions, in the same transaction as the
+task change and after the pod's version has been bumped, so the lock on
+the pod row serializes the read-modify-write of its rollup rows.
+
+A task counts as completed in the bucket of its completed_at for as long
+as it stays done: marking it not done, or done by someone else, takes it
+back out. The rollups therefore always equal a GROUP BY over the tasks
+table, which is what rebuild_pods computes for the backfill, and a trend
+or windowed leaderboard reads one row per bucket (or per member) instead
+of scanning the pod's tasks.
+"""
+
+import datetime
+
+from sqlalchemy import func
+
+from db import db, Pod, PodRollup, Task, User, UserRollup
+import stats_dao
+
+HOUR = "hour"
+DAY = "day"
+PERIODS = (HOUR, DAY)
+# buckets a window covers when the request gives no start
+DEFAULT_BUCKETS = {HOUR: 24, DAY: 30}
+MAX_BUCKETS = 2000
+
+_TIME_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d")
+
+
+def bucket_start(at, period):
+    """
+    Returns the start of the hour or day at falls in
+    """
+    if period == HOUR:
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def bucket_step(period):
+    """
+    Returns the length of a bucket of the period
+    """
+    if period == HOUR:
+        return datetime.timedelta(hours=1)
+    return datetime.timedelta(days=1)
+
+
+def _parse_time(value):
+    """
+    Returns the datetime of an ISO date or date and time, or raises ValueError
+    """
+    for time_format in _TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise ValueError("times must look like 2024-01-31 or 2024-01-31T08:00")
+
+
+def window_args(args, max_buckets=MAX_BUCKETS, now=None):
+    """
+    Returns (period, start, end) read from the request query arguments
+
+    start and end are aligned to the period and end is exclusive. Without
+    end the window ends with the current bucket; without start it covers
+    buckets buckets (DEFAULT_BUCKETS by default). Raises ValueError if an
+    argument is malformed or the window is empty or too long
+    """
+    period = args.get("period", DAY)
+    if period not in PERIODS:
+        raise ValueError("period must be hour or day")
+    step = bucket_step(period)
+    end = args.get("end")
+    if end is None:
+        end = bucket_start(now or datetime.datetime.now(), period) + step
+    else:
+        end = bucket_start(_parse_time(end), period)
+    start = args.get("start")
+    if start is None:
+        try:
+            buckets = int(args.get("buckets", DEFAULT_BUCKETS[period]))
+        except ValueError:
+            raise ValueError("buckets must be an integer")
+        if buckets < 1 or buckets > max_buckets:
+            raise ValueError("buckets must be between 1 and %d" % max_buckets)
+        start = end - buckets * step
+    else:
+        start = bucket_start(_parse_time(start), period)
+    if start >= end:
+        raise ValueError("start must be before end")
+    if (end - start) // step > max_buckets:
+        raise ValueError("window is longer than %d buckets" % max_buckets)
+    return period, start, end
+
+
+def new_deltas():
+    """
+    Returns an empty ({(pod_id, period, bucket): [created, completed]},
+    {(user_id, pod_id, period, bucket): [created, completed]}) pair
+    """
+    return {}, {}
+
+
+def _add(deltas, pod_id, user_id, at, created, completed):
+    """
+    Adds created and completed tasks at time at to the hour and day of the
+    pod, and of the user unless user_id is None
+    """
+    pod_deltas, user_deltas = deltas
+    for period in PERIODS:
+        bucket = bucket_start(at, period)
+        entry = pod_deltas.setdefault((pod_id, period, bucket), [0, 0])
+        entry[0] = entry[0] + created
+        entry[1] = entry[1] + completed
+        if user_id is not None:
+            entry = user_deltas.setdefault((user_id, pod_id, period, bucket), [0, 0])
+            entry[0] = entry[0] + created
+            entry[1] = entry[1] + completed
+
+
+def add_created(deltas, pod_id, creator_id, created_at, count=1):
+    """
+    Adds count tasks created at created_at to deltas
+    """
+    _add(deltas, pod_id, creator_id, created_at, count, 0)
+
+
+def completed_at_after(old_status, old_completer_id, old_completed_at, new_status, new_completer_id, now):
+    """
+    Returns the completed_at of a task after a status change made at now
+
+    Marking a done task done again by the same user keeps its completion
+    time; a new completer completes it anew
+    """
+    if not new_status:
+        return None
+    if old_status and old_completer_id == new_completer_id:
+        return old_completed_at
+    return now
+
+
+def add_status_change(deltas, pod_id, old_status, old_completer_id, old_completed_at,
+                      new_status, new_completer_id, new_completed_at):
+    """
+    Adds the rollup changes caused by a task status change to deltas
+    """
+    if old_status and old_completed_at is not None and old_completed_at != new_completed_at:
+        _add(deltas, pod_id, old_completer_id, old_completed_at, 0, -1)
+    if new_status and new_completed_at is not None and new_completed_at != old_completed_at:
+        _add(deltas, pod_id, new_completer_id, new_completed_at, 0, 1)
+
+
+def _bump(model, keys, created, completed):
+    """
+    Adds to the counts of a rollup row, inserting it if there is none yet
+    """
+    updated = model.query.filter(*[getattr(model, k) == v for k, v in keys.items()]).update(
+        {model.created: model.created + created, model.completed: model.completed + completed},
+        synchronize_session=False,
+    )
+    if not updated:
+        row = dict(keys, created=created, completed=completed)
+        db.session.execute(model.__table__.insert(), [row])
+
+
+def apply_deltas(deltas):
+    """
+    Applies the rollup changes collected by add_*, with one UPDATE (or
+    INSERT) per rollup row that changes
+    """
+    pod_deltas, user_deltas = deltas
+    for (pod_id, period, bucket), (created, completed) in pod_deltas.items():
+        if created or completed:
+            _bump(PodRollup, {"pod_id": pod_id, "period": period, "bucket": bucket}, created, completed)
+    for (user_id, pod_id, period, bucket), (created, completed) in user_deltas.items():
+        if created or completed:
+            _bump(UserRollup, {"user_id": user_id, "pod_id": pod_id, "period": period, "bucket": bucket},
+                  created, completed)
+
+
+def record_created(pod_id, creator_id, created_at, count=1):
+    """
+    Counts new tasks towards the rollups of their pod and creator
+    """
+    deltas = new_deltas()
+    add_created(deltas, pod_id, creator_id, created_at, count)
+    apply_deltas(deltas)
+
+
+def _fill(rows, period, start, end):
+    """
+    Returns {"bucket", "created", "completed"} for every bucket from start
+    to end, given the (bucket, created, completed) rows that are not empty
+    """
+    counts = {bucket: (created, completed) for bucket, created, completed in rows}
+    buckets = []
+    bucket = start
+    step = bucket_step(period)
+    while bucket < end:
+        created, completed = counts.get(bucket, (0, 0))
+        buckets.append({"bucket": str(bucket), "created": created, "completed": completed})
+        bucket = bucket + step
+    return buckets
+
+
+def pod_trend(pod_id, period, start, end):
+    """
+    Returns the tasks of a pod created and completed in every bucket of the
+    window, oldest first
+    """
+    rows = (
+        db.session.query(PodRollup.bucket, PodRollup.created, PodRollup.completed)
+        .filter(PodRollup.pod_id == pod_id, PodRollup.period == period,
+                PodRollup.bucket >= start, PodRollup.bucket < end)
+        .all()
+    )
+    return _fill(rows, period, start, end)
+
+
+def user_trend(user_id, period, start, end):
+    """
+    Returns the tasks a user created and completed, over every pod, in
+    every bucket of the window, oldest first
+    """
+    rows = (
+        db.session.query(UserRollup.bucket, func.sum(UserRollup.created), func.sum(UserRollup.completed))
+        .filter(UserRollup.user_id == user_id, UserRollup.period == period,
+                UserRollup.bucket >= start, UserRollup.bucket < end)
+        .group_by(UserRollup.bucket)
+        .all()
+    )
+    return _fill(rows, period, start, end)
+
+
+def window_leaderboard(pod_id, period, start, end, n):
+    """
+    Returns the top n (username, tasks_completed, rank) rows of the pod's
+    current members by tasks completed in the window
+    """
+    completed = func.sum(UserRollup.completed)
+    rows = (
+        db.session.query(User.username, completed)
+        .join(User, User.id == UserRollup.user_id)
+        .filter(UserRollup.pod_id == pod_id, User.podID == pod_id, UserRollup.period == period,
+                UserRollup.bucket >= start, UserRollup.bucket < end)
+        .group_by(User.id, User.username)
+        .having(completed > 0)
+        .order_by(completed.desc(), User.id.desc())
+        .limit(n)
+        .all()
+    )
+    return stats_dao.rank_leaderboard(rows)
+
+
+def stamp_tasks(first_id, last_id, at):
+    """
+    Gives the tasks with ids from first_id to last_id that were written
+    before the timestamp columns existed a created_at, and the done ones a
+    completed_at, of at, and commits
+
+    Returns the number of timestamps set
+    """
+    in_range = Task.id.between(first_id, last_id)
+    stamped = Task.query.filter(in_range, Task.created_at.is_(None)).update(
+        {Task.created_at: at}, synchronize_session=False)
+    stamped = stamped + Task.query.filter(in_range, Task.status == True, Task.completed_at.is_(None)).update(
+        {Task.completed_at: at}, synchronize_session=False)
+    db.session.commit()
+    return stamped
+
+
+def _pod_versions(first_id, last_id):
+    """
+    Returns {pod_id: version} of the pods with ids from first_id to last_id
+    """
+    return dict(db.session.query(Pod.id, Pod.version).filter(Pod.id.between(first_id, last_id)).all())
+
+
+def rebuild_pods(first_id, last_id, attempts=3):
+    """
+    Recomputes and commits the rollups of the pods with ids from first_id
+    to last_id from the tasks table
+
+    The tasks are read outside of the write transaction, so SQLite's write
+    lock is only held while the rollup rows are replaced; if a task of one
+    of the pods changed in between (its version moved), the range is read
+    again. Returns the number of rollup rows written
+    """
+    for _ in range(attempts):
+        versions = _pod_versions(first_id, last_id)
+        deltas = new_deltas()
+        rows = (
+            db.session.query(Task.pod_id, Task.creator_id, Task.created_at,
+                             Task.status, Task.completer_id, Task.completed_at)
+            .filter(Task.pod_id.between(first_id, last_id))
+            .yield_per(10000)
+        )
+        for pod_id, creator_id, created_at, status, completer_id, completed_at in rows:
+            if created_at is not None:
+                _add(deltas, pod_id, creator_id, created_at, 1, 0)
+            if status and completed_at is not None:
+                _add(deltas, pod_id, completer_id, completed_at, 0, 1)
+        # end the read so the deletes start a fresh write transaction
+        db.session.rollback()
+        UserRollup.query.filter(UserRollup.pod_id.between(first_id, last_id)).delete(synchronize_session=False)
+        PodRollup.query.filter(PodRollup.pod_id.between(first_id, last_id)).delete(synchronize_session=False)
+        if _pod_versions(first_id, last_id) != versions:
+            db.session.rollback()
+            continue
+        pod_deltas, user_deltas = deltas
+        pod_rows = [{"pod_id": pod_id, "period": period, "bucket": bucket, "created": c[0], "completed": c[1]}
+                    for (pod_id, period, bucket), c in pod_deltas.items()]
+        user_rows = [{"user_id": user_id, "pod_id": pod_id, "period": period, "bucket": bucket,
+                      "created": c[0], "completed": c[1]}
+                     for (user_id, pod_id, period, bucket), c in user_deltas.items()]
+        if pod_rows:
+            db.session.execute(PodRollup.__table__.insert(), pod_rows)
+        if user_rows:
+            db.session.execute(UserRollup.__table__.insert(), user_rows)
+        db.session.commit()
+        return len(pod_rows) + len(user_rows)
+    raise RuntimeError("Pods %d to %d kept changing while their rollups were rebuilt" % (first_id, last_id))
+
+
+def backfill(chunk_size, checkpoint=None, at=None):
+    """
+    Stamps every task written before the timestamp columns existed with at
+    (now by default), then rebuilds the rollups of every pod, chunk_size
+    tasks or pods at a time; checkpoint(rows) is called after each chunk
+
+    Returns (timestamps set, rollup rows written)
+    """
+    at = at or datetime.datetime.now()
+    stamped = 0
+    written = 0
+    max_task_id = db.session.query(func.max(Task.id)).scalar() or 0
+    for first_id in range(1, max_task_id + 1, chunk_size):
+        last_id = min(first_id + chunk_size - 1, max_task_id)
+        stamped = stamped + stamp_tasks(first_id, last_id, at)
+        if checkpoint is not None:
+            checkpoint(last_id - first_id + 1)
+    max_pod_id = db.session.query(func.max(Pod.id)).scalar() or 0
+    for first_id in range(1, max_pod_id + 1, chunk_size):
+        last_id = min(first_id + chunk_size - 1, max_pod_id)
+        written = written + rebuild_pods(first_id, last_id)
+        if checkpoint is not None:
+            checkpoint(last_id - first_id + 1)
+    return stamped, written
+
+
+def delete_rollups_chunk(pod_id, chunk_size):
+    """
+    Deletes and commits about chunk_size of the oldest rollup rows of a pod,
+    its members' first
+
+    Returns the number of rows deleted, 0 once the pod has none left
+    """
+    for model in (UserRollup, PodRollup):
+        last_bucket = (
+            db.session.query(model.bucket)
+            .filter(model.pod_id == pod_id)
+            .order_by(model.bucket)
+            .offset(chunk_size - 1)
+            .limit(1)
+            .scalar()
+        )
+        query = model.query.filter(model.pod_id == pod_id)
+        if last_bucket is not None:
+            query = query.filter(model.bucket <= last_bucket)
+        deleted = query.delete(synchronize_session=False)
+        if deleted:
+            db.session.commit()
+            return deleted
+    return 0
+
+
+def delete_rollups(pod_id):
+    """
+    Deletes the remaining rollup rows of a pod; does not commit
+    """
+    UserRollup.query.filter(UserRollup.pod_id == pod_id).delete(synchronize_session=False)
+    PodRollup.query.filter(PodRollup.pod_id == pod_id).delete(synchronize_session=False)
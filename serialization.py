@@ -0,0 +1,88 @@
+"""
+Pluggable JSON encoder for response bodies
+
+The stdlib encoder is the default and produces the exact bytes the API
+has always returned. Setting JSON_ENCODER to "orjson" or "ujson" (or to
+"fast" for whichever of them is installed) swaps in a faster encoder;
+those produce the same JSON values, but without the space after "," and
+":" and with non-ASCII characters left unescaped.
+"""
+
+import json
+
+from flask import current_app, has_app_context
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+DEFAULT_ENCODER = "json"
+
+
+def _stdlib_encode(obj):
+    """
+    Encodes with the stdlib json module
+    """
+    return json.dumps(obj)
+
+
+def _orjson_encode(obj):
+    """
+    Encodes with orjson
+    """
+    return orjson.dumps(obj).decode("utf-8")
+
+
+def _ujson_encode(obj):
+    """
+    Encodes with ujson
+    """
+    return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+
+ENCODERS = {
+    "json": (json, _stdlib_encode),
+    "orjson": (orjson, _orjson_encode),
+    "ujson": (ujson, _ujson_encode),
+}
+# tried in order for "fast"
+FAST_ENCODERS = ["orjson", "ujson", "json"]
+
+
+def get_encoder(name=DEFAULT_ENCODER):
+    """
+    Returns the encode function of the named encoder
+
+    Raises ValueError if the encoder is unknown or not installed
+    """
+    if name == "fast":
+        name = next(n for n in FAST_ENCODERS if ENCODERS[n][0] is not None)
+    if name not in ENCODERS:
+        raise ValueError("Unknown JSON encoder: %s" % name)
+    module, encode = ENCODERS[name]
+    if module is None:
+        raise ValueError("JSON encoder %s is not installed" % name)
+    return encode
+
+
+def init_app(app, name=DEFAULT_ENCODER):
+    """
+    Selects the encoder used by encode() in app's context
+    """
+    app.extensions["json_encoder"] = get_encoder(name)
+
+
+def encode(obj):
+    """
+    Returns obj encoded as a JSON string with the current app's encoder
+    (the stdlib one outside an app context)
+    """
+    if has_app_context():
+        return current_app.extensions["json_encoder"](obj)
+    return _stdlib_encode(obj)
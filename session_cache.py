@@ -0,0 +1,98 @@
+"""
+In-process cache of session tokens
+
+Maps a session token (by its hash, as stored in the sessions table) to the
+id of its user so authenticated requests can be verified without a
+database round-trip. Entries expire at the session's expiration time, or
+after MAX_TTL seconds so that sessions ended by another worker process are
+picked up, and the least recently used entry is evicted once the cache
+holds MAX_SIZE tokens.
+"""
+
+import datetime
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+MAX_SIZE = 10000
+MAX_TTL = 60
+
+
+class SessionCache(object):
+    """
+    LRU + TTL cache of session token -> user id
+    """
+
+    def __init__(self, max_size=MAX_SIZE, max_ttl=MAX_TTL):
+        """
+        Initializes an empty SessionCache
+        """
+        self.max_size = max_size
+        self.max_ttl = datetime.timedelta(seconds=max_ttl)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Makes this the session_cache of app
+        """
+        app.extensions["session_cache"] = self
+
+    def get(self, session_token):
+        """
+        Returns the user id cached for a session token, or None if the token
+        is not cached or its entry has expired
+        """
+        now = datetime.datetime.now()
+        with self._lock:
+            entry = self._entries.get(session_token)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[session_token]
+                self.misses = self.misses + 1
+                return None
+            self._entries.move_to_end(session_token)
+            self.hits = self.hits + 1
+            return entry[0]
+
+    def put(self, session_token, user_id, session_expiration):
+        """
+        Caches the user id of a session token until the session expires
+        """
+        expires_at = min(session_expiration, datetime.datetime.now() + self.max_ttl)
+        with self._lock:
+            self._entries[session_token] = (user_id, expires_at)
+            self._entries.move_to_end(session_token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, session_token):
+        """
+        Removes a session token from the cache
+        """
+        with self._lock:
+            self._entries.pop(session_token, None)
+
+    def clear(self):
+        """
+        Removes every entry and resets the counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and current size of the cache
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+# the SessionCache of the current app (see SessionCache.init_app)
+session_cache = LocalProxy(lambda: current_app.extensions["session_cache"])
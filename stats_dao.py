@@ -0,0 +1,190 @@
+"""
+DAO (Data Access Object) file
+
+Helper file containing aggregate queries for pod and user statistics.
+Counting is done by the database with COUNT/GROUP BY over the indexed
+task columns instead of loading every task into Python.
+
+Pods and users also carry denormalized counters (Pod.total_tasks,
+Pod.completed_tasks, Pod.incomplete_tasks and User.verified_completions)
+that the write paths keep up to date through the record_* functions, in
+the same transaction as the task change. rebuild_counters recomputes them
+from the tasks table.
+"""
+
+from sqlalchemy import func, text
+
+from db import db, Pod, Task, User
+
+
+def pod_leaderboard_query(pod_id, n):
+    """
+    Returns the query of the top n (username, tasks_completed) rows of a pod
+
+    Runs ORDER BY tasks_completed DESC LIMIT n over (podID, tasks_completed).
+    """
+    return (
+        db.session.query(User.username, User.tasks_completed)
+        .filter(User.podID == pod_id)
+        .order_by(User.tasks_completed.desc(), User.id.desc())
+        .limit(n)
+    )
+
+
+def rank_leaderboard(rows):
+    """
+    Returns (username, tasks_completed, rank) for rows of
+    pod_leaderboard_query(); users with the same number of tasks completed
+    share a rank
+    """
+    leaderboard = []
+    for position, (username, tasks_completed) in enumerate(rows, 1):
+        rank = position
+        if leaderboard and leaderboard[-1][1] == tasks_completed:
+            rank = leaderboard[-1][2]
+        leaderboard.append((username, tasks_completed, rank))
+    return leaderboard
+
+
+def record_task_created(pod_id, count=1):
+    """
+    Counts new incomplete tasks towards their pod's counters
+    """
+    Pod.query.filter(Pod.id == pod_id).update(
+        {
+            Pod.total_tasks: Pod.total_tasks + count,
+            Pod.incomplete_tasks: Pod.incomplete_tasks + count,
+        },
+        synchronize_session=False,
+    )
+
+
+def add_status_change(deltas, pod_id, old_status, old_completer_id, new_status, new_completer_id):
+    """
+    Adds the counter changes caused by a task status change to deltas, a
+    ({pod_id: completed delta}, {user_id: verified completions delta}) pair
+    """
+    pod_deltas, user_deltas = deltas
+    if bool(old_status) != bool(new_status):
+        delta = 1 if new_status else -1
+        pod_deltas[pod_id] = pod_deltas.get(pod_id, 0) + delta
+    if old_status and old_completer_id is not None:
+        user_deltas[old_completer_id] = user_deltas.get(old_completer_id, 0) - 1
+    if new_status and new_completer_id is not None:
+        user_deltas[new_completer_id] = user_deltas.get(new_completer_id, 0) + 1
+
+
+def apply_counter_deltas(deltas):
+    """
+    Applies the counter changes collected by add_status_change, with one
+    UPDATE per pod or user whose counters change
+    """
+    pod_deltas, user_deltas = deltas
+    for pod_id, delta in pod_deltas.items():
+        if delta == 0:
+            continue
+        Pod.query.filter(Pod.id == pod_id).update(
+            {
+                Pod.completed_tasks: Pod.completed_tasks + delta,
+                Pod.incomplete_tasks: Pod.incomplete_tasks - delta,
+            },
+            synchronize_session=False,
+        )
+    for user_id, delta in user_deltas.items():
+        if delta == 0:
+            continue
+        User.query.filter(User.id == user_id).update(
+            {User.verified_completions: User.verified_completions + delta},
+            synchronize_session=False,
+        )
+
+
+def record_tasks_deleted(pod_id, last_id=None):
+    """
+    Removes the tasks of a pod with ids up to last_id (all of them if None)
+    that are being deleted from the pod's counters, and the completed ones
+    from their completers' verified completions
+    """
+    query = db.session.query(Task.status, Task.completer_id, func.count(Task.id)).filter(Task.pod_id == pod_id)
+    if last_id is not None:
+        query = query.filter(Task.id <= last_id)
+    completed = 0
+    incomplete = 0
+    for status, completer_id, count in query.group_by(Task.status, Task.completer_id).all():
+        if not status:
+            incomplete = incomplete + count
+            continue
+        completed = completed + count
+        if completer_id is not None:
+            User.query.filter(User.id == completer_id).update(
+                {User.verified_completions: User.verified_completions - count},
+                synchronize_session=False,
+            )
+    if completed or incomplete:
+        Pod.query.filter(Pod.id == pod_id).update(
+            {
+                Pod.total_tasks: Pod.total_tasks - (completed + incomplete),
+                Pod.completed_tasks: Pod.completed_tasks - completed,
+                Pod.incomplete_tasks: Pod.incomplete_tasks - incomplete,
+            },
+            synchronize_session=False,
+        )
+
+
+REBUILD_POD_COUNTERS = text(
+    """
+    UPDATE pod SET
+        total_tasks = (SELECT COUNT(*) FROM tasks WHERE tasks.pod_id = pod.id),
+        completed_tasks = (SELECT COUNT(*) FROM tasks
+                           WHERE tasks.pod_id = pod.id AND tasks.status = :done),
+        incomplete_tasks = (SELECT COUNT(*) FROM tasks
+                            WHERE tasks.pod_id = pod.id AND tasks.status = :not_done)
+    WHERE id BETWEEN :first_id AND :last_id AND (
+          total_tasks != (SELECT COUNT(*) FROM tasks WHERE tasks.pod_id = pod.id)
+       OR completed_tasks != (SELECT COUNT(*) FROM tasks
+                              WHERE tasks.pod_id = pod.id AND tasks.status = :done)
+       OR incomplete_tasks != (SELECT COUNT(*) FROM tasks
+                               WHERE tasks.pod_id = pod.id AND tasks.status = :not_done))
+    """
+)
+
+REBUILD_USER_COUNTERS = text(
+    """
+    UPDATE users SET
+        verified_completions = (SELECT COUNT(*) FROM tasks
+                                WHERE tasks.completer_id = users.id AND tasks.status = :done)
+    WHERE id BETWEEN :first_id AND :last_id
+      AND verified_completions != (SELECT COUNT(*) FROM tasks
+                                   WHERE tasks.completer_id = users.id AND tasks.status = :done)
+    """
+)
+
+
+# upper bound of the id range rebuild_counters covers by default
+MAX_ID = 2 ** 63 - 1
+
+
+def rebuild_counters(connection=None, first_id=1, last_id=MAX_ID):
+    """
+    Recomputes the counters of the pods and users with ids from first_id to
+    last_id (every one by default) from the tasks table
+
+    Runs on the given connection, or on the session and commits.
+    Returns the number of pods and users whose counters had drifted.
+    """
+    executor = connection if connection is not None else db.session
+    params = {"done": True, "not_done": False, "first_id": first_id, "last_id": last_id}
+    pods_fixed = executor.execute(REBUILD_POD_COUNTERS, params).rowcount
+    users_fixed = executor.execute(REBUILD_USER_COUNTERS, params).rowcount
+    if connection is None:
+        db.session.commit()
+    return pods_fixed, users_fixed
+
+
+def max_counter_id():
+    """
+    Returns the largest pod or user id, or 0 if there are none
+    """
+    max_pod_id = db.session.query(func.max(Pod.id)).scalar() or 0
+    max_user_id = db.session.query(func.max(User.id)).scalar() or 0
+    return max(max_pod_id, max_user_id)
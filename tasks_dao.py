@@ -0,0 +1,216 @@
+"""
+DAO (Data Access Object) file
+
+Helper file for creating and updating tasks in batches. A batch is
+validated in one pass, written with executemany statements and committed
+once, so either every item is applied or none are.
+"""
+
+import datetime
+
+from sqlalchemy import func
+
+from db import db, Pod, Task, User
+import events_dao
+import feed
+import rollups_dao
+import stats_dao
+from projections import pod_projections
+
+BATCH_MAX_SIZE = 10000
+
+# number of ids bound per IN (...) clause, below SQLite's variable limit
+IN_CHUNK_SIZE = 500
+
+
+def _chunks(items, size=IN_CHUNK_SIZE):
+    """
+    Yields consecutive slices of items of at most size elements
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _batch_error(items, max_size):
+    """
+    Returns an error message if items is not a usable batch, otherwise None
+    """
+    if not isinstance(items, list) or not items:
+        return "expected a non-empty list"
+    if len(items) > max_size:
+        return "batch is larger than %d items" % max_size
+    return None
+
+
+def validate_descriptions(descriptions, max_size=BATCH_MAX_SIZE):
+    """
+    Returns (error, item_errors) for a batch of task descriptions
+
+    item_errors lists {"index", "error"} for every invalid description
+    """
+    error = _batch_error(descriptions, max_size)
+    if error is not None:
+        return error, []
+    item_errors = []
+    for index, description in enumerate(descriptions):
+        if not isinstance(description, str) or not description:
+            item_errors.append({"index": index, "error": "description must be a non-empty string"})
+    return None, item_errors
+
+
+def task_states(task_ids):
+    """
+    Returns {task_id: [pod_id, status, completer_id, completed_at]} of the
+    tasks that exist, read with one query per IN_CHUNK_SIZE ids
+    """
+    states = {}
+    for chunk in _chunks(sorted(task_ids)):
+        rows = (
+            db.session.query(Task.id, Task.pod_id, Task.status, Task.completer_id, Task.completed_at)
+            .filter(Task.id.in_(chunk))
+            .all()
+        )
+        for task_id, pod_id, status, completer_id, completed_at in rows:
+            states[task_id] = [pod_id, status, completer_id, completed_at]
+    return states
+
+
+def validate_updates(updates, max_size=BATCH_MAX_SIZE):
+    """
+    Returns (error, item_errors, states) for a batch of {task_id, done} updates
+
+    states is the task_states() of every referenced task
+    """
+    error = _batch_error(updates, max_size)
+    if error is not None:
+        return error, [], {}
+    item_errors = []
+    task_ids = set()
+    for index, update in enumerate(updates):
+        if not isinstance(update, dict):
+            item_errors.append({"index": index, "error": "update must be an object"})
+        elif isinstance(update.get("task_id"), bool) or not isinstance(update.get("task_id"), int):
+            item_errors.append({"index": index, "error": "task not specified"})
+        elif not isinstance(update.get("done"), bool):
+            item_errors.append({"index": index, "error": "done must be true or false"})
+        else:
+            task_ids.add(update["task_id"])
+    states = task_states(task_ids)
+    for index, update in enumerate(updates):
+        if isinstance(update, dict) and update.get("task_id") in task_ids and update["task_id"] not in states:
+            item_errors.append({"index": index, "error": "task not found"})
+    item_errors.sort(key=lambda e: e["index"])
+    return None, item_errors, states
+
+
+def create_tasks(user, descriptions):
+    """
+    Creates a task in the user's pod for every description and commits once
+
+    Returns the ids of the new tasks, in the order of descriptions
+    """
+    now = datetime.datetime.now()
+    rows = [
+        {
+            "description": description,
+            "status": False,
+            "pod_id": user.podID,
+            "creator_id": user.id,
+            "completer_id": None,
+            "created_at": now,
+            "completed_at": None,
+        }
+        for description in descriptions
+    ]
+    # ids already taken; every row inserted after this has a larger one
+    last_id = db.session.query(func.max(Task.id)).scalar() or 0
+    db.session.execute(Task.__table__.insert(), rows)
+    # the rows of this batch are the ones after last_id with its creator and
+    # timestamp, and ids are given in insert order
+    ids = [
+        task_id
+        for task_id, in db.session.query(Task.id)
+        .filter(Task.id > last_id, Task.creator_id == user.id, Task.created_at == now)
+        .order_by(Task.id)
+    ]
+    stats_dao.record_task_created(user.podID, len(descriptions))
+    Pod.bump_version(user.podID)
+    rollups_dao.record_created(user.podID, user.id, now, len(descriptions))
+    pod_id = user.podID
+    for chunk in _chunks(ids):
+        events_dao.record_task_events(pod_id, events_dao.TASK_CREATED, chunk)
+    db.session.commit()
+    feed.notifier.notify(pod_id)
+    return ids
+
+
+def update_tasks(user, updates, states):
+    """
+    Applies a validated batch of {task_id, done} updates made by user and
+    commits once
+
+    Returns the final {"task_id", "done"} of every updated task
+    """
+    return apply_updates([(update["task_id"], update["done"], user.id) for update in updates], states)
+
+
+def apply_updates(updates, states=None):
+    """
+    Applies (task_id, done, user_id) status updates in order and commits
+    once
+
+    The writes are coalesced: one UPDATE per task, per pod (counters,
+    version, rollup buckets) and per user (tasks_completed is incremented
+    in SQL, so concurrent updates are not lost). Updates of tasks missing
+    from states (read with task_states() by default) are skipped. Returns
+    the final {"task_id", "done"} of every updated task
+    """
+    if states is None:
+        states = task_states({task_id for task_id, _, _ in updates})
+    now = datetime.datetime.now()
+    deltas = ({}, {})
+    rollup_deltas = rollups_dao.new_deltas()
+    mappings = {}
+    user_updates = {}
+    for task_id, done, user_id in updates:
+        if task_id not in states:
+            continue
+        pod_id, status, completer_id, completed_at = states[task_id]
+        stats_dao.add_status_change(deltas, pod_id, status, completer_id, done, user_id)
+        new_completed_at = rollups_dao.completed_at_after(status, completer_id, completed_at, done, user_id, now)
+        rollups_dao.add_status_change(rollup_deltas, pod_id, status, completer_id, completed_at,
+                                      done, user_id, new_completed_at)
+        states[task_id] = [pod_id, done, user_id, new_completed_at]
+        mappings[task_id] = {"id": task_id, "status": done, "completer_id": user_id,
+                             "completed_at": new_completed_at}
+        user_updates[user_id] = user_updates.get(user_id, 0) + 1
+    if not mappings:
+        return []
+    db.session.bulk_update_mappings(Task, list(mappings.values()))
+    stats_dao.apply_counter_deltas(deltas)
+    pod_task_ids = {}
+    for task_id in mappings:
+        pod_task_ids.setdefault(states[task_id][0], []).append(task_id)
+    for pod_id, task_ids in pod_task_ids.items():
+        Pod.bump_version(pod_id)
+        for chunk in _chunks(sorted(task_ids)):
+            events_dao.record_task_events(pod_id, events_dao.TASK_UPDATED, chunk)
+    rollups_dao.apply_deltas(rollup_deltas)
+    for user_id, count in user_updates.items():
+        User.query.filter(User.id == user_id).update(
+            {User.tasks_completed: User.tasks_completed + count},
+            synchronize_session=False,
+        )
+    # {pod_id: {user_id: updates}} of the pods the updating users are members of
+    member_updates = {}
+    for chunk in _chunks(sorted(user_updates)):
+        for user_id, pod_id in db.session.query(User.id, User.podID).filter(User.id.in_(chunk)):
+            if pod_id is not None:
+                member_updates.setdefault(pod_id, {})[user_id] = user_updates[user_id]
+    members_versions = {pod_id: Pod.bump_members_version(pod_id) for pod_id in member_updates}
+    db.session.commit()
+    for pod_id, counts in member_updates.items():
+        pod_projections.add_tasks_completed_by(pod_id, members_versions[pod_id], counts)
+    for updated_pod_id in pod_task_ids:
+        feed.notifier.notify(updated_pod_id)
+    return [{"task_id": m["id"], "done": m["status"]} for m in mappings.values()]
@@ -0,0 +1,153 @@
+"""
+Task routes: creating, reading and updating tasks, one or a batch at a time
+"""
+
+import json
+
+from flask import Blueprint, current_app, request
+
+from db import db, Pod, Task, User
+import events_dao
+import feed
+import http_cache
+from instrumentation import dumps
+import rollups_dao
+import stats_dao
+import tasks_dao
+import write_buffer
+from write_buffer import task_writes
+
+blueprint = Blueprint("tasks", __name__)
+
+
+@blueprint.errorhandler(write_buffer.FlushTimeout)
+def flush_timeout(e):
+    """
+    Sheds a task update whose flush did not finish in time; the update may
+    still be written later
+    """
+    return dumps({"error": "Server busy, try again shortly"}), 503, {"Retry-After": "1"}
+
+
+@blueprint.route("/api/task/<int:user_id>/", methods = ["POST"])
+def create_task(user_id):
+    """
+    Endpoint for creating a task
+    request:
+    description
+    """
+    user=User.query.filter_by(id=user_id).first()
+    if user is None:
+        return dumps({"error": "user not found"}), 404
+    body=json.loads(request.data)
+    description=body.get("description")
+    if description is None:
+        return dumps({"error": "task description field not supplied"}), 400
+    new_task=Task(description=description, pod_id=user.podID, creator_id=user.id)
+    db.session.add(new_task)
+    stats_dao.record_task_created(new_task.pod_id)
+    Pod.bump_version(new_task.pod_id)
+    db.session.flush()
+    task_pod_id = new_task.pod_id
+    rollups_dao.record_created(task_pod_id, user.id, new_task.created_at)
+    events_dao.record_task_events(task_pod_id, events_dao.TASK_CREATED, [new_task.id])
+    db.session.commit()
+    feed.notifier.notify(task_pod_id)
+    if new_task is None:
+        return dumps({"error": "new task is null."}), 400
+    return dumps(new_task.serialize()), 201
+
+@blueprint.route("/api/task/<int:task_id>/")
+def get_task_by_id(task_id):
+    """
+    Endpoing for getting a task by ID
+    """
+    row = (
+        db.session.query(Task.pod_id, Pod.version)
+        .join(Pod, Pod.id == Task.pod_id)
+        .filter(Task.id == task_id)
+        .first()
+    )
+    if row is None:
+        return dumps({"error": "task not found"}), 404
+
+    def build():
+        task=Task.query.options(*Task.serialize_options()).filter_by(id=task_id).first()
+        return task.serialize()
+
+    key = ("task", task_id, row.pod_id, row.version)
+    return http_cache.cached_json(key, build, 201)
+
+@blueprint.route("/api/task/update/<int:user_id>/", methods = ["POST"])
+def update_task(user_id):
+    """
+    Endpoint for updating a task's status
+    request:
+    status
+    """
+    body=json.loads(request.data)
+    if body.get("task_id") is None:
+        return dumps({"error": "task not specified"}), 400
+    task=Task.query.filter_by(id=body.get("task_id")).first()
+    if task is None:
+        return dumps({"error":"task not found"}), 404
+    user=User.query.filter_by(id=user_id).first()
+    if user is None:
+        return dumps({"error": "user not found"}), 404
+    status=body.get("done")
+    if status is None:
+        return dumps({"error":"incomplete request"}), 400
+    if not isinstance(status, bool):
+        return dumps({"error": "done must be true or false"}), 400
+    task_id, user_id = task.id, user.id
+    # end the read transaction: in sync mode the flusher commits the update
+    db.session.rollback()
+    task_writes.update(task_id, status, user_id)
+    if task_writes.mode == write_buffer.ASYNC:
+        return dumps({"task_id": task_id, "done": status}), 202
+    task=Task.query.options(*Task.serialize_options()).filter_by(id=task_id).first()
+    if task is None:
+        return dumps({"error":"task not found"}), 404
+    return dumps(task.serialize()), 201
+
+@blueprint.route("/api/task/batch/<int:user_id>/", methods = ["POST"])
+def create_tasks(user_id):
+    """
+    Endpoint for creating many tasks in the user's pod at once
+    request:
+    descriptions (list of task descriptions)
+    """
+    user=User.query.filter_by(id=user_id).first()
+    if user is None:
+        return dumps({"error": "user not found"}), 404
+    if user.podID is None:
+        return dumps({"error": "user is not in a pod"}), 400
+    body=json.loads(request.data)
+    descriptions=body.get("descriptions")
+    error, item_errors = tasks_dao.validate_descriptions(descriptions, current_app.config["BATCH_MAX_SIZE"])
+    if error is not None:
+        return dumps({"error": "descriptions: " + error}), 400
+    if item_errors:
+        return dumps({"error": "invalid tasks", "items": item_errors}), 400
+    ids = tasks_dao.create_tasks(user, descriptions)
+    return dumps({"created": len(ids), "ids": ids}), 201
+
+@blueprint.route("/api/task/batch/update/<int:user_id>/", methods = ["POST"])
+def update_tasks(user_id):
+    """
+    Endpoint for updating the status of many tasks at once
+    request:
+    updates (list of {task_id, done})
+    """
+    user=User.query.filter_by(id=user_id).first()
+    if user is None:
+        return dumps({"error": "user not found"}), 404
+    body=json.loads(request.data)
+    updates=body.get("updates")
+    error, item_errors, states = tasks_dao.validate_updates(updates, current_app.config["BATCH_MAX_SIZE"])
+    if error is not None:
+        return dumps({"error": "updates: " + error}), 400
+    if item_errors:
+        return dumps({"error": "invalid updates", "items": item_errors}), 400
+    results = tasks_dao.update_tasks(user, updates, states)
+    return dumps({"updated": len(results), "tasks": results}), 201
@@ -0,0 +1,72 @@
+"""
+Fixtures: an app on a fresh SQLite database per test, and a pod to work on
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from app import create_app  # noqa: E402
+from db import db  # noqa: E402
+import migrations  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    Returns an app with its schema set up; jobs only run when a test runs them
+    """
+
+    class TestConfig(config.Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = "sqlite:///%s" % (tmp_path / "test.db")
+        # readers keep their snapshot while another connection commits
+        SQLITE_PRAGMAS = {"journal_mode": "WAL", "busy_timeout": 5000}
+        BCRYPT_ROUNDS = 4
+        JOB_WORKERS = 0
+        RATE_LIMIT_ENABLED = False
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        migrations.migrate()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    """
+    Returns a test client of the app
+    """
+    return app.test_client()
+
+
+def post(client, url, body):
+    """
+    Posts body as JSON and returns (status code, decoded response)
+    """
+    response = client.post(url, data=json.dumps(body))
+    return response.status_code, json.loads(response.data)
+
+
+@pytest.fixture
+def pod(client):
+    """
+    Creates users 1 (the leader) and 2 in pod 1, and tasks 1 to 3; returns
+    the pod id
+    """
+    for username in ("a", "b"):
+        assert post(client, "/api/user/", {"username": username, "password": "p"})[0] == 201
+    status, created = post(client, "/api/pod/1/", {"name": "P", "description": "D"})
+    assert status == 201
+    assert post(client, "/api/user/2/", {"join_code": created["join_code"]})[0] == 200
+    for i in range(3):
+        assert post(client, "/api/task/1/", {"description": "t%d" % i})[0] == 201
+    return created["id"]
@@ -0,0 +1,21 @@
+"""
+Tests of the request rate limits
+"""
+
+import admission
+
+
+def test_rejected_request_keeps_earlier_tokens():
+    """
+    A request one bucket rejects takes no token from the buckets before it
+    """
+    # the user bucket admits 3 requests, the ip bucket only 1, and neither refills
+    limiter = admission.RateLimiter({"tasks.update_task": [("user", 1e-9, 3), ("ip", 1e-9, 1)]})
+    assert limiter.check("tasks.update_task", {"user": 1, "ip": "a"}) == 0
+    for _ in range(5):
+        assert limiter.check("tasks.update_task", {"user": 1, "ip": "a"}) > 0
+    # the rejections took nothing from the user's bucket
+    assert limiter.check("tasks.update_task", {"user": 1, "ip": "b"}) == 0
+    assert limiter.check("tasks.update_task", {"user": 1, "ip": "c"}) == 0
+    assert limiter.check("tasks.update_task", {"user": 1, "ip": "d"}) > 0
+    assert limiter.stats()["allowed"] == 3
@@ -0,0 +1,49 @@
+"""
+Tests of the pod projections against concurrent member writes
+"""
+
+from sqlalchemy import event, text
+
+from db import db, Pod, User
+import projections
+from projections import pod_projections
+
+
+def test_member_write_committed_during_load_is_applied_once(app, pod):
+    """
+    A member write that commits while a projection is being loaded must
+    not be counted twice once its change is applied to the projection
+    """
+    with app.app_context():
+        engine = db.engine
+        committed = []
+        armed = [True]
+
+        def commit_member_write(conn, cursor, statement, parameters, context, executemany):
+            # runs right after the load's first read of members_version
+            if not armed[0] or "members_version" not in statement:
+                return
+            armed[0] = False
+            with engine.begin() as other:
+                other.execute(text("UPDATE users SET tasks_completed = tasks_completed + 1 WHERE id = 2"))
+                other.execute(text("UPDATE pod SET members_version = members_version + 1 WHERE id = :id"),
+                              {"id": pod})
+                committed.append(other.execute(
+                    text("SELECT members_version FROM pod WHERE id = :id"), {"id": pod}).scalar())
+
+        pod_projections.discard(pod)
+        event.listen(engine, "after_cursor_execute", commit_member_write)
+        try:
+            projection = projections.load(pod)
+        finally:
+            event.remove(engine, "after_cursor_execute", commit_member_write)
+        assert committed
+        pod_projections.put(projection)
+        # what the writer does once its transaction has committed
+        pod_projections.add_tasks_completed_by(pod, committed[0], {2: 1})
+
+        db.session.rollback()
+        assert db.session.query(Pod.members_version).filter(Pod.id == pod).scalar() == committed[0]
+        expected = db.session.query(User.tasks_completed).filter(User.id == 2).scalar()
+        leaderboard = dict((username, count) for username, count, _ in projections.leaderboard(pod, 10))
+        assert leaderboard["b"] == expected == 1
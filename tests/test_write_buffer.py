@@ -0,0 +1,26 @@
+"""
+Tests of task status updates through the write-behind buffer
+"""
+
+import json
+
+import write_buffer
+
+
+def test_flush_timeout_is_answered_503(app, client, pod, monkeypatch):
+    """
+    A sync update whose flush misses its deadline is shed with 503 and
+    Retry-After, like the other overloaded writes
+    """
+    task_writes = app.extensions["task_writes"]
+    task_writes.configure(write_buffer.SYNC)
+    monkeypatch.setattr(write_buffer, "FLUSH_TIMEOUT", 0.1)
+    task_writes._start()
+    # a flush still running keeps the flusher from starting the next one
+    with task_writes._flush_lock:
+        response = client.post("/api/task/update/2/", data=json.dumps({"task_id": 1, "done": True}))
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert json.loads(response.data) == {"error": "Server busy, try again shortly"}
+    task_writes.flush()
+    assert task_writes.stats()["pending"] == 0
@@ -2,74 +2,188 @@
 DAO (Data Access Object) file
 
 Helper file containing functions for accessing data in our database
+
+Sessions live in their own table, one row per signed-in device, holding
+SHA-256 hashes of the session and update tokens under unique indexes, so
+a token is checked with a single index probe however many sessions there
+are. Rows whose update token can no longer renew them are deleted in
+batches by the sweep_sessions job.
 """
 
+import datetime
+
 from db import User
+from db import Pod
+from db import UserSession
 from db import db
+import events_dao
+import feed
+from passwords import password_hasher
+from projections import pod_projections
+from session_cache import session_cache
 
+SESSION_LIFETIME = datetime.timedelta(days=1)
+# how long after a session expires its update token can still renew it
+RENEW_WINDOW = datetime.timedelta(days=30)
+# seconds between runs of the sweep_sessions job
+SWEEP_INTERVAL = 3600
 
-def get_user_by_email(email):
+
+def get_user_by_username(username):
     """
-    Returns a user object from the database given an email
+    Returns a user object from the database given a username
     """
-    return User.query.filter(User.email == email).first()
+    return User.query.filter(User.username == username).first()
 
 
-def get_user_by_session_token(session_token):
+def get_user_id_by_session_token(session_token):
     """
-    Returns a user object from the database given a session token
+    Returns the id of the user owning a valid session token, or None
+
+    Reads through the session cache so repeated checks of the same token
+    do not touch the database
+    """
+    token_hash = UserSession.hash_token(session_token)
+    user_id = session_cache.get(token_hash)
+    if user_id is not None:
+        return user_id
+    row = (
+        db.session.query(UserSession.user_id, UserSession.expires_at)
+        .filter(UserSession.token_hash == token_hash)
+        .first()
+    )
+    if row is None or row.expires_at <= datetime.datetime.now():
+        return None
+    session_cache.put(token_hash, row.user_id, row.expires_at)
+    return row.user_id
+
+
+def create_session(user_id, lifetime=SESSION_LIFETIME, renew_window=RENEW_WINDOW):
+    """
+    Signs a user in on a new device
+
+    Returns the UserSession, carrying its session and update tokens
     """
-    return User.query.filter(User.session_token == session_token).first()
+    session = UserSession(user_id=user_id)
+    session.renew(lifetime, renew_window)
+    db.session.add(session)
+    db.session.commit()
+    return session
 
 
-def get_user_by_update_token(update_token):
+def end_session(session_token):
     """
-    Returns a user object from the database given an update token
+    Deletes the session of a token and removes it from the session cache
+
+    Returns if the token belonged to a valid session
     """
-    return User.query.filter(User.update_token == update_token).first()
+    token_hash = UserSession.hash_token(session_token)
+    session_cache.invalidate(token_hash)
+    session = UserSession.query.filter(UserSession.token_hash == token_hash).first()
+    if session is None:
+        return False
+    was_valid = datetime.datetime.now() < session.expires_at
+    db.session.delete(session)
+    db.session.commit()
+    return was_valid
 
 
-def verify_credentials(email, password):
+def verify_credentials(username, password):
     """
     Returns true if the credentials match, otherwise returns false
+
+    Stores a fresh hash of the password if the stored one was made with a
+    different work factor
     """
-    optional_user  = get_user_by_email(email)
+    optional_user  = get_user_by_username(username)
 
     if optional_user is None:
-        return False, None
+        return password_hasher.verify_dummy(password), None
     
-    return optional_user.verify_password(password),optional_user
+    if not optional_user.verify_password(password):
+        return False, optional_user
+
+    if password_hasher.needs_rehash(optional_user.password):
+        optional_user.password = password_hasher.hash(password)
+        pod_id = optional_user.podID
+        if pod_id is not None:
+            # the member list returns password hashes
+            Pod.bump_members_version(pod_id)
+        db.session.commit()
+        if pod_id is not None:
+            pod_projections.discard(pod_id)
+    return True, optional_user
 
 
-def create_user(email, password):
+def create_user(username, password, leader=False):
     """
     Creates a User object in the database
 
     Returns if creation was successful, and the User object
     """
-    optional_user = get_user_by_email(email)
+    optional_user = get_user_by_username(username)
     if optional_user is not None:
         return False, optional_user
     
-    user = User(email = email, password = password)
+    user = User(username = username, password = password, leader = leader)
     db.session.add(user)
     db.session.commit()
     return True, user
 
 
 
-def renew_session(update_token):
+def renew_session(update_token, lifetime=SESSION_LIFETIME, renew_window=RENEW_WINDOW):
     """
-    Renews a user's session token
+    Replaces both tokens of the session an update token belongs to
     
-    Returns the User object
+    Returns the UserSession, carrying its new tokens
     """
-    user = get_user_by_update_token(update_token)
+    session = UserSession.query.filter(
+        UserSession.update_token_hash == UserSession.hash_token(update_token)
+    ).first()
 
-    if user is None:
+    if session is None or session.renew_until <= datetime.datetime.now():
         raise Exception("Invalid update token")
     
-    user.renew_session()
+    session_cache.invalidate(session.token_hash)
+    session.renew(lifetime, renew_window)
     db.session.commit()
-    return user
-    
+    return session
+
+
+def sweep_sessions(batch_size):
+    """
+    Deletes and commits up to batch_size sessions that can no longer be
+    renewed
+
+    Returns the number of sessions deleted, 0 once there are none left
+    """
+    swept = (
+        db.session.query(UserSession.id)
+        .filter(UserSession.renew_until <= datetime.datetime.now())
+        .limit(batch_size)
+    )
+    deleted = UserSession.query.filter(UserSession.id.in_(swept.statement)).delete(
+        synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def remove_from_pod(user_id, pod_id):
+    """
+    Takes a user out of a pod and resets their tasks completed
+
+    Returns false if the user is no longer in that pod
+    """
+    user = User.query.filter(User.id == user_id, User.podID == pod_id).first()
+    if user is None:
+        return False
+    user.podID = None
+    user.tasks_completed = 0
+    Pod.bump_version(pod_id)
+    events_dao.record_member_event(pod_id, events_dao.MEMBER_LEFT, user)
+    members_version = Pod.bump_members_version(pod_id)
+    db.session.commit()
+    pod_projections.remove_member(pod_id, members_version, user_id)
+    feed.notifier.notify(pod_id)
+    return True
@@ -0,0 +1,167 @@
+"""
+User routes: accounts, pod membership and per-user analytics
+"""
+
+import json
+
+from flask import Blueprint, current_app, request
+
+from db import db, User, Pod
+import events_dao
+import feed
+import http_cache
+from instrumentation import dumps
+from jobs import job_queue
+from main_routes import job_accepted
+import pagination
+import pods_dao
+import projections
+from projections import pod_projections
+import rollups_dao
+
+blueprint = Blueprint("users", __name__)
+
+
+@blueprint.route("/api/user/")
+def get_all_users():
+    """
+    Endpoint for getting all users, a page at a time
+    request args:
+    limit
+    cursor
+    """
+    try:
+        limit, cursor = pagination.page_args(request.args)
+    except ValueError as e:
+        return dumps({"error": str(e)}), 400
+    users, next_cursor = pagination.keyset_page(User.row_query(), User.id, limit, cursor)
+    return dumps({"users": [User.serialize_row(u) for u in users], "next_cursor": next_cursor}),200
+
+
+@blueprint.route("/api/user/<int:user_id>/")
+def get_user(user_id):
+    """
+    Endpoint for getting user by id
+    """
+    user = User.query.options(*User.serialize_options()).filter_by(id=user_id).first()
+    if user is None:
+        return dumps({"error": "user not found"}),404
+    pod_version = user.pod.version if user.pod is not None else None
+    key = ("user", user.id, user.username, user.password, user.tasks_completed,
+           user.leader, user.podID, pod_version)
+    return http_cache.cached_json(key, user.serialize)
+
+
+@blueprint.route("/api/user/", methods = ["POST"])
+def create_user():
+    """
+    Endpoint for creating new user
+    """
+    body = json.loads(request.data)
+    new_username = body.get("username")
+    new_password = body.get("password")
+    if not new_username:
+        return dumps({"error": "username field not supplied."}), 400
+    if not new_password:
+        return dumps({"error": "password field not supplied."}), 400
+    if not isinstance(new_password, str):
+        return dumps({"error": "password must be a string."}), 400
+    new_user = User(username = new_username, password = new_password,leader=0,tasks_completed = 0)
+    db.session.add(new_user)
+    db.session.commit()
+    return dumps(new_user.serialize()),201
+
+
+@blueprint.route("/api/user/<int:user_id>/", methods = ["POST"])
+def join_pod(user_id):
+    """
+    Endpoint for a User to join a Pod, using pod id and a join code.
+    request:
+    user_id
+    join_code
+    """
+    user = User.query.filter_by(id = user_id).first()
+    if user is None:
+        return dumps({"error": "user is null"}), 404
+    if user.podID != None:
+        return dumps({"error": "user is already in pod"}), 404
+    body = json.loads(request.data)
+    join_code=body.get("join_code")
+    pod = pods_dao.get_pod_by_join_code(join_code)
+    if pod is None:
+        return dumps({"error": "no pod with that join code."}), 404
+    member = projections.Member.of(user)
+    user.podID=pod.id
+    Pod.bump_version(pod.id)
+    events_dao.record_member_event(pod.id, events_dao.MEMBER_JOINED, user)
+    members_version = Pod.bump_members_version(pod.id)
+    db.session.commit()
+    pod_projections.add_member(pod.id, members_version, member)
+    feed.notifier.notify(pod.id)
+    return dumps(user.serialize()), 200
+
+
+@blueprint.route("/api/user/taskscompleted/<int:user_id>/")
+def user_tasks_completed(user_id):
+    user = User.query.filter_by(id=user_id).first()
+    if user is None:
+        return dumps({"error": "user not found"}), 404
+    tasks_completed = user.verified_completions
+    return dumps({"tasks completed by user": tasks_completed}), 201
+
+
+@blueprint.route("/api/user/<int:user_id>/analytics/")
+def user_analytics(user_id):
+    """
+    Endpoint for the tasks a user created and completed per hour or day
+    request args:
+    period (hour or day)
+    start, end (ISO dates or times; default: the last buckets buckets)
+    buckets
+    """
+    try:
+        period, start, end = rollups_dao.window_args(request.args, current_app.config["ANALYTICS_MAX_BUCKETS"])
+    except ValueError as e:
+        return dumps({"error": str(e)}), 400
+    if db.session.query(User.id).filter(User.id == user_id).first() is None:
+        return dumps({"error": "user not found"}), 404
+    buckets = rollups_dao.user_trend(user_id, period, start, end)
+    return dumps(trend_body(period, start, end, buckets)), 200
+
+
+def trend_body(period, start, end, buckets):
+    """
+    Returns the response body of a trend over the given buckets
+    """
+    return {
+        "period": period,
+        "start": str(start),
+        "end": str(end),
+        "created": sum(b["created"] for b in buckets),
+        "completed": sum(b["completed"] for b in buckets),
+        "buckets": buckets,
+    }
+
+
+@blueprint.route("/api/user/<int:user_id>/delete/",methods = ["DELETE"])
+def delete_user_from_pod(user_id):
+    """
+    Endpoint for deleting a user from pod by id
+    """
+    body = json.loads(request.data)
+    userDeleting = User.query.filter_by(id = user_id).first()
+    if userDeleting is None:
+        return dumps({"error": "user_id is null"}), 404
+    userToDelete = User.query.filter_by(id = body.get("user_to_delete")).first()
+    if userToDelete is None:
+        return dumps({"error": "user_to_delete is null"}), 404
+    podOfDeleter = Pod.query.filter_by(id=userDeleting.podID).first()
+    podOfDeleting = Pod.query.filter_by(id=userToDelete.podID).first()
+    if (podOfDeleting or podOfDeleter) is None:
+        return dumps({"error": "one of pods is not found."}), 404
+    if podOfDeleting.id != podOfDeleter.id:
+        return dumps({"error": "not allowed"}), 400
+    if userDeleting.leader == True:
+        job = job_queue.enqueue("remove_user", pod_id=podOfDeleting.id, user_id=userToDelete.id)
+        return job_accepted(job)
+    return dumps(userToDelete.serialize()), 200
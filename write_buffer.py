@@ -0,0 +1,245 @@
+"""
+Write-behind buffer for task status updates
+
+update_task hands its status update to task_writes instead of writing it
+itself. A flusher thread collects the updates that arrive within WINDOW
+seconds of the first one (or until MAX_UPDATES are waiting) and applies
+them with tasks_dao.apply_updates in one transaction: the counters,
+version, rollups and events of each pod and the tasks_completed of each
+user are written once per flush, as SQL increments, instead of once per
+update. A burst of toggles then takes SQLite's write lock once.
+
+MODE sets what a request waits for:
+- "sync": the flush of its update (group commit), so it is answered as
+  before, once the update is committed;
+- "async": nothing; it is answered 202 once the update is queued. A
+  queued update is lost if the process dies before the flush, and reads
+  do not show it until then;
+- "off": no buffering, every request commits its own update.
+
+With FLUSH_ON_SHUTDOWN the updates still queued are flushed when the
+interpreter exits normally (atexit), as on a graceful worker shutdown.
+Flushes run one at a time, so updates are applied in the order they were
+queued. Each app has its own buffer, and in each process its own flusher
+thread, started by its first update.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from db import db
+import tasks_dao
+
+OFF = "off"
+SYNC = "sync"
+ASYNC = "async"
+MODES = (OFF, SYNC, ASYNC)
+
+MODE = SYNC
+# seconds the flusher waits for more updates after the first one
+WINDOW = 0.005
+MAX_UPDATES = 1000
+FLUSH_ON_SHUTDOWN = True
+# seconds a sync request waits for its flush before giving up
+FLUSH_TIMEOUT = 30
+
+log = logging.getLogger("poductivity.write_buffer")
+
+
+class FlushTimeout(Exception):
+    """
+    Raised when an update queued in sync mode was not flushed in time
+    """
+
+
+class _Batch(object):
+    """
+    Updates flushed together, and the outcome their requests wait for
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty _Batch
+        """
+        self.updates = []
+        self.flushed = threading.Event()
+        # position in updates -> error that update failed with
+        self.errors = {}
+
+
+class WriteBuffer(object):
+    """
+    Coalesces task status updates into one transaction per window
+    """
+
+    def __init__(self, mode=MODE, window=WINDOW, max_updates=MAX_UPDATES, flush_on_shutdown=FLUSH_ON_SHUTDOWN):
+        """
+        Initializes a WriteBuffer; its flusher is started on first use
+        """
+        self.app = None
+        self.submitted = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.failed = 0
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._batch = _Batch()
+        self._atexit = False
+        self.configure(mode, window, max_updates, flush_on_shutdown)
+
+    def configure(self, mode=MODE, window=WINDOW, max_updates=MAX_UPDATES, flush_on_shutdown=FLUSH_ON_SHUTDOWN):
+        """
+        Sets the durability mode, the window and the shutdown behaviour
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown task write mode: %s" % mode)
+        self.mode = mode
+        self.window = window
+        self.max_updates = max_updates
+        self.flush_on_shutdown = flush_on_shutdown
+
+    def init_app(self, app):
+        """
+        Makes this the task_writes of app: updates are flushed in app's
+        context, and when the process exits
+        """
+        self.app = app
+        app.extensions["task_writes"] = self
+        if not self._atexit:
+            atexit.register(self._shutdown)
+            self._atexit = True
+
+    def _start(self):
+        """
+        Starts the flusher thread unless this process already runs it
+        """
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # updates inherited from the parent are the parent's to flush
+            self._condition = threading.Condition()
+            self._flush_lock = threading.Lock()
+            self._batch = _Batch()
+            threading.Thread(target=self._run, name="poductivity-task-writes", daemon=True).start()
+            self._pid = os.getpid()
+
+    def update(self, task_id, done, user_id):
+        """
+        Applies a task status update made by a user, as the mode says
+
+        Raises the flush's error, or FlushTimeout, in sync mode
+        """
+        if self.mode == OFF or self.app is None:
+            tasks_dao.apply_updates([(task_id, done, user_id)])
+            return
+        batch, position = self.submit(task_id, done, user_id)
+        if self.mode == SYNC:
+            if not batch.flushed.wait(FLUSH_TIMEOUT):
+                raise FlushTimeout("Task update was not written in %d seconds" % FLUSH_TIMEOUT)
+            if position in batch.errors:
+                raise batch.errors[position]
+
+    def submit(self, task_id, done, user_id):
+        """
+        Queues a task status update; returns the batch it will be flushed
+        with and its position there
+        """
+        self._start()
+        with self._condition:
+            batch = self._batch
+            position = len(batch.updates)
+            batch.updates.append((task_id, done, user_id))
+            self.submitted = self.submitted + 1
+            if position == 0 or position + 1 >= self.max_updates:
+                self._condition.notify()
+        return batch, position
+
+    def _run(self):
+        """
+        Flushes the queued updates once the window of the first has passed
+        """
+        while True:
+            with self._condition:
+                while not self._batch.updates:
+                    self._condition.wait()
+                deadline = time.monotonic() + self.window
+                while len(self._batch.updates) < self.max_updates:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Task write flusher error")
+
+    def _apply(self, updates):
+        """
+        Applies and commits updates in one transaction
+        """
+        with self.app.app_context():
+            try:
+                tasks_dao.apply_updates(updates)
+            except Exception:
+                db.session.rollback()
+                raise
+        self.flushes = self.flushes + 1
+        self.flushed = self.flushed + len(updates)
+
+    def flush(self):
+        """
+        Applies and commits every queued update now
+
+        If the batch fails as a whole its updates are retried one at a
+        time, so only the updates that fail on their own are reported
+        """
+        with self._flush_lock:
+            with self._condition:
+                batch = self._batch
+                self._batch = _Batch()
+            if not batch.updates:
+                return
+            try:
+                self._apply(batch.updates)
+            except Exception as e:
+                log.exception("Flushing %d task updates failed", len(batch.updates))
+                if len(batch.updates) == 1:
+                    batch.errors[0] = e
+                else:
+                    for position, update in enumerate(batch.updates):
+                        try:
+                            self._apply([update])
+                        except Exception as error:
+                            batch.errors[position] = error
+                            log.exception("Task update %r failed", update)
+                self.failed = self.failed + len(batch.errors)
+            finally:
+                batch.flushed.set()
+
+    def _shutdown(self):
+        """
+        Flushes the queued updates at exit if configured to
+        """
+        if self.flush_on_shutdown and self._pid == os.getpid() and self.app is not None:
+            self.flush()
+
+    def stats(self):
+        """
+        Returns the update and flush counters of this process
+        """
+        return {"submitted": self.submitted, "flushes": self.flushes, "flushed": self.flushed,
+                "failed": self.failed, "pending": len(self._batch.updates)}
+
+
+# the WriteBuffer of the current app (see WriteBuffer.init_app)
+task_writes = LocalProxy(lambda: current_app.extensions["task_writes"])